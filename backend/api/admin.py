@@ -0,0 +1,31 @@
+import asyncio
+
+import structlog
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+from ..middleware.auth import verify_api_key
+from ..services import profiler as profiler_service
+
+logger = structlog.get_logger(__name__)
+
+router = APIRouter()
+
+
+@router.post("/admin/profile")
+async def profile(request: Request, seconds: float = 10.0) -> PlainTextResponse:
+  if not profiler_service.PROFILING_ENABLED:
+    raise HTTPException(status_code=404, detail="Not Found")
+  verify_api_key(request)
+  if seconds <= 0 or seconds > profiler_service.MAX_PROFILE_SECONDS:
+    raise HTTPException(status_code=400, detail="Invalid profile duration")
+
+  logger.info("profile capture started", seconds=seconds)
+  try:
+    stacks = await asyncio.to_thread(profiler_service.profiler.capture, seconds)
+  except profiler_service.ProfilerBusyError as exc:
+    raise HTTPException(status_code=409, detail="Profile already running") from exc
+  return PlainTextResponse(
+    stacks,
+    headers={"Content-Disposition": "attachment; filename=profile.collapsed"},
+  )
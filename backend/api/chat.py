@@ -1,4 +1,5 @@
 import json
+import time
 import structlog
 from typing import Literal
 
@@ -8,13 +9,15 @@ from prometheus_client import Counter, Histogram
 from pydantic import BaseModel, field_validator
 
 from ..middleware.auth import verify_api_key
-from ..services.openai_client import client
+from ..services.admission import chat_limit
+from ..services.openai_client import get_client
 from ..utils.sanitization import sanitize_string, DISALLOWED_PATTERNS
 from ..utils.validation import (
   MAX_REQUEST_SIZE,
   MAX_FIELD_LENGTH,
   MAX_HISTORY_MESSAGES,
 )
+from ..utils.timing import StageTimer
 
 logger = structlog.get_logger(__name__)
 
@@ -23,6 +26,18 @@ CHAT_REQUESTS = Counter("chat_requests_total", "Number of chat requests")
 CHAT_LATENCY = Histogram(
   "chat_request_duration_seconds", "Latency of chat requests"
 )
+CHAT_STAGE_LATENCY = Histogram(
+  "chat_stage_duration_seconds",
+  "Latency of individual chat pipeline stages",
+  ["stage", "model", "outcome"],
+)
+CHAT_TOKENS = Counter(
+  "chat_openai_tokens_total",
+  "OpenAI tokens consumed by chat requests",
+  ["model", "kind"],
+)
+
+CHAT_MODEL = "gpt-4o"
 
 
 class Message(BaseModel):
@@ -150,11 +165,45 @@ TOOLS = [
 router = APIRouter()
 
 
+def _record_usage(response) -> None:
+  usage = getattr(response, "usage", None)
+  if usage is None:
+    return
+  for kind in ("prompt", "completion"):
+    tokens = getattr(usage, f"{kind}_tokens", None)
+    if tokens:
+      CHAT_TOKENS.labels(model=CHAT_MODEL, kind=kind).inc(tokens)
+
+
 @router.post("/api/chat", response_model=ChatResponse)
 async def chat(chat_request: ChatRequest, request: Request) -> ChatResponse:
   verify_api_key(request)
   CHAT_REQUESTS.inc()
-  with CHAT_LATENCY.time():
+  chat_limit.acquire()
+  timer = StageTimer()
+  outcome = "error"
+  started = time.monotonic()
+  try:
+    with CHAT_LATENCY.time():
+      response = await _chat(chat_request, timer)
+    outcome = "success"
+    return response
+  except HTTPException as exc:
+    outcome = "rejected" if exc.status_code < 500 else "error"
+    raise
+  finally:
+    chat_limit.release(time.monotonic() - started, failed=outcome == "error")
+    timer.observe(CHAT_STAGE_LATENCY, model=CHAT_MODEL, outcome=outcome)
+    logger.info(
+      "chat timings",
+      model=CHAT_MODEL,
+      outcome=outcome,
+      timings_ms=timer.as_ms(),
+    )
+
+
+async def _chat(chat_request: ChatRequest, timer: StageTimer) -> JSONResponse:
+  with timer.stage("validation"):
     trimmed = chat_request.messages[-MAX_HISTORY_MESSAGES:]
     payload = {"messages": [m.model_dump() for m in trimmed]}
     if len(json.dumps(payload).encode("utf-8")) > MAX_REQUEST_SIZE:
@@ -167,6 +216,7 @@ async def chat(chat_request: ChatRequest, request: Request) -> ChatResponse:
         if pattern.search(msg.content):
           raise HTTPException(status_code=400, detail="Invalid content")
 
+  with timer.stage("sanitization"):
     user_messages = [
       {"role": msg.role, "content": sanitize_string(msg.content)}
       for msg in trimmed
@@ -176,14 +226,17 @@ async def chat(chat_request: ChatRequest, request: Request) -> ChatResponse:
       *user_messages,
     ]
 
-    try:
-      response = await client.chat.completions.create(
-        model="gpt-4o",
+  try:
+    with timer.stage("openai"):
+      response = await get_client().chat.completions.create(
+        model=CHAT_MODEL,
         messages=openai_messages,
         temperature=0.7,
         tools=TOOLS,
         tool_choice="auto",
       )
+    _record_usage(response)
+    with timer.stage("tool_parsing"):
       msg = response.choices[0].message
       upserts: list[Upsert] = []
       for call in getattr(msg, "tool_calls", []) or []:
@@ -207,6 +260,7 @@ async def chat(chat_request: ChatRequest, request: Request) -> ChatResponse:
             error=str(exc),
             fields=list(raw.keys()),
           )
+    with timer.stage("response"):
       assistant_message = {
         "role": "assistant",
         "content": sanitize_string(msg.content or ""),
@@ -214,8 +268,8 @@ async def chat(chat_request: ChatRequest, request: Request) -> ChatResponse:
       full_messages = [Message(**m) for m in user_messages + [assistant_message]]
       result = ChatResponse(messages=full_messages, upserts=upserts)
       return JSONResponse(content=result.model_dump(exclude_none=True))
-    except HTTPException:
-      raise
-    except Exception as e:
-      logger.exception("chat endpoint failed", exc_info=e)
-      raise HTTPException(status_code=500, detail="Internal server error") from e
+  except HTTPException:
+    raise
+  except Exception as e:
+    logger.exception("chat endpoint failed", exc_info=e)
+    raise HTTPException(status_code=500, detail="Internal server error") from e
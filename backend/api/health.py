@@ -2,7 +2,8 @@ import structlog
 from fastapi import APIRouter
 from fastapi.responses import JSONResponse
 
-from ..middleware.rate_limit import redis_client
+from ..middleware.rate_limit import record_pool_usage, redis_client
+from ..services.warmup import is_ready
 
 logger = structlog.get_logger(__name__)
 
@@ -14,6 +15,13 @@ def health() -> dict[str, str]:
   return {"status": "ok"}
 
 
+@router.get("/ready")
+def ready():
+  if not is_ready():
+    return JSONResponse(status_code=503, content={"status": "warming"})
+  return {"status": "ready"}
+
+
 @router.get("/redis/health")
 async def redis_health():
   try:
@@ -22,3 +30,5 @@ async def redis_health():
   except Exception as exc:
     logger.warning("Redis health check failed", error=str(exc))
     return JSONResponse(status_code=503, content={"status": "unavailable", "detail": "Redis unavailable"})
+  finally:
+    record_pool_usage(redis_client)
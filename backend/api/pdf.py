@@ -1,14 +1,35 @@
+import asyncio
+import io
 import json
+import os
+import time
+import zipfile
+from typing import Awaitable, TypeVar
+
+import structlog
 from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import StreamingResponse
-from jsonschema import ValidationError, validate, FormatChecker
+from fastapi.responses import JSONResponse, Response
 from prometheus_client import Counter, Histogram
+from starlette.types import Receive, Scope, Send
 
-from ..middleware.auth import verify_api_key
+from ..middleware.auth import get_client_ip, verify_api_key
+from ..middleware.disconnect import wait_for_disconnect
 from ..middleware.rate_limit import rate_limit
-from ..services.pdf_service import generate_pdf
-from ..utils.validation import MAX_REQUEST_SIZE, MAX_FIELD_LENGTH, PETITION_SCHEMA
-from ..worker import queue
+from ..services.admission import Overloaded
+from ..services.job_store import jobs
+from ..services.pdf_service import generate_pdf, get_cached_packet, packet_key
+from ..utils.validation import (
+  MAX_BATCH_OUTPUT_BYTES,
+  MAX_BATCH_PETITIONS,
+  MAX_FIELD_LENGTH,
+  MAX_REQUEST_SIZE,
+  petition_validator,
+)
+from ..worker import PRIORITY_LOW, PRIORITY_NORMAL, SingleFlight, queue, shutdown_error
+
+logger = structlog.get_logger(__name__)
+
+T = TypeVar("T")
 
 router = APIRouter()
 
@@ -17,32 +38,328 @@ PDF_REQUESTS = Counter("pdf_requests_total", "Number of PDF requests")
 PDF_LATENCY = Histogram(
   "pdf_request_duration_seconds", "Latency of PDF requests"
 )
+PDF_QUEUE_REJECTIONS = Counter(
+  "pdf_queue_rejections_total",
+  "PDF requests refused by the worker queue, by reason",
+  ["county", "reason"],
+)
+PDF_COALESCED = Counter(
+  "pdf_coalesced_requests_total",
+  "PDF requests that joined an identical render already in flight",
+  ["county"],
+)
+
+PDF_BATCH_ITEMS = Counter(
+  "pdf_batch_items_total",
+  "Petitions processed through the batch endpoint",
+  ["outcome"],
+)
+
+renders = SingleFlight()
+
+PDF_JOB_TIMEOUT = float(os.getenv("PDF_JOB_TIMEOUT", "30"))
+PDF_SEND_CHUNK_BYTES = int(os.getenv("PDF_SEND_CHUNK_BYTES", str(1024 * 1024)))
+
+
+def _validate_petition(data: dict) -> None:
+  if not isinstance(data, dict):
+    raise HTTPException(status_code=400, detail="Invalid request body")
+
+  if len(json.dumps(data).encode("utf-8")) > MAX_REQUEST_SIZE:
+    raise HTTPException(status_code=413, detail="Request too large")
+
+  if any(isinstance(v, str) and len(v) > MAX_FIELD_LENGTH for v in data.values()):
+    raise HTTPException(status_code=413, detail="Field too large")
+
+  if not petition_validator().is_valid(data):
+    raise HTTPException(status_code=400, detail="Invalid petition data")
+
+
+def _rejection_reason(exc: HTTPException) -> str:
+  if isinstance(exc, Overloaded):
+    return "shed"
+  if queue.closing:
+    return "shutdown"
+  return "queue_full"
+
+
+async def _render(
+  data: dict,
+  client: str,
+  priority: int = PRIORITY_NORMAL,
+  wait_for_slot: bool = False,
+  deadline: float | None = None,
+) -> bytes:
+  key = packet_key(data)
+  cached = get_cached_packet(data, key)
+  if cached is not None:
+    return cached
+
+  county = data.get("county", "General")
+  # Only callers that would queue the render the same way share it, so a
+  # background job never inherits an interactive caller's "Queue full".
+  flight = (key, priority, wait_for_slot)
+  if renders.in_flight(flight):
+    PDF_COALESCED.labels(county=county).inc()
+  enqueue = queue.submit if wait_for_slot else queue.enqueue
+
+  async def start() -> asyncio.Future:
+    try:
+      return await enqueue(
+        generate_pdf,
+        data,
+        key=key,
+        client=client,
+        priority=priority,
+        deadline=deadline,
+        enqueued_at=time.perf_counter(),
+      )
+    except HTTPException as exc:
+      if exc.status_code == 503:
+        PDF_QUEUE_REJECTIONS.labels(county=county, reason=_rejection_reason(exc)).inc()
+      raise
+
+  # The packet is immutable bytes, so coalesced callers share it as is.
+  return await renders.run(flight, start)
+
+
+async def _until_disconnected(
+  request: Request, awaitable: Awaitable[T], deadline: float | None = None
+) -> T:
+  task = asyncio.ensure_future(awaitable)
+  disconnect = asyncio.ensure_future(wait_for_disconnect(request))
+  try:
+    timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+    done, _ = await asyncio.wait(
+      {task, disconnect}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+    )
+    if task in done:
+      return task.result()
+    if disconnect in done:
+      logger.info("pdf client disconnected")
+      raise HTTPException(status_code=499, detail="Client closed request")
+    raise HTTPException(status_code=504, detail="PDF generation timed out")
+  finally:
+    disconnect.cancel()
+    # Cancelling the waiter releases its share of the render; the worker
+    # drops or stops the job once nobody is waiting for it.
+    if not task.done():
+      task.cancel()
+
+
+class PacketResponse(Response):
+  """A finished zip archive, sent with Content-Length in fixed-size slices."""
+
+  media_type = "application/zip"
+
+  def __init__(
+    self, packet: bytes, filename: str, chunk_size: int | None = None
+  ) -> None:
+    self.chunk_size = PDF_SEND_CHUNK_BYTES if chunk_size is None else chunk_size
+    super().__init__(
+      packet, headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+  async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+    await send(
+      {
+        "type": "http.response.start",
+        "status": self.status_code,
+        "headers": self.raw_headers,
+      }
+    )
+    size = len(self.body)
+    if size <= self.chunk_size:
+      await send({"type": "http.response.body", "body": self.body})
+      return
+    # Each slice is copied because the middleware stack only forwards bytes.
+    view = memoryview(self.body)
+    for start in range(0, size, self.chunk_size):
+      end = start + self.chunk_size
+      await send(
+        {
+          "type": "http.response.body",
+          "body": bytes(view[start:end]),
+          "more_body": end < size,
+        }
+      )
+
+
+def _zip_response(packet: bytes) -> PacketResponse:
+  return PacketResponse(packet, "po_packet.zip")
 
 
 @router.post("/api/pdf")
 @rate_limit(limit=5, window=60, key="pdf")
-async def pdf(data: dict, request: Request) -> StreamingResponse:
+async def pdf(data: dict, request: Request) -> PacketResponse:
   verify_api_key(request)
   PDF_REQUESTS.inc()
   with PDF_LATENCY.time():
-    if not isinstance(data, dict):
-      raise HTTPException(status_code=400, detail="Invalid request body")
+    _validate_petition(data)
+    deadline = time.monotonic() + PDF_JOB_TIMEOUT
+    packet = await _until_disconnected(
+      request,
+      _render(data, get_client_ip(request), deadline=deadline),
+      deadline,
+    )
+    return _zip_response(packet)
 
-    if len(json.dumps(data).encode("utf-8")) > MAX_REQUEST_SIZE:
-      raise HTTPException(status_code=413, detail="Request too large")
 
-    if any(isinstance(v, str) and len(v) > MAX_FIELD_LENGTH for v in data.values()):
-      raise HTTPException(status_code=413, detail="Field too large")
+_job_tasks: dict[str, asyncio.Task] = {}
 
-    try:
-      validate(instance=data, schema=PETITION_SCHEMA, format_checker=FormatChecker())
-    except ValidationError as exc:
-      raise HTTPException(status_code=400, detail="Invalid petition data") from exc
-
-    future = await queue.enqueue(generate_pdf, data)
-    zip_bytes = await future
-    return StreamingResponse(
-      zip_bytes,
-      media_type="application/zip",
-      headers={"Content-Disposition": "attachment; filename=po_packet.zip"},
+
+async def _run_job(job_id: str, data: dict, client: str) -> None:
+  try:
+    packet = await _render(data, client, PRIORITY_LOW, wait_for_slot=True)
+  except HTTPException as exc:
+    jobs.fail(job_id, exc.status_code, exc.detail)
+  except Exception:
+    logger.exception("pdf job failed")
+    jobs.fail(job_id, 500, "Failed to generate PDF")
+  else:
+    jobs.complete(job_id, packet)
+
+
+def abandon_jobs() -> None:
+  """Fail every unfinished job with 503 and stop its render."""
+  error = shutdown_error()
+  for job_id, task in list(_job_tasks.items()):
+    jobs.fail(job_id, error.status_code, error.detail)
+    task.cancel()
+
+
+@router.post("/api/pdf/jobs", status_code=202)
+@rate_limit(limit=5, window=60, key="pdf")
+async def create_pdf_job(data: dict, request: Request) -> JSONResponse:
+  verify_api_key(request)
+  jobs.require_single_process()
+  PDF_REQUESTS.inc()
+  _validate_petition(data)
+
+  if queue.closing:
+    raise shutdown_error()
+
+  job = jobs.create()
+  task = asyncio.create_task(_run_job(job.job_id, data, get_client_ip(request)))
+  _job_tasks[job.job_id] = task
+  task.add_done_callback(lambda _: _job_tasks.pop(job.job_id, None))
+  status_url = f"/api/pdf/jobs/{job.job_id}"
+  return JSONResponse(
+    status_code=202,
+    content={"job_id": job.job_id, "status": job.status, "status_url": status_url},
+    headers={"Location": status_url},
+  )
+
+
+@router.get("/api/pdf/jobs/{job_id}")
+async def get_pdf_job(job_id: str, request: Request) -> Response:
+  verify_api_key(request)
+  jobs.require_single_process()
+  job = jobs.get(job_id)
+  if job is None:
+    raise HTTPException(status_code=404, detail="Job not found")
+  if job.status == "pending":
+    return JSONResponse(
+      status_code=202,
+      content={"job_id": job.job_id, "status": job.status},
+      headers={"Retry-After": "1"},
+    )
+  if job.status == "failed":
+    return JSONResponse(
+      content={
+        "job_id": job.job_id,
+        "status": job.status,
+        "error_status": job.error_status,
+        "detail": job.error,
+      }
+    )
+  return _zip_response(job.result)
+
+
+async def _render_batch_item(
+  index: int, item: dict, client: str
+) -> tuple[dict, bytes | None]:
+  entry: dict = {"index": index}
+  try:
+    _validate_petition(item)
+    packet = await _render(item, client, PRIORITY_LOW, wait_for_slot=True)
+  except HTTPException as exc:
+    entry.update(status="error", status_code=exc.status_code, detail=exc.detail)
+    return entry, None
+  except Exception:
+    logger.exception("batch item failed", index=index)
+    entry.update(status="error", status_code=500, detail="Failed to generate PDF")
+    return entry, None
+  with zipfile.ZipFile(io.BytesIO(packet)) as zf:
+    return entry, zf.read("petition.pdf")
+
+
+def _too_large(entry: dict) -> tuple[dict, None]:
+  entry.update(status="error", status_code=413, detail="Batch output too large")
+  return entry, None
+
+
+async def _render_batch(petitions: list, client: str) -> list[tuple[dict, bytes | None]]:
+  """Render items in parallel; past the output cap, the rest are cancelled as 413."""
+  pending = {
+    asyncio.ensure_future(_render_batch_item(i, item, client))
+    for i, item in enumerate(petitions)
+  }
+  results: list[tuple[dict, bytes | None] | None] = [None] * len(petitions)
+  total = 0
+  full = False
+  try:
+    while pending and not full:
+      done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+      for task in done:
+        entry, pdf_bytes = task.result()
+        if pdf_bytes is not None and total + len(pdf_bytes) > MAX_BATCH_OUTPUT_BYTES:
+          full = True
+          results[entry["index"]] = _too_large(entry)
+        else:
+          total += len(pdf_bytes or b"")
+          results[entry["index"]] = (entry, pdf_bytes)
+  finally:
+    for task in pending:
+      task.cancel()
+  return [
+    result if result is not None else _too_large({"index": index})
+    for index, result in enumerate(results)
+  ]
+
+
+def _build_batch_zip(results: list[tuple[dict, bytes | None]]) -> tuple[bytes, list[dict]]:
+  manifest: list[dict] = []
+  batch_zip = io.BytesIO()
+  with zipfile.ZipFile(batch_zip, "w") as zf:
+    for entry, pdf_bytes in results:
+      if pdf_bytes is not None:
+        name = f"petition_{entry['index'] + 1:02d}.pdf"
+        zf.writestr(name, pdf_bytes)
+        entry.update(status="ok", file=name)
+      PDF_BATCH_ITEMS.labels(outcome=entry["status"]).inc()
+      manifest.append(entry)
+    zf.writestr("manifest.json", json.dumps(manifest, indent=2))
+  return batch_zip.getvalue(), manifest
+
+
+@router.post("/api/pdf/batch")
+@rate_limit(limit=2, window=60, key="pdf-batch")
+async def pdf_batch(data: dict, request: Request) -> Response:
+  verify_api_key(request)
+  petitions = data.get("petitions") if isinstance(data, dict) else None
+  if not isinstance(petitions, list) or not petitions:
+    raise HTTPException(status_code=400, detail="Invalid request body")
+  if len(petitions) > MAX_BATCH_PETITIONS:
+    raise HTTPException(status_code=413, detail="Too many petitions")
+  PDF_REQUESTS.inc(len(petitions))
+  client = get_client_ip(request)
+
+  results = await _until_disconnected(request, _render_batch(petitions, client))
+  batch_zip, manifest = await asyncio.to_thread(_build_batch_zip, results)
+  if not any(entry["status"] == "ok" for entry in manifest):
+    return JSONResponse(
+      status_code=422,
+      content={"detail": "No petitions could be generated", "items": manifest},
     )
+  return PacketResponse(batch_zip, "po_packets.zip")
@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from .harness import run, summarize
+
+ROOT = Path(__file__).resolve().parents[2]
+API_KEY = "bench-key"
+# Redis is pointed at a closed port so the server runs on its in-memory
+# fallback limiter, as it would before Redis is reachable.
+ENV = {
+  **os.environ,
+  "OPENAI_API_KEY": "test",
+  "CHAT_API_KEY": API_KEY,
+  "REDIS_URL": "redis://127.0.0.1:1/0",
+}
+PETITION = {
+  "county": "General",
+  "petitioner_full_name": "Jane Q. Doe",
+  "respondent_full_name": "John R. Roe",
+}
+IMPORT_SNIPPET = (
+  "import time; start = time.perf_counter(); import backend.main; "
+  "print(time.perf_counter() - start)"
+)
+
+
+def _import_time(env: dict[str, str] | None = None) -> float:
+  out = subprocess.run(
+    [sys.executable, "-c", IMPORT_SNIPPET],
+    cwd=ROOT,
+    env={**ENV, **(env or {})},
+    capture_output=True,
+    text=True,
+    check=True,
+  )
+  return float(out.stdout.strip().splitlines()[-1])
+
+
+def _free_port() -> int:
+  with socket.socket() as sock:
+    sock.bind(("127.0.0.1", 0))
+    return sock.getsockname()[1]
+
+
+async def _first_responses() -> tuple[float, float]:
+  """Start a server and time its first 200 from /health and from /api/pdf."""
+  port = _free_port()
+  started = time.perf_counter()
+  proc = subprocess.Popen(
+    [
+      sys.executable, "-m", "uvicorn", "backend.main:app",
+      "--port", str(port), "--log-level", "error",
+    ],
+    cwd=ROOT,
+    env=ENV,
+    stdout=subprocess.DEVNULL,
+    stderr=subprocess.DEVNULL,
+  )
+  try:
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as client:
+      while True:
+        if proc.poll() is not None:
+          raise RuntimeError("server exited during startup")
+        try:
+          if (await client.get("/health")).status_code == 200:
+            break
+        except httpx.TransportError:
+          pass
+        await asyncio.sleep(0.005)
+      health = time.perf_counter() - started
+      resp = await client.post(
+        "/api/pdf", json=PETITION, headers={"X-API-Key": API_KEY}, timeout=30
+      )
+      resp.raise_for_status()
+      pdf = time.perf_counter() - started
+  finally:
+    proc.terminate()
+    proc.wait(timeout=30)
+  return health, pdf
+
+
+async def _bench_import(runs: int) -> dict[str, dict]:
+  return {"cold_start[import]": summarize([_import_time() for _ in range(runs)])}
+
+
+async def _bench_import_no_bytecode(runs: int) -> dict[str, dict]:
+  # An empty bytecode cache and no .pyc writes make every run compile from
+  # source, which is what an image without precompiled bytecode pays.
+  samples = []
+  for _ in range(runs):
+    with tempfile.TemporaryDirectory() as prefix:
+      samples.append(
+        _import_time({"PYTHONPYCACHEPREFIX": prefix, "PYTHONDONTWRITEBYTECODE": "1"})
+      )
+  return {"cold_start[import_no_bytecode]": summarize(samples)}
+
+
+async def _bench_first_200(runs: int) -> dict[str, dict]:
+  health, pdf = [], []
+  for _ in range(runs):
+    first_health, first_pdf = await _first_responses()
+    health.append(first_health)
+    pdf.append(first_pdf)
+  return {
+    "cold_start[first_200_health]": summarize(health),
+    "cold_start[first_200_pdf]": summarize(pdf),
+  }
+
+
+SUITES = {
+  "import": _bench_import,
+  "import_no_bytecode": _bench_import_no_bytecode,
+  "first_200": _bench_first_200,
+}
+
+
+async def main(args: argparse.Namespace) -> dict[str, dict]:
+  runs = max(1, int(5 * args.scale))
+  results: dict[str, dict] = {}
+  for name, suite in SUITES.items():
+    if args.only and args.only not in name:
+      continue
+    results.update(await suite(runs))
+  return results
+
+
+if __name__ == "__main__":
+  run(main, "Measure import time and time to first 200 for a fresh server")
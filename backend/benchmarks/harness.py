@@ -0,0 +1,114 @@
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+THRESHOLDS_PATH = Path(__file__).resolve().parent / "thresholds.json"
+
+
+def summarize(samples: list[float]) -> dict[str, float]:
+  ordered = sorted(samples)
+  p95_index = max(0, int(round(len(ordered) * 0.95)) - 1)
+  return {
+    "iterations": len(ordered),
+    "min_ms": round(ordered[0] * 1000, 4),
+    "median_ms": round(statistics.median(ordered) * 1000, 4),
+    "mean_ms": round(statistics.fmean(ordered) * 1000, 4),
+    "p95_ms": round(ordered[p95_index] * 1000, 4),
+  }
+
+
+def measure(func: Callable[[], Any], iterations: int, warmup: int = 3) -> dict[str, float]:
+  for _ in range(warmup):
+    func()
+  samples: list[float] = []
+  for _ in range(iterations):
+    start = time.perf_counter()
+    func()
+    samples.append(time.perf_counter() - start)
+  return summarize(samples)
+
+
+async def measure_async(
+  func: Callable[[], Awaitable[Any]], iterations: int, warmup: int = 3
+) -> dict[str, float]:
+  for _ in range(warmup):
+    await func()
+  samples: list[float] = []
+  for _ in range(iterations):
+    start = time.perf_counter()
+    await func()
+    samples.append(time.perf_counter() - start)
+  return summarize(samples)
+
+
+def load_thresholds(path: Path | None) -> dict[str, float]:
+  path = path or THRESHOLDS_PATH
+  if not path.exists():
+    return {}
+  with open(path) as f:
+    return json.load(f)
+
+
+def find_regressions(
+  results: dict[str, dict[str, float]], thresholds: dict[str, float]
+) -> list[dict[str, Any]]:
+  regressions: list[dict[str, Any]] = []
+  for name, limit in thresholds.items():
+    result = results.get(name)
+    if result is None:
+      continue
+    if result["median_ms"] > limit:
+      regressions.append(
+        {"benchmark": name, "median_ms": result["median_ms"], "threshold_ms": limit}
+      )
+  return regressions
+
+
+def build_parser(description: str) -> argparse.ArgumentParser:
+  parser = argparse.ArgumentParser(description=description)
+  parser.add_argument("--output", type=Path, help="write JSON results to this file")
+  parser.add_argument("--thresholds", type=Path, help="JSON file of median_ms limits")
+  parser.add_argument("--only", help="run only suites whose name contains this")
+  parser.add_argument(
+    "--scale", type=float, default=1.0, help="multiply iteration counts"
+  )
+  return parser
+
+
+def report(
+  results: dict[str, dict[str, Any]], args: argparse.Namespace
+) -> int:
+  regressions = find_regressions(results, load_thresholds(args.thresholds))
+  payload = {
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "benchmarks": results,
+    "regressions": regressions,
+  }
+  text = json.dumps(payload, indent=2)
+  if args.output:
+    args.output.write_text(text + "\n")
+  print(text)
+  return 1 if regressions else 0
+
+
+def run(
+  main: Callable[[argparse.Namespace], Awaitable[dict]],
+  description: str,
+  configure: Callable[[argparse.ArgumentParser], None] | None = None,
+) -> None:
+  parser = build_parser(description)
+  if configure is not None:
+    configure(parser)
+  args = parser.parse_args()
+  # Keep request and PyPDF2 logs out of stdout so the JSON report stays parseable.
+  logging.getLogger().setLevel(logging.ERROR)
+  results = asyncio.run(main(args))
+  sys.exit(report(results, args))
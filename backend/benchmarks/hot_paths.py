@@ -0,0 +1,330 @@
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("CHAT_API_KEY", "bench-key")
+
+import argparse
+import asyncio
+import io
+import itertools
+import tempfile
+from pathlib import Path
+
+import httpx
+from fakeredis import aioredis as fake_aioredis
+from jsonschema import FormatChecker, validate
+from openai.resources.chat.completions import AsyncCompletions
+from starlette.responses import StreamingResponse
+
+from .harness import measure, measure_async, run
+from ..api.pdf import PacketResponse
+from ..main import create_app
+from ..middleware.rate_limit import HybridRateLimiter, InMemoryRateLimiter, RedisRateLimiter
+from ..services import pdf_service
+from ..services.pdf_incremental import load_template
+from ..services.pdf_service import _fill_fields, _form_values, _generate_pdf_sync
+from ..services.template_service import index_fields
+from ..utils.sanitization import sanitize_string
+from ..utils.validation import PETITION_SCHEMA
+
+COUNTIES = ["Harris", "Dallas", "Travis", "General"]
+
+PETITION = {
+  "county": "General",
+  "case_no": "2024-CV-00123",
+  "hearing_date": "2024-01-01",
+  "petitioner_full_name": "Jane Q. Doe",
+  "petitioner_address": "1234 Main Street, Apt 5B, Houston, TX 77002",
+  "petitioner_phone": "555-867-5309",
+  "petitioner_email": "jane@example.com",
+  "respondent_full_name": "John R. Doe",
+  "firearm_surrender": True,
+}
+
+SANITIZE_INPUTS = {
+  "name": "Jane Q. Doe",
+  "address": "1234 Main Street, Apt 5B\nHouston, TX 77002",
+  "markup": "<b>He said</b> <script>alert(1)</script> he would <i>come back</i>",
+  "narrative": (
+    "On the evening of March 3rd he showed up at my workplace and followed me "
+    "to my car. I am afraid for my safety and the safety of my children. "
+  ) * 6,
+}
+
+
+def _large_form(directory: Path, pages: int) -> Path:
+  """A form with one field per FIELD_MAP entry and ``pages`` pages of text."""
+  from PyPDF2 import PdfWriter
+  from PyPDF2.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    NameObject,
+    NumberObject,
+    TextStringObject,
+  )
+
+  writer = PdfWriter()
+  text = b"BT /F1 10 Tf 72 720 Td (Protective order instructions) Tj ET\n" * 800
+  for _ in range(pages):
+    page = writer.add_blank_page(width=612, height=792)
+    content = DecodedStreamObject()
+    content.set_data(text)
+    page[NameObject("/Contents")] = writer._add_object(content)
+  fields = ArrayObject()
+  for index, name in enumerate(_form_values(PETITION)):
+    fields.append(writer._add_object(DictionaryObject({
+      NameObject("/T"): TextStringObject(name),
+      NameObject("/FT"): NameObject("/Tx"),
+      NameObject("/Type"): NameObject("/Annot"),
+      NameObject("/Subtype"): NameObject("/Widget"),
+      NameObject("/Rect"): ArrayObject(
+        [NumberObject(n) for n in (50, 700 - 30 * index, 300, 720 - 30 * index)]
+      ),
+    })))
+  writer.pages[0][NameObject("/Annots")] = ArrayObject(fields)
+  writer._root_object[NameObject("/AcroForm")] = writer._add_object(
+    DictionaryObject({NameObject("/Fields"): fields})
+  )
+  path = directory / f"form_{pages}.pdf"
+  with open(path, "wb") as f:
+    writer.write(f)
+  return path
+
+
+def _rewrite_fill(path: Path, values: dict[str, str], index=None) -> bytes:
+  """Fill by copying every page; without ``index``, scan each page's widgets."""
+  from PyPDF2 import PdfReader, PdfWriter
+
+  with open(path, "rb") as f:
+    reader = PdfReader(f)
+    writer = PdfWriter()
+    for page in reader.pages:
+      writer.add_page(page)
+    if index is None:
+      for page in writer.pages:
+        writer.update_page_form_field_values(page, values)
+    else:
+      _fill_fields(writer, index, values)
+    out = io.BytesIO()
+    writer.write(out)
+  return out.getvalue()
+
+
+async def _bench_pdf(scale: float) -> dict[str, dict]:
+  from PyPDF2 import PdfReader
+
+  results = {}
+  for mode in ("rewrite", "incremental"):
+    pdf_service.PDF_RENDER_MODE = mode
+    prefix = "" if mode == "rewrite" else "incremental,"
+    for county in COUNTIES:
+      data = {**PETITION, "county": county}
+      results[f"pdf_render[{prefix}{county}]"] = measure(
+        lambda: _generate_pdf_sync(data), int(30 * scale)
+      )
+  pdf_service.PDF_RENDER_MODE = "rewrite"
+
+  # The bundled templates are tiny; larger synthetic forms show how each
+  # mode scales with document size.
+  values = _form_values(PETITION)
+  with tempfile.TemporaryDirectory() as directory:
+    for pages in (1, 40):
+      path = _large_form(Path(directory), pages)
+      template = load_template(path)
+      with open(path, "rb") as f:
+        index = index_fields(PdfReader(f), path.name)
+      results[f"pdf_fill[rewrite_scan,{pages}_pages]"] = measure(
+        lambda: _rewrite_fill(path, values), int(10 * scale)
+      )
+      results[f"pdf_fill[rewrite,{pages}_pages]"] = measure(
+        lambda: _rewrite_fill(path, values, index), int(10 * scale)
+      )
+      results[f"pdf_fill[incremental,{pages}_pages]"] = measure(
+        lambda: template.data + template.update(values), int(100 * scale)
+      )
+  return results
+
+
+async def _deliver(response) -> int:
+  """Run a response as an ASGI app and return how many messages it sent."""
+  sends = 0
+
+  async def receive():
+    await asyncio.Future()
+
+  async def send(message):
+    nonlocal sends
+    sends += 1
+
+  await response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+  return sends
+
+
+async def _bench_pdf_response(scale: float) -> dict[str, dict]:
+  # Packets from the bundled templates are a few KB; real county forms and
+  # batch archives run from hundreds of KB to several MB. Random bytes stand
+  # in for compressed PDF content.
+  packets = {
+    "rendered": _generate_pdf_sync(PETITION),
+    "256KiB": os.urandom(256 * 1024),
+    "4MiB": os.urandom(4 * 1024 * 1024),
+  }
+  builders = {
+    "bytesio_stream": lambda packet: StreamingResponse(
+      io.BytesIO(packet), media_type="application/zip"
+    ),
+    "packet": lambda packet: PacketResponse(packet, "po_packet.zip"),
+  }
+  results = {}
+  for size, packet in packets.items():
+    iterations = int((5 if len(packet) > 1024 * 1024 else 100) * scale)
+    for kind, build in builders.items():
+      result = await measure_async(lambda: _deliver(build(packet)), iterations)
+      result["send_calls"] = await _deliver(build(packet))
+      results[f"pdf_response[{kind},{size}]"] = result
+  return results
+
+
+async def _bench_sanitize(scale: float) -> dict[str, dict]:
+  return {
+    f"sanitize_string[{name}]": measure(lambda: sanitize_string(value), int(2000 * scale))
+    for name, value in SANITIZE_INPUTS.items()
+  }
+
+
+async def _bench_memory_limiter(scale: float) -> dict[str, dict]:
+  results = {}
+  for ip_count in (10, 1_000, 10_000):
+    limiter = InMemoryRateLimiter(100, 60, 300, ip_count)
+    addresses = [f"10.{i // 65536}.{i // 256 % 256}.{i % 256}" for i in range(ip_count)]
+    # Seed the store directly; recording 10k IPs one by one is itself O(n^2).
+    for ip in addresses:
+      limiter._store[ip] = {"0.0": 0.0}
+    ips = itertools.cycle(addresses)
+    clock = itertools.count(1)
+
+    async def record():
+      await limiter.record_request(next(ips), next(clock) * 0.0001)
+
+    iterations = int((200 if ip_count >= 10_000 else 1000) * scale)
+    results[f"memory_limiter[{ip_count}]"] = await measure_async(record, iterations)
+  return results
+
+
+async def _bench_redis_limiter(scale: float) -> dict[str, dict]:
+  client = fake_aioredis.FakeRedis(decode_responses=True)
+  limiter = RedisRateLimiter(client, 100, 60, 300, 1000)
+  ips = itertools.cycle([f"10.0.0.{i}" for i in range(250)])
+  clock = itertools.count(1)
+
+  async def record():
+    await limiter.record_request(next(ips), next(clock) * 0.0001)
+
+  results = {"redis_limiter[fakeredis]": await measure_async(record, int(1000 * scale))}
+
+  counter = RedisRateLimiter(client, 100, 60, 300, 1000, algorithm="counter")
+
+  async def record_counter():
+    await counter.record_request(next(ips), next(clock) * 0.0001)
+
+  results["redis_limiter[fakeredis,counter]"] = await measure_async(
+    record_counter, int(1000 * scale)
+  )
+
+  hybrid = HybridRateLimiter(client, 100, 60, 300, 1000)
+
+  async def record_hybrid():
+    await hybrid.record_request(next(ips), next(clock) * 0.0001)
+
+  # Decisions only; the background sync is not on the request path.
+  results["hybrid_limiter[fakeredis]"] = await measure_async(
+    record_hybrid, int(1000 * scale)
+  )
+  await hybrid.close()
+  return results
+
+
+async def _bench_schema(scale: float) -> dict[str, dict]:
+  checker = FormatChecker()
+  return {
+    "schema_validate": measure(
+      lambda: validate(instance=PETITION, schema=PETITION_SCHEMA, format_checker=checker),
+      int(1000 * scale),
+    )
+  }
+
+
+async def _fake_create(self, *args, **kwargs):
+  class FakeMessage:
+    role = "assistant"
+    content = "Thank you for sharing that. Which county are you filing in?"
+    tool_calls = []
+
+  class FakeResponse:
+    choices = [type("Choice", (), {"message": FakeMessage()})()]
+    usage = None
+
+  return FakeResponse()
+
+
+async def _bench_asgi(scale: float) -> dict[str, dict]:
+  AsyncCompletions.create = _fake_create
+  app = create_app(InMemoryRateLimiter(10**9, 60, 300, 100_000))
+  headers = {"X-API-Key": os.environ["CHAT_API_KEY"]}
+  forwarded = (f"172.16.{i // 256}.{i % 256}" for i in itertools.count())
+  chat_body = {
+    "messages": [
+      {"role": "user", "content": "I need help filing a protective order."},
+      {"role": "assistant", "content": "I'm here to help. Are you safe right now?"},
+      {"role": "user", "content": "Yes, I am safe for now."},
+    ]
+  }
+  results = {}
+  async with httpx.AsyncClient(
+    transport=httpx.ASGITransport(app=app, client=("127.0.0.1", 0)),
+    base_url="http://testserver",
+  ) as client:
+    async def health():
+      await client.get("/health")
+
+    async def chat():
+      resp = await client.post("/api/chat", json=chat_body, headers=headers)
+      resp.raise_for_status()
+
+    async def pdf():
+      resp = await client.post(
+        "/api/pdf",
+        json=PETITION,
+        headers={**headers, "X-Forwarded-For": next(forwarded)},
+      )
+      resp.raise_for_status()
+
+    results["asgi[health]"] = await measure_async(health, int(500 * scale))
+    results["asgi[chat]"] = await measure_async(chat, int(300 * scale))
+    results["asgi[pdf]"] = await measure_async(pdf, int(30 * scale))
+  return results
+
+
+SUITES = {
+  "pdf": _bench_pdf,
+  "pdf_response": _bench_pdf_response,
+  "sanitize": _bench_sanitize,
+  "memory_limiter": _bench_memory_limiter,
+  "redis_limiter": _bench_redis_limiter,
+  "schema": _bench_schema,
+  "asgi": _bench_asgi,
+}
+
+
+async def main(args: argparse.Namespace) -> dict[str, dict]:
+  results: dict[str, dict] = {}
+  for name, suite in SUITES.items():
+    if args.only and args.only not in name:
+      continue
+    results.update(await suite(args.scale))
+  return results
+
+
+if __name__ == "__main__":
+  run(main, "Benchmark the backend hot paths")
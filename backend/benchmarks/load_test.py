@@ -0,0 +1,124 @@
+import argparse
+import asyncio
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from .cold_start import API_KEY, ENV, ROOT, _free_port
+from .harness import run, summarize
+
+SERVER_COMMAND = [
+  sys.executable, "-m", "gunicorn",
+  "-c", "python:backend.gunicorn_conf",
+  "--log-level", "error",
+  "backend.main:app",
+]
+
+
+def _configure(parser: argparse.ArgumentParser) -> None:
+  parser.add_argument(
+    "--workers", default="1,2,4", help="comma-separated worker counts to compare"
+  )
+  parser.add_argument(
+    "--duration", type=float, default=10.0, help="seconds of load per worker count"
+  )
+  parser.add_argument(
+    "--concurrency", type=int, default=16, help="requests kept in flight"
+  )
+
+
+async def _wait_ready(client: httpx.AsyncClient, proc: subprocess.Popen) -> None:
+  while True:
+    if proc.poll() is not None:
+      raise RuntimeError("server exited during startup")
+    try:
+      if (await client.get("/ready")).status_code == 200:
+        return
+    except httpx.TransportError:
+      pass
+    await asyncio.sleep(0.05)
+
+
+async def _load(client: httpx.AsyncClient, duration: float, concurrency: int) -> dict:
+  # Every request gets a new name so it misses the packet cache and pays for
+  # a full render, and a new forwarded IP so per-client rate limits and caps
+  # do not apply.
+  counter = itertools.count()
+  latencies: list[float] = []
+  statuses: dict[str, int] = {}
+  deadline = time.perf_counter() + duration
+
+  async def user() -> None:
+    while time.perf_counter() < deadline:
+      n = next(counter)
+      petition = {
+        "county": "General",
+        "petitioner_full_name": f"Load Test {n}",
+        "respondent_full_name": "John R. Roe",
+      }
+      headers = {
+        "X-API-Key": API_KEY,
+        "X-Forwarded-For": f"10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}",
+      }
+      start = time.perf_counter()
+      resp = await client.post("/api/pdf", json=petition, headers=headers)
+      status = str(resp.status_code)
+      statuses[status] = statuses.get(status, 0) + 1
+      if resp.status_code == 200:
+        latencies.append(time.perf_counter() - start)
+
+  started = time.perf_counter()
+  await asyncio.gather(*(user() for _ in range(concurrency)))
+  elapsed = time.perf_counter() - started
+  result = summarize(latencies) if latencies else {"iterations": 0}
+  result["throughput_rps"] = round(len(latencies) / elapsed, 2)
+  result["statuses"] = statuses
+  return result
+
+
+async def _bench_workers(workers: int, args: argparse.Namespace) -> dict:
+  port = _free_port()
+  with tempfile.TemporaryDirectory() as metrics_dir:
+    env = {
+      **ENV,
+      "PORT": str(port),
+      "WEB_CONCURRENCY": str(workers),
+      "PROMETHEUS_MULTIPROC_DIR": metrics_dir,
+    }
+    proc = subprocess.Popen(
+      SERVER_COMMAND,
+      cwd=ROOT,
+      env=env,
+      stdout=subprocess.DEVNULL,
+      stderr=subprocess.DEVNULL,
+    )
+    try:
+      async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{port}",
+        timeout=60,
+        limits=httpx.Limits(max_connections=args.concurrency),
+      ) as client:
+        await _wait_ready(client, proc)
+        # A short unmeasured run lets every worker finish its own warmup.
+        await _load(client, min(2.0, args.duration), args.concurrency)
+        return await _load(client, args.duration * args.scale, args.concurrency)
+    finally:
+      proc.terminate()
+      proc.wait(timeout=60)
+
+
+async def main(args: argparse.Namespace) -> dict[str, dict]:
+  results: dict[str, dict] = {}
+  for workers in (int(w) for w in args.workers.split(",")):
+    results[f"load[pdf,workers={workers}]"] = await _bench_workers(workers, args)
+  return results
+
+
+if __name__ == "__main__":
+  print(f"cpus available: {os.cpu_count()}", file=sys.stderr)
+  run(main, "Compare /api/pdf throughput across server worker counts", _configure)
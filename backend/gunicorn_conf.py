@@ -0,0 +1,40 @@
+# gunicorn -c python:backend.gunicorn_conf backend.main:app
+import os
+import tempfile
+
+from uvicorn.workers import UvicornWorker
+
+from backend.utils.metrics import MULTIPROC_DIR_ENV, clear_multiprocess_dir, mark_worker_exit
+
+workers = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+# Workers read this to scale per-process limits, so it must match the
+# number actually started.
+os.environ["WEB_CONCURRENCY"] = str(workers)
+if workers > 1:
+  os.environ.setdefault(
+    MULTIPROC_DIR_ENV, os.path.join(tempfile.gettempdir(), "podrafter-metrics")
+  )
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+# Workers share the listening socket bound by the master. SO_REUSEPORT lets
+# a replacement master bind the same port during a zero-downtime restart.
+reuse_port = True
+worker_class = "backend.gunicorn_conf.Worker"
+# Nothing with an open connection or event loop may be shared across fork.
+preload_app = False
+keepalive = 5
+# Open requests get 15s, then the lifespan drain gets PDF_DRAIN_TIMEOUT, all
+# before gunicorn kills the worker.
+graceful_timeout = 28
+
+
+class Worker(UvicornWorker):
+  CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, "timeout_graceful_shutdown": 15}
+
+
+def on_starting(server) -> None:
+  clear_multiprocess_dir()
+
+
+def child_exit(server, worker) -> None:
+  mark_worker_exit(worker.pid)
@@ -2,17 +2,26 @@ from .utils.logging import configure_logging
 
 configure_logging()
 
-import time
-from PyPDF2 import PdfReader, PdfWriter
+import asyncio
+import signal
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Awaitable, Callable, Iterator
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import Response
 from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 
-from .api import chat, pdf, health
+from .api import admin, chat, pdf, health
 from .middleware.auth import validate_api_key
 from .middleware.rate_limit import (
+  GLOBAL_RULE,
+  RATE_LIMIT_EXEMPT_PATHS,
+  RATE_LIMIT_MODE,
+  RATE_LIMIT_RULES,
+  RATE_LIMITERS,
   RateLimitMiddleware,
+  RateLimitRules,
   redis_client,
   RedisRateLimiter,
   InMemoryRateLimiter,
@@ -20,22 +29,92 @@ from .middleware.rate_limit import (
 )
 from .middleware.security import BodySizeLimitMiddleware, log_requests, set_security_headers
 from .middleware.correlation import add_correlation_id
+from .middleware.disconnect import DisconnectMiddleware
 from .utils.sanitization import sanitize_string, CoverLetterContext
 from .utils.validation import get_allowed_origins, reload_schema, MAX_REQUEST_SIZE
 from .services.openai_client import validate_environment
-from .services.template_service import TEMPLATE_CHECKSUMS, FORMS_DIR
-from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from .services.template_service import validate_templates
+from .services.warmup import warm_up
+from .utils.metrics import mark_worker_exit, render_metrics
+from .worker import PDF_DRAIN_TIMEOUT, queue
+from prometheus_client import CONTENT_TYPE_LATEST
 
 
 RATE_LIMIT = 100
 RATE_WINDOW = 60
+if GLOBAL_RULE in RATE_LIMIT_RULES:
+  RATE_LIMIT = RATE_LIMIT_RULES[GLOBAL_RULE].limit
+  RATE_WINDOW = RATE_LIMIT_RULES[GLOBAL_RULE].window
 FALLBACK_MAX_IPS = 1000
 FALLBACK_IP_TTL = RATE_WINDOW * 5
 
 
-def create_app(rate_limiter: RateLimiterProtocol) -> FastAPI:
-  app = FastAPI()
+async def stop_pdf_intake() -> None:
+  await queue.close()
+  pdf.abandon_jobs()
+
+
+@contextmanager
+def on_shutdown_signal(callback: Callable[[], Awaitable[None]]) -> Iterator[None]:
+  """Schedule ``callback`` as soon as SIGTERM or SIGINT arrives."""
+  if threading.current_thread() is not threading.main_thread():
+    yield
+    return
+  loop = asyncio.get_running_loop()
+  previous: dict[int, object] = {}
+
+  def handler(signum: int, frame) -> None:
+    asyncio.run_coroutine_threadsafe(callback(), loop)
+    chained = previous[signum]
+    if callable(chained):
+      chained(signum, frame)
+    elif chained in (signal.SIG_DFL, None):
+      signal.signal(signum, signal.SIG_DFL)
+      signal.raise_signal(signum)
+
+  for sig in (signal.SIGINT, signal.SIGTERM):
+    previous[sig] = signal.signal(sig, handler)
+  try:
+    yield
+  finally:
+    for sig, chained in previous.items():
+      if signal.getsignal(sig) is handler:
+        signal.signal(sig, chained if chained is not None else signal.SIG_DFL)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+  reload_schema()
+  await validate_environment()
+  validate_api_key()
+  # Field indexes are needed for every render, so a template that lost a
+  # mapped field stops the worker here rather than producing empty fields.
+  validate_templates()
+  # Heavy modules are imported lazily; warm them up in the background once
+  # the server is accepting connections. /ready returns 503 until this ends.
+  warmup = asyncio.create_task(warm_up())
+  # New PDF work is refused from the moment the server is told to stop,
+  # while open requests are still being given time to finish.
+  with on_shutdown_signal(stop_pdf_intake):
+    yield
+  warmup.cancel()
+  await stop_pdf_intake()
+  await queue.drain(PDF_DRAIN_TIMEOUT)
+  await app.state.rate_limiter.close()
+  mark_worker_exit()
+
+
+def create_app(
+  rate_limiter: RateLimiterProtocol, exempt_paths: frozenset[str] | None = None
+) -> FastAPI:
+  app = FastAPI(lifespan=lifespan)
   app.state.rate_limiter = rate_limiter
+  app.state.rate_limit_exempt_paths = (
+    RATE_LIMIT_EXEMPT_PATHS if exempt_paths is None else exempt_paths
+  )
+  app.state.rate_limit_rules = RateLimitRules(
+    {name: rule for name, rule in RATE_LIMIT_RULES.items() if name != GLOBAL_RULE}
+  )
   app.add_middleware(RateLimitMiddleware)
   app.add_middleware(BodySizeLimitMiddleware)
   app.add_middleware(
@@ -48,24 +127,21 @@ def create_app(rate_limiter: RateLimiterProtocol) -> FastAPI:
   app.middleware("http")(set_security_headers)
   app.middleware("http")(log_requests)
   app.middleware("http")(add_correlation_id)
-
-  @app.on_event("startup")
-  async def startup_event() -> None:
-    reload_schema()
-    await validate_environment()
-    validate_api_key()
+  # Outermost, so disconnects are seen before BaseHTTPMiddleware hides them.
+  app.add_middleware(DisconnectMiddleware)
 
   app.include_router(chat.router)
   app.include_router(pdf.router)
   app.include_router(health.router)
+  app.include_router(admin.router)
 
   @app.get("/metrics")
   async def metrics() -> Response:
-    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
   return app
 
 
-rate_limiter = RedisRateLimiter(
+rate_limiter = RATE_LIMITERS[RATE_LIMIT_MODE](
   redis_client, RATE_LIMIT, RATE_WINDOW, FALLBACK_IP_TTL, FALLBACK_MAX_IPS
 )
 app = create_app(rate_limiter)
@@ -0,0 +1,50 @@
+import asyncio
+
+from fastapi import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class DisconnectMiddleware:
+  """Record ``http.disconnect`` in request state once the body has been read."""
+
+  def __init__(self, app: ASGIApp) -> None:
+    self.app = app
+
+  async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+    if scope["type"] != "http":
+      await self.app(scope, receive, send)
+      return
+    disconnected = asyncio.Event()
+    scope.setdefault("state", {})["client_disconnected"] = disconnected
+    watcher: asyncio.Task | None = None
+
+    async def watch() -> None:
+      while (await receive())["type"] != "http.disconnect":
+        pass
+      disconnected.set()
+
+    async def receive_or_disconnect() -> Message:
+      nonlocal watcher
+      if watcher is not None:
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+      message = await receive()
+      if message["type"] == "http.disconnect":
+        disconnected.set()
+      elif not message.get("more_body", False):
+        # The server only has a disconnect left to deliver, so listen for it
+        # now rather than when a layer happens to ask.
+        watcher = asyncio.create_task(watch())
+      return message
+
+    try:
+      await self.app(scope, receive_or_disconnect, send)
+    finally:
+      if watcher is not None:
+        watcher.cancel()
+
+
+async def wait_for_disconnect(request: Request) -> None:
+  """Return once the client has gone away; waits forever without the middleware."""
+  disconnected = getattr(request.state, "client_disconnected", None)
+  await (disconnected or asyncio.Event()).wait()
@@ -1,31 +1,256 @@
 import asyncio
+import itertools
+import json
 import os
 import time
 from collections import OrderedDict
-from functools import wraps
-from typing import Dict, Protocol, Tuple
+from dataclasses import dataclass
+from secrets import token_hex
+from typing import Dict, Protocol, Sequence, Tuple
 
 import redis.asyncio as redis
-from fastapi.responses import JSONResponse, Response
+from fastapi.responses import JSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.routing import Match
 from fastapi import Request
+from prometheus_client import Counter, Gauge, Histogram
 import structlog
 
+from ..utils.processes import SERVER_PROCESSES
 from .auth import get_client_ip
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-redis_client = redis.from_url(REDIS_URL, decode_responses=True)
+# A request should fall back to the in-memory limiter quickly rather than
+# hang on a slow Redis, so every wait on Redis is bounded. When the pool is
+# exhausted, commands fail at once instead of queueing for a connection.
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "20"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.25"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "0.25"))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+REDIS_RETRY_INTERVAL = float(os.getenv("REDIS_RETRY_INTERVAL", "1"))
+# "redis" checks Redis on every request; "hybrid" decides from per-process
+# counters synced to Redis in the background, and may overshoot slightly.
+RATE_LIMIT_MODE = os.getenv("RATE_LIMIT_MODE", "redis")
+RATE_LIMIT_SYNC_INTERVAL = float(os.getenv("RATE_LIMIT_SYNC_INTERVAL", "0.005"))
+# "log" keeps one sorted-set entry per request and counts exactly; "counter"
+# keeps two fixed-window counters per key and interpolates between them.
+RATE_LIMIT_ALGORITHM = os.getenv("RATE_LIMIT_ALGORITHM", "log")
+if RATE_LIMIT_ALGORITHM not in ("log", "counter"):
+  raise RuntimeError(f"Invalid RATE_LIMIT_ALGORITHM: {RATE_LIMIT_ALGORITHM}")
+# Probes and scrapes must not be throttled or wait on the limiter.
+RATE_LIMIT_EXEMPT_PATHS = frozenset(
+  path.strip()
+  for path in os.getenv("RATE_LIMIT_EXEMPT_PATHS", "/health,/ready,/metrics").split(",")
+  if path.strip()
+)
+
+redis_client = redis.from_url(
+  REDIS_URL,
+  decode_responses=True,
+  max_connections=REDIS_MAX_CONNECTIONS,
+  socket_timeout=REDIS_SOCKET_TIMEOUT,
+  socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+  health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+)
+
+REDIS_POOL_CONNECTIONS = Gauge(
+  "redis_pool_connections",
+  "Connections held by the Redis client pool",
+  ["state"],
+  multiprocess_mode="livesum",
+)
+REDIS_ERRORS = Counter(
+  "redis_errors_total",
+  "Redis calls that failed, by exception type",
+  ["error"],
+)
+# Limiter checks take microseconds locally and a Redis round trip otherwise,
+# both well below the default buckets.
+LIMITER_LATENCY_BUCKETS = (
+  0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5
+)
+RATE_LIMIT_DECISIONS = Counter(
+  "rate_limit_decisions_total",
+  "Rate-limit decisions, by outcome, store and deciding rule",
+  ["outcome", "store", "rule"],
+)
+RATE_LIMIT_CHECK_LATENCY = Histogram(
+  "rate_limit_check_duration_seconds",
+  "Time requests spend in the rate limiter, by store",
+  ["store"],
+  buckets=LIMITER_LATENCY_BUCKETS,
+)
+RATE_LIMIT_SYNC_LATENCY = Histogram(
+  "rate_limit_sync_duration_seconds",
+  "Duration of hybrid limiter syncs with Redis",
+  ["outcome"],
+  buckets=LIMITER_LATENCY_BUCKETS,
+)
+RATE_LIMIT_TRACKED_KEYS = Gauge(
+  "rate_limit_tracked_keys",
+  "Client keys held in process memory by the rate limiter",
+  ["limiter"],
+  multiprocess_mode="livesum",
+)
+RATE_LIMIT_FALLBACK_TRANSITIONS = Counter(
+  "rate_limit_fallback_transitions_total",
+  "Switches between Redis and the in-memory fallback, by the store switched to",
+  ["to"],
+)
 
 logger = structlog.get_logger(__name__)
 
 
+def record_pool_usage(client) -> None:
+  pool = getattr(client, "connection_pool", None)
+  if pool is None:
+    return
+  in_use = len(getattr(pool, "_in_use_connections", ()))
+  idle = len(getattr(pool, "_available_connections", ()))
+  REDIS_POOL_CONNECTIONS.labels(state="in_use").set(in_use)
+  REDIS_POOL_CONNECTIONS.labels(state="idle").set(idle)
+
+
+def _record_fallback(active: bool) -> None:
+  if active:
+    RATE_LIMIT_FALLBACK_TRANSITIONS.labels(to="memory").inc()
+    logger.warning("rate limiter falling back to memory")
+  else:
+    RATE_LIMIT_FALLBACK_TRANSITIONS.labels(to="redis").inc()
+    logger.info("rate limiter reconnected to redis")
+
+
+GLOBAL_RULE = "global"
+
+
+@dataclass(frozen=True)
+class RateLimitRule:
+  name: str
+  limit: int
+  window: int
+  paths: tuple[str, ...] = ()
+  methods: tuple[str, ...] = ()
+
+  def matches(self, method: str, path: str) -> bool:
+    return path in self.paths and (not self.methods or method in self.methods)
+
+
+@dataclass(frozen=True)
+class RateLimitDecision:
+  allowed: bool
+  store: str
+  remaining: int
+  limit: int
+  rule: str
+
+
+def load_rate_limit_rules(raw: str | None = None) -> dict[str, RateLimitRule]:
+  """Parse ``RATE_LIMIT_RULES``, a JSON list of path rules and overrides."""
+  raw = os.getenv("RATE_LIMIT_RULES", "") if raw is None else raw
+  if not raw.strip():
+    return {}
+  rules: dict[str, RateLimitRule] = {}
+  try:
+    for entry in json.loads(raw):
+      rule = RateLimitRule(
+        name=entry["name"],
+        limit=int(entry["limit"]),
+        window=int(entry["window"]),
+        paths=tuple(entry.get("paths", ())),
+        methods=tuple(m.upper() for m in entry.get("methods", ())),
+      )
+      rules[rule.name] = rule
+  except (TypeError, KeyError, ValueError) as exc:
+    raise RuntimeError(f"Invalid RATE_LIMIT_RULES: {exc}") from exc
+  return rules
+
+
+RATE_LIMIT_RULES = load_rate_limit_rules()
+
+
+def _endpoint_rule(request: Request) -> RateLimitRule | None:
+  for route in request.app.router.routes:
+    match, child = route.matches(request.scope)
+    if match is Match.FULL:
+      return getattr(child.get("endpoint"), "rate_limit_rule", None)
+  return None
+
+
+class RateLimitRules:
+  def __init__(self, rules: dict[str, RateLimitRule]) -> None:
+    self.rules = rules
+    self.path_rules = [rule for rule in rules.values() if rule.paths]
+
+  def for_request(self, request: Request) -> list[RateLimitRule]:
+    method, path = request.method, request.url.path
+    matched = [rule for rule in self.path_rules if rule.matches(method, path)]
+    declared = _endpoint_rule(request)
+    if declared is not None and all(rule.name != declared.name for rule in matched):
+      matched.append(self.rules.get(declared.name, declared))
+    return matched
+
+
+def _rule_keys(
+  ip: str, rules: Sequence[RateLimitRule], rate_limit: int, rate_window: int
+) -> tuple[list[tuple[str, int]], list[tuple[str, int]]]:
+  """Redis keys with their windows, and rule names with their limits."""
+  keys = [(f"ratelimit:{ip}", rate_window)] + [
+    (f"ratelimit:{rule.name}:{ip}", rule.window) for rule in rules
+  ]
+  limits = [(GLOBAL_RULE, rate_limit)] + [(rule.name, rule.limit) for rule in rules]
+  return keys, limits
+
+
+_MEMBER_PREFIX = token_hex(4)
+_member_sequence = itertools.count()
+
+
+def _unique_member(now: float) -> str:
+  # Sorted-set members must be unique across processes and within one
+  # timestamp, or concurrent requests overwrite each other and undercount.
+  return f"{now}:{_MEMBER_PREFIX}:{next(_member_sequence)}"
+
+
+def _counter_buckets(key: str, window: int, now: float) -> tuple[str, str, float]:
+  """Current and previous window keys, and the previous window's overlap weight."""
+  bucket = int(now // window)
+  elapsed = now - bucket * window
+  return f"{key}:{bucket}", f"{key}:{bucket - 1}", 1 - elapsed / window
+
+
+def _estimate(previous, current, weight: float) -> int:
+  return int(int(previous or 0) * weight) + int(current or 0)
+
+
+def _decide(
+  limits: list[tuple[str, int]], counts: list[int], store: str
+) -> RateLimitDecision:
+  """Deny on the first exceeded rule, else report the one with least headroom."""
+  tightest: RateLimitDecision | None = None
+  for (name, limit), count in zip(limits, counts):
+    remaining = limit - count
+    if remaining < 0:
+      return RateLimitDecision(False, store, 0, limit, name)
+    if tightest is None or remaining < tightest.remaining:
+      tightest = RateLimitDecision(True, store, remaining, limit, name)
+  return tightest
+
+
 class RateLimiterProtocol(Protocol):
+  async def check(
+    self, ip: str, now: float, rules: Sequence[RateLimitRule] = ()
+  ) -> RateLimitDecision:
+    ...
+
   async def record_request(self, ip: str, now: float) -> Tuple[bool, str, int]:
     ...
 
   async def clear(self) -> None:
     ...
 
+  async def close(self) -> None:
+    ...
+
 
 class InMemoryRateLimiter:
   def __init__(
@@ -40,36 +265,66 @@ class InMemoryRateLimiter:
     self.fallback_ip_ttl = fallback_ip_ttl
     self.fallback_max_ips = fallback_max_ips
     self._store: OrderedDict[str, Dict[str, float]] = OrderedDict()
+    # Windows of rule keys that differ from rate_window.
+    self._windows: Dict[str, int] = {}
     self._lock = asyncio.Lock()
 
-  async def record_request(self, ip: str, now: float) -> Tuple[bool, str, int]:
+  async def check(
+    self, ip: str, now: float, rules: Sequence[RateLimitRule] = ()
+  ) -> RateLimitDecision:
     async with self._lock:
-      allowed, remaining = self._record_request_unsafe(ip, now)
-    return allowed, "memory", remaining
+      return self._check_unsafe(ip, now, rules)
+
+  async def record_request(self, ip: str, now: float) -> Tuple[bool, str, int]:
+    decision = await self.check(ip, now)
+    return decision.allowed, "memory", decision.remaining
 
   async def clear(self) -> None:
     async with self._lock:
       self._store.clear()
+      self._windows.clear()
+
+  async def close(self) -> None:
+    pass
 
-  def _record_request_unsafe(self, ip: str, now: float) -> Tuple[bool, int]:
-    window_start = now - self.rate_window
-    for ip_key, times in list(self._store.items()):
+  def _sweep(self, now: float) -> None:
+    for key, times in list(self._store.items()):
+      window_start = now - self._windows.get(key, self.rate_window)
       for ts_key, ts in list(times.items()):
         if ts < window_start:
           del times[ts_key]
       last_seen = max(times.values()) if times else 0
       if not times or last_seen < now - self.fallback_ip_ttl:
-        self._store.pop(ip_key, None)
+        self._forget(key)
+
+  def _forget(self, key: str) -> None:
+    self._store.pop(key, None)
+    self._windows.pop(key, None)
 
-    timestamps = self._store.setdefault(ip, {})
-    if len(timestamps) >= self.rate_limit:
-      return False, 0
-    timestamps[str(now)] = now
-    self._store.move_to_end(ip)
+  def _check_unsafe(
+    self, ip: str, now: float, rules: Sequence[RateLimitRule]
+  ) -> RateLimitDecision:
+    self._sweep(now)
+    keys = [(ip, self.rate_window)] + [
+      (f"{rule.name}:{ip}", rule.window) for rule in rules
+    ]
+    limits = [(GLOBAL_RULE, self.rate_limit)] + [
+      (rule.name, rule.limit) for rule in rules
+    ]
+    counts = [len(self._store.get(key, ())) + 1 for key, _ in keys]
+    decision = _decide(limits, counts, "memory")
+    if not decision.allowed:
+      return decision
+    for key, window in keys:
+      self._store.setdefault(key, {})[str(now)] = now
+      self._store.move_to_end(key)
+      if window != self.rate_window:
+        self._windows[key] = window
     while len(self._store) > self.fallback_max_ips:
-      self._store.popitem(last=False)
-    remaining = self.rate_limit - len(timestamps)
-    return True, remaining
+      oldest = next(iter(self._store))
+      self._forget(oldest)
+    RATE_LIMIT_TRACKED_KEYS.labels(limiter="memory").set(len(self._store))
+    return decision
 
 
 class RedisRateLimiter:
@@ -80,102 +335,394 @@ class RedisRateLimiter:
     rate_window: int,
     fallback_ip_ttl: int,
     fallback_max_ips: int,
+    algorithm: str = RATE_LIMIT_ALGORITHM,
   ) -> None:
     self.redis_cli = redis_cli
     self.rate_limit = rate_limit
     self.rate_window = rate_window
     self.fallback_ip_ttl = fallback_ip_ttl
     self.fallback_max_ips = fallback_max_ips
+    self.algorithm = algorithm
+    # Fallback counters live in each server process, so split the limit to
+    # keep a client's total across processes close to ``rate_limit``.
     self.fallback_limiter = InMemoryRateLimiter(
-      rate_limit, rate_window, fallback_ip_ttl, fallback_max_ips
+      max(1, rate_limit // SERVER_PROCESSES),
+      rate_window,
+      fallback_ip_ttl,
+      fallback_max_ips,
     )
     self.fallback_active = False
+    self.probe_interval = REDIS_RETRY_INTERVAL
+    self._next_probe = 0.0
 
-  async def record_request(self, ip: str, now: float) -> Tuple[bool, str, int]:
-    if self.fallback_active:
+  async def check(
+    self, ip: str, now: float, rules: Sequence[RateLimitRule] = ()
+  ) -> RateLimitDecision:
+    # While Redis is down, probe it at most once per probe_interval so that
+    # requests are not each delayed by a failing connection attempt.
+    if self.fallback_active and now >= self._next_probe:
       try:
         await self.redis_cli.ping()
         self.fallback_active = False
+        _record_fallback(False)
         await self.fallback_limiter.clear()
-      except Exception:
-        pass
+      except Exception as exc:
+        REDIS_ERRORS.labels(error=type(exc).__name__).inc()
+        self._next_probe = now + self.probe_interval
 
     if not self.fallback_active:
       try:
-        key = f"ratelimit:{ip}"
-        await self.redis_cli.zremrangebyscore(key, 0, now - self.rate_window)
-        count = await self.redis_cli.zcard(key)
-        if count >= self.rate_limit:
-          return False, "redis", 0
-        await self.redis_cli.zadd(key, {str(now): now})
-        await self.redis_cli.expire(key, self.rate_window)
-        remaining = self.rate_limit - (count + 1)
-        return True, "redis", remaining
-      except Exception:
+        return await self._check_redis(ip, now, rules)
+      except Exception as exc:
+        REDIS_ERRORS.labels(error=type(exc).__name__).inc()
         self.fallback_active = True
+        _record_fallback(True)
+        self._next_probe = now
         await self.fallback_limiter.clear()
+      finally:
+        record_pool_usage(self.redis_cli)
+
+    return await self.fallback_limiter.check(ip, now, rules)
+
+  async def record_request(self, ip: str, now: float) -> Tuple[bool, str, int]:
+    decision = await self.check(ip, now)
+    return decision.allowed, decision.store, decision.remaining
+
+  async def _check_redis(
+    self, ip: str, now: float, rules: Sequence[RateLimitRule]
+  ) -> RateLimitDecision:
+    # Every rule is recorded and counted in one transaction and one round
+    # trip. A rejected request is undone afterwards, which costs a second
+    # round trip only on the deny path.
+    keys, limits = _rule_keys(ip, rules, self.rate_limit, self.rate_window)
+    if self.algorithm == "counter":
+      return await self._check_counter(keys, limits, now)
+    return await self._check_log(keys, limits, now)
 
-    allowed, _, remaining = await self.fallback_limiter.record_request(ip, now)
-    return allowed, "memory", remaining
+  async def _check_log(
+    self, keys: list[tuple[str, int]], limits: list[tuple[str, int]], now: float
+  ) -> RateLimitDecision:
+    member = _unique_member(now)
+    pipe = self.redis_cli.pipeline(transaction=True)
+    for key, window in keys:
+      pipe.zremrangebyscore(key, 0, now - window)
+      pipe.zadd(key, {member: now})
+      pipe.zcard(key)
+      pipe.expire(key, window)
+    results = await pipe.execute()
+    decision = _decide(limits, results[2::4], "redis")
+    if not decision.allowed:
+      cleanup = self.redis_cli.pipeline(transaction=False)
+      for key, _ in keys:
+        cleanup.zrem(key, member)
+      await cleanup.execute()
+    return decision
+
+  async def _check_counter(
+    self, keys: list[tuple[str, int]], limits: list[tuple[str, int]], now: float
+  ) -> RateLimitDecision:
+    # A counter lives for two windows so it can serve as the previous window.
+    buckets = [_counter_buckets(key, window, now) for key, window in keys]
+    pipe = self.redis_cli.pipeline(transaction=True)
+    for (current, previous, _), (_, window) in zip(buckets, keys):
+      pipe.incr(current)
+      pipe.expire(current, 2 * window)
+      pipe.get(previous)
+    results = await pipe.execute()
+    counts = [
+      _estimate(results[3 * i + 2], results[3 * i], weight)
+      for i, (_, _, weight) in enumerate(buckets)
+    ]
+    decision = _decide(limits, counts, "redis")
+    if not decision.allowed:
+      cleanup = self.redis_cli.pipeline(transaction=False)
+      for current, _, _ in buckets:
+        cleanup.decr(current)
+      await cleanup.execute()
+    return decision
 
   async def clear(self) -> None:
     self.fallback_active = False
+    self._next_probe = 0.0
     await self.fallback_limiter.clear()
 
+  async def close(self) -> None:
+    pass
+
+
+class HybridRateLimiter:
+  """Decide locally and reconcile counters with Redis in the background."""
+
+  def __init__(
+    self,
+    redis_cli,
+    rate_limit: int,
+    rate_window: int,
+    fallback_ip_ttl: int,
+    fallback_max_ips: int,
+    sync_interval: float = RATE_LIMIT_SYNC_INTERVAL,
+    algorithm: str = RATE_LIMIT_ALGORITHM,
+  ) -> None:
+    self.redis_cli = redis_cli
+    self.rate_limit = rate_limit
+    self.rate_window = rate_window
+    self.fallback_ip_ttl = fallback_ip_ttl
+    self.fallback_max_ips = fallback_max_ips
+    self.sync_interval = sync_interval
+    self.algorithm = algorithm
+    self.fallback_active = False
+    self.probe_interval = REDIS_RETRY_INTERVAL
+    self._next_probe = 0.0
+    # Entries allowed here and not yet pushed, oldest first, per Redis key.
+    self._pending: OrderedDict[str, list[Tuple[float, str]]] = OrderedDict()
+    # Entries taken from _pending by a sync that has not returned yet.
+    self._syncing: Dict[str, list[Tuple[float, str]]] = {}
+    # Count and time of the last sync, per Redis key.
+    self._synced: Dict[str, Tuple[int, float]] = {}
+    self._windows: Dict[str, int] = {}
+    self._denied: set[str] = set()
+    self._sync_task: asyncio.Task | None = None
+    self._work: asyncio.Event | None = None
+
+  async def check(
+    self, ip: str, now: float, rules: Sequence[RateLimitRule] = ()
+  ) -> RateLimitDecision:
+    self._ensure_sync_task()
+    keys, limits = _rule_keys(ip, rules, self.rate_limit, self.rate_window)
+    store = "hybrid"
+    if self.fallback_active:
+      store = "memory"
+      limits = [(name, max(1, limit // SERVER_PROCESSES)) for name, limit in limits]
+    counts = [self._count(key, window, now) + 1 for key, window in keys]
+    self._windows.update(keys)
+    decision = _decide(limits, counts, store)
+    self._work.set()
+    if not decision.allowed:
+      self._denied.update(key for key, _ in keys)
+      return decision
+    # The member is fixed now so that a retried push cannot add it twice.
+    entry = (now, _unique_member(now))
+    for key, _ in keys:
+      self._pending.setdefault(key, []).append(entry)
+      self._pending.move_to_end(key)
+    while len(self._pending) > self.fallback_max_ips:
+      self._pending.popitem(last=False)
+    return decision
+
+  async def record_request(self, ip: str, now: float) -> Tuple[bool, str, int]:
+    decision = await self.check(ip, now)
+    return decision.allowed, decision.store, decision.remaining
+
+  def _count(self, key: str, window: int, now: float) -> int:
+    entries = self._pending.get(key, [])
+    expired = 0
+    while expired < len(entries) and entries[expired][0] <= now - window:
+      expired += 1
+    del entries[:expired]
+    local = len(entries) + sum(
+      1 for ts, _ in self._syncing.get(key, ()) if ts > now - window
+    )
+    if self.fallback_active:
+      return local
+    count, synced_at = self._synced.get(key, (0, now))
+    return local + (count if synced_at > now - window else 0)
+
+  def _ensure_sync_task(self) -> None:
+    loop = asyncio.get_running_loop()
+    task = self._sync_task
+    if task is None or task.done() or task.get_loop() is not loop:
+      self._work = asyncio.Event()
+      self._sync_task = loop.create_task(self._sync_loop(self._work))
+
+  async def _sync_loop(self, work: asyncio.Event) -> None:
+    # Idle processes sleep until a request leaves something to sync.
+    while True:
+      await work.wait()
+      delay = self.sync_interval
+      if self.fallback_active:
+        delay = max(delay, self._next_probe - time.time())
+      await asyncio.sleep(delay)
+      work.clear()
+      await self.sync(time.time())
+      if self._pending or self._denied:
+        work.set()
+
+  async def sync(self, now: float) -> None:
+    """Push pending entries and refresh counts in one pipeline."""
+    started = time.perf_counter()
+    outcome = await self._sync(now)
+    if outcome is not None:
+      RATE_LIMIT_SYNC_LATENCY.labels(outcome=outcome).observe(
+        time.perf_counter() - started
+      )
+    # After a successful sync every pushed key is in _synced; during an
+    # outage only the local entries are tracked.
+    tracked = self._pending if self.fallback_active else self._synced
+    RATE_LIMIT_TRACKED_KEYS.labels(limiter="hybrid").set(len(tracked))
+
+  async def _sync(self, now: float) -> str | None:
+    pending, self._pending = self._pending, OrderedDict()
+    keys = list(pending.keys() | self._denied)
+    self._denied = set()
+    self._syncing = pending
+    try:
+      return await self._push(pending, keys, now)
+    finally:
+      self._syncing = {}
+
+  async def _push(
+    self, pending: Dict[str, list[Tuple[float, str]]], keys: list[str], now: float
+  ) -> str | None:
+    for key, (_, synced_at) in list(self._synced.items()):
+      if synced_at <= now - self._windows.get(key, self.rate_window):
+        del self._synced[key]
+    if len(self._windows) > 2 * self.fallback_max_ips:
+      live = self._synced.keys() | pending.keys() | self._pending.keys() | keys
+      self._windows = {key: self._windows[key] for key in live if key in self._windows}
+    if not keys:
+      return None
+    try:
+      pipe = self.redis_cli.pipeline(transaction=False)
+      # Positions of the replies each key's count is read from: the current
+      # count, and for counters the previous window's count and its weight.
+      reads: list[tuple[int, int | None, float]] = []
+      position = 0
+      for key in keys:
+        window = self._windows.get(key, self.rate_window)
+        if self.algorithm == "counter":
+          position += self._queue_counter(pipe, key, window, pending.get(key, ()), now)
+          current, previous, weight = _counter_buckets(key, window, now)
+          pipe.get(current)
+          pipe.get(previous)
+          reads.append((position, position + 1, weight))
+          position += 2
+          continue
+        pipe.zremrangebyscore(key, 0, now - window)
+        entries = {
+          member: ts for ts, member in pending.get(key, ()) if ts > now - window
+        }
+        if entries:
+          pipe.zadd(key, entries)
+          position += 1
+        pipe.zcard(key)
+        pipe.expire(key, window)
+        reads.append((position + 1, None, 0.0))
+        position += 3
+      results = await pipe.execute()
+    except Exception as exc:
+      REDIS_ERRORS.labels(error=type(exc).__name__).inc()
+      if not self.fallback_active:
+        self.fallback_active = True
+        _record_fallback(True)
+      self._next_probe = now + self.probe_interval
+      # Keep the entries so they still count locally and reach Redis later.
+      for key, entries in pending.items():
+        self._pending[key] = entries + self._pending.get(key, [])
+      return "error"
+    finally:
+      record_pool_usage(self.redis_cli)
+    if self.fallback_active:
+      self.fallback_active = False
+      _record_fallback(False)
+    for key, (current, previous, weight) in zip(keys, reads):
+      if previous is None:
+        count = results[current]
+      else:
+        count = _estimate(results[previous], results[current], weight)
+      self._synced[key] = (count, now)
+    return "ok"
+
+  @staticmethod
+  def _queue_counter(pipe, key: str, window: int, entries, now: float) -> int:
+    """Queue counter increments for ``entries``; returns the commands queued."""
+    # Unlike sorted-set members, increments are not idempotent, so a push
+    # retried after a partial failure can overcount.
+    oldest_bucket = int(now // window) - 1
+    added: dict[str, int] = {}
+    for ts, _ in entries:
+      if int(ts // window) >= oldest_bucket:
+        current = _counter_buckets(key, window, ts)[0]
+        added[current] = added.get(current, 0) + 1
+    for current, count in added.items():
+      pipe.incrby(current, count)
+      pipe.expire(current, 2 * window)
+    return 2 * len(added)
+
+  async def clear(self) -> None:
+    self.fallback_active = False
+    self._next_probe = 0.0
+    self._pending.clear()
+    self._synced.clear()
+    self._windows.clear()
+    self._denied.clear()
+
+  async def close(self) -> None:
+    """Stop the sync task and push whatever is still pending."""
+    if self._sync_task is not None:
+      self._sync_task.cancel()
+      self._sync_task = None
+    await self.sync(time.time())
+
+
+RATE_LIMITERS = {"hybrid": HybridRateLimiter, "redis": RedisRateLimiter}
+if RATE_LIMIT_MODE not in RATE_LIMITERS:
+  raise RuntimeError(f"Invalid RATE_LIMIT_MODE: {RATE_LIMIT_MODE}")
+
 
+def _limit_headers(decision: RateLimitDecision) -> dict[str, str]:
+  return {
+    "X-RateLimit-Limit": str(decision.limit),
+    "X-RateLimit-Remaining": str(decision.remaining),
+    "X-RateLimit-Rule": decision.rule,
+    "X-RateLimit-Store": decision.store,
+  }
+
+
+# Evaluates the global limit and every route rule that applies to a request
+# in a single limiter call, and reports them with one set of headers.
 class RateLimitMiddleware(BaseHTTPMiddleware):
   async def dispatch(self, request: Request, call_next):
+    if request.url.path in request.app.state.rate_limit_exempt_paths:
+      return await call_next(request)
     rate_limiter = request.app.state.rate_limiter
+    rules = request.app.state.rate_limit_rules.for_request(request)
     ip = get_client_ip(request)
     now = time.time()
+    started = time.perf_counter()
     try:
-      allowed, store, remaining = await rate_limiter.record_request(ip, now)
+      decision = await rate_limiter.check(ip, now, rules)
     except Exception:
       logger.exception("rate limiter failure", ip=ip)
       return JSONResponse(status_code=503, content={"detail": "Service unavailable"})
-    if not allowed:
-      return JSONResponse(status_code=429, content={"detail": "Too many requests"})
+    RATE_LIMIT_CHECK_LATENCY.labels(store=decision.store).observe(
+      time.perf_counter() - started
+    )
+    RATE_LIMIT_DECISIONS.labels(
+      outcome="allowed" if decision.allowed else "denied",
+      store=decision.store,
+      rule=decision.rule,
+    ).inc()
+    if not decision.allowed:
+      return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many requests"},
+        headers=_limit_headers(decision),
+      )
     try:
       response = await call_next(request)
     except Exception:
       logger.exception("downstream failure")
       return JSONResponse(status_code=503, content={"detail": "Service unavailable"})
-    response.headers["X-RateLimit-Store"] = store
-    response.headers["X-RateLimit-Remaining"] = str(remaining)
+    response.headers.update(_limit_headers(decision))
     return response
 
 
 def rate_limit(limit: int, window: int, key: str | None = None):
-  limiter = RedisRateLimiter(redis_client, limit, window, window * 5, 1000)
-
+  """Declare a per-route limit; routes sharing a ``key`` share one counter."""
   def decorator(func):
-    @wraps(func)
-    async def wrapper(*args, **kwargs):
-      request: Request = kwargs.get("request")
-      if request is None:
-        for arg in args:
-          if isinstance(arg, Request):
-            request = arg
-            break
-      if request is None:
-        raise RuntimeError("Request object required for rate limiting")
-      ip = get_client_ip(request)
-      route_key = key or request.url.path
-      composite = f"{route_key}:{ip}"
-      try:
-        allowed, store, remaining = await limiter.record_request(composite, time.time())
-      except Exception:
-        logger.exception("rate limiter failure", ip=ip, route=route_key)
-        return JSONResponse(status_code=503, content={"detail": "Service unavailable"})
-      if not allowed:
-        return JSONResponse(status_code=429, content={"detail": "Too many requests"})
-      result = await func(*args, **kwargs)
-      if not isinstance(result, Response):
-        result = JSONResponse(result)
-      result.headers["X-RateLimit-Store"] = store
-      result.headers["X-Route-RateLimit-Remaining"] = str(remaining)
-      return result
-
-    return wrapper
+    func.rate_limit_rule = RateLimitRule(
+      name=key or func.__name__, limit=limit, window=window
+    )
+    return func
 
   return decorator
@@ -6,18 +6,20 @@ from starlette.middleware.base import BaseHTTPMiddleware
 from structlog.contextvars import bind_contextvars
 
 from .auth import get_client_ip
-from ..utils.validation import MAX_REQUEST_SIZE
+from ..utils.validation import MAX_BATCH_REQUEST_SIZE, MAX_REQUEST_SIZE
 
 logger = structlog.get_logger(__name__)
 SENSITIVE_PATHS = {"/api/chat", "/api/pdf"}
+BODY_SIZE_LIMITS = {"/api/pdf/batch": MAX_BATCH_REQUEST_SIZE}
 
 
 class BodySizeLimitMiddleware(BaseHTTPMiddleware):
   async def dispatch(self, request: Request, call_next):
+    limit = BODY_SIZE_LIMITS.get(request.url.path, MAX_REQUEST_SIZE)
     cl = request.headers.get("content-length")
     if cl:
       try:
-        if int(cl) > MAX_REQUEST_SIZE:
+        if int(cl) > limit:
           return JSONResponse(status_code=413, content={"detail": "Request too large"})
       except ValueError:
         return JSONResponse(status_code=400, content={"detail": "Invalid content length"})
@@ -25,18 +27,20 @@ class BodySizeLimitMiddleware(BaseHTTPMiddleware):
       body = bytearray()
       async for chunk in request.stream():
         body.extend(chunk)
-        if len(body) > MAX_REQUEST_SIZE:
+        if len(body) > limit:
           return JSONResponse(status_code=413, content={"detail": "Request too large"})
       body_bytes = bytes(body)
       if body_bytes:
         request._body = body_bytes
         consumed = False
+        original_receive = request._receive
         async def receive():
           nonlocal consumed
           if not consumed:
             consumed = True
             return {"type": "http.request", "body": body_bytes, "more_body": False}
-          return {"type": "http.disconnect"}
+          # Defer to the server so a real disconnect is still observable.
+          return await original_receive()
         request._receive = receive
     return await call_next(request)
 
@@ -63,8 +67,9 @@ async def set_security_headers(request: Request, call_next):
 async def log_requests(request: Request, call_next):
   ip = get_client_ip(request)
   path = request.url.path
-  log_ip = "redacted" if path in SENSITIVE_PATHS else ip
-  log_path = "redacted" if path in SENSITIVE_PATHS else path
+  sensitive = any(path == p or path.startswith(p + "/") for p in SENSITIVE_PATHS)
+  log_ip = "redacted" if sensitive else ip
+  log_path = "redacted" if sensitive else path
   bind_contextvars(method=request.method, path=log_path, client_ip=log_ip)
   start = time.time()
   try:
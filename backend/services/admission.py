@@ -0,0 +1,127 @@
+import math
+import os
+import time
+
+from fastapi import HTTPException
+from prometheus_client import Counter, Gauge
+
+PDF_TARGET_WAIT = float(os.getenv("PDF_TARGET_WAIT", "5"))
+PDF_ADMISSION_INTERVAL = float(os.getenv("PDF_ADMISSION_INTERVAL", "2"))
+CHAT_TARGET_LATENCY = float(os.getenv("CHAT_TARGET_LATENCY", "15"))
+CHAT_INITIAL_CONCURRENCY = int(os.getenv("CHAT_INITIAL_CONCURRENCY", "20"))
+CHAT_MIN_CONCURRENCY = int(os.getenv("CHAT_MIN_CONCURRENCY", "2"))
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", "100"))
+
+ADMISSION_REJECTIONS = Counter(
+  "admission_rejections_total",
+  "Requests shed by admission control before doing any work",
+  ["traffic_class", "reason"],
+)
+CHAT_CONCURRENCY_LIMIT = Gauge(
+  "chat_concurrency_limit",
+  "Current adaptive concurrency limit for chat requests",
+  multiprocess_mode="livesum",
+)
+
+
+class Overloaded(HTTPException):
+  """A request shed by admission control."""
+
+
+def overloaded(traffic_class: str, reason: str, retry_after: float) -> Overloaded:
+  ADMISSION_REJECTIONS.labels(traffic_class=traffic_class, reason=reason).inc()
+  return Overloaded(
+    status_code=503,
+    detail="Server busy",
+    headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+  )
+
+
+# Sheds queued work in two ways. A request is refused when the queue ahead
+# of it, spread across the workers and multiplied by the smoothed service
+# time, would exceed the target wait. Its own render is left out, so an
+# empty queue always admits and a slow average cannot lock traffic out. Separately, as in CoDel, the queue is marked overloaded once every
+# job dequeued over a whole interval has waited longer than the target, and
+# stays that way until a job gets through under target.
+class QueueAdmission:
+  def __init__(self, target: float, interval: float, smoothing: float = 0.2) -> None:
+    self.target = target
+    self.interval = interval
+    self.smoothing = smoothing
+    self.service_time: float | None = None
+    self._first_above: float | None = None
+    self._dropping = False
+
+  def record_service(self, seconds: float) -> None:
+    if self.service_time is None:
+      self.service_time = seconds
+    else:
+      self.service_time += self.smoothing * (seconds - self.service_time)
+
+  def record_wait(self, seconds: float, now: float | None = None) -> None:
+    now = time.monotonic() if now is None else now
+    if seconds < self.target:
+      self._first_above = None
+      self._dropping = False
+      return
+    if self._first_above is None:
+      self._first_above = now + self.interval
+    elif now >= self._first_above:
+      self._dropping = True
+
+  def predicted_wait(self, ahead: int, workers: int) -> float:
+    if self.service_time is None:
+      return 0.0
+    return ahead / max(workers, 1) * self.service_time
+
+  def check(self, ahead: int, workers: int) -> HTTPException | None:
+    if self._dropping and ahead > 0:
+      return overloaded("pdf", "sojourn", self.target)
+    predicted = self.predicted_wait(ahead, workers)
+    if predicted > self.target:
+      return overloaded("pdf", "predicted_wait", predicted - self.target)
+    return None
+
+
+# AIMD concurrency limit in the style of Netflix's concurrency-limits: grow
+# by one while at least half the limit is in use and requests stay under the
+# latency target; back off multiplicatively on slow or failed requests.
+class AdaptiveConcurrencyLimit:
+  def __init__(
+    self,
+    initial: int,
+    min_limit: int,
+    max_limit: int,
+    target_latency: float,
+    backoff: float = 0.9,
+  ) -> None:
+    self.limit = float(initial)
+    self.min_limit = min_limit
+    self.max_limit = max_limit
+    self.target_latency = target_latency
+    self.backoff = backoff
+    self.in_flight = 0
+    CHAT_CONCURRENCY_LIMIT.set(self.limit)
+
+  def acquire(self) -> None:
+    if self.in_flight >= int(self.limit):
+      raise overloaded("chat", "concurrency", 1)
+    self.in_flight += 1
+
+  def release(self, latency: float, failed: bool = False) -> None:
+    in_flight = self.in_flight
+    self.in_flight = max(0, self.in_flight - 1)
+    if failed or latency > self.target_latency:
+      self.limit = max(self.min_limit, self.limit * self.backoff)
+    elif in_flight * 2 >= self.limit:
+      self.limit = min(self.max_limit, self.limit + 1)
+    CHAT_CONCURRENCY_LIMIT.set(self.limit)
+
+
+pdf_admission = QueueAdmission(PDF_TARGET_WAIT, PDF_ADMISSION_INTERVAL)
+chat_limit = AdaptiveConcurrencyLimit(
+  CHAT_INITIAL_CONCURRENCY,
+  CHAT_MIN_CONCURRENCY,
+  CHAT_MAX_CONCURRENCY,
+  CHAT_TARGET_LATENCY,
+)
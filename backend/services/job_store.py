@@ -0,0 +1,93 @@
+import os
+import secrets
+import time
+from dataclasses import dataclass, field
+from typing import Literal
+
+from fastapi import HTTPException
+
+from ..utils.processes import SERVER_PROCESSES
+from ..utils.ttl_cache import BoundedTTLCache
+
+PDF_JOB_TTL = float(os.getenv("PDF_JOB_TTL", "300"))
+PDF_JOB_MAX_PENDING = int(os.getenv("PDF_JOB_MAX_PENDING", "500"))
+PDF_JOB_MAX_BYTES = int(os.getenv("PDF_JOB_MAX_BYTES", str(50 * 1024 * 1024)))
+
+JobStatus = Literal["pending", "done", "failed"]
+
+
+@dataclass
+class PdfJob:
+  job_id: str
+  status: JobStatus = "pending"
+  created_at: float = field(default_factory=time.monotonic)
+  result: bytes | None = None
+  error: str | None = None
+  error_status: int | None = None
+
+
+class JobStore:
+  def __init__(
+    self, ttl: float, max_pending: int, max_bytes: int, processes: int = 1
+  ) -> None:
+    self.max_pending = max_pending
+    self.processes = processes
+    self._pending: dict[str, PdfJob] = {}
+    self._finished: BoundedTTLCache[PdfJob] = BoundedTTLCache(
+      ttl, max_entries=max_pending, max_bytes=max_bytes
+    )
+
+  def require_single_process(self) -> None:
+    # Jobs live in this process's memory. With several worker processes a
+    # status poll would usually reach one that never saw the job.
+    if self.processes > 1:
+      raise HTTPException(
+        status_code=501,
+        detail="PDF jobs are unavailable with multiple server processes; use /api/pdf",
+      )
+
+  def create(self) -> PdfJob:
+    if len(self._pending) >= self.max_pending:
+      raise HTTPException(
+        status_code=503,
+        detail="Too many pending jobs",
+        headers={"Retry-After": "5"},
+      )
+    job = PdfJob(job_id=secrets.token_urlsafe(16))
+    self._pending[job.job_id] = job
+    return job
+
+  def get(self, job_id: str) -> PdfJob | None:
+    job = self._pending.get(job_id)
+    if job is not None:
+      return job
+    return self._finished.get(job_id)
+
+  def complete(self, job_id: str, result: bytes) -> None:
+    job = self._pending.pop(job_id, None)
+    if job is None:
+      return
+    job.status = "done"
+    job.result = result
+    if not self._finished.set(job_id, job, len(result)):
+      self._fail(job, 507, "Result too large to store")
+
+  def fail(self, job_id: str, status_code: int, detail: str) -> None:
+    job = self._pending.pop(job_id, None)
+    if job is None:
+      return
+    self._fail(job, status_code, detail)
+
+  def _fail(self, job: PdfJob, status_code: int, detail: str) -> None:
+    job.status = "failed"
+    job.result = None
+    job.error = detail
+    job.error_status = status_code
+    self._finished.set(job.job_id, job, 0)
+
+  def clear(self) -> None:
+    self._pending.clear()
+    self._finished.clear()
+
+
+jobs = JobStore(PDF_JOB_TTL, PDF_JOB_MAX_PENDING, PDF_JOB_MAX_BYTES, SERVER_PROCESSES)
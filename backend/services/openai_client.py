@@ -1,14 +1,26 @@
 import os
+from functools import cache
+from typing import TYPE_CHECKING
 
 import structlog
-from openai import AsyncOpenAI
+
+if TYPE_CHECKING:
+  from openai import AsyncOpenAI
 
 logger = structlog.get_logger(__name__)
 
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
 
 
+# The openai package is the slowest import in the app, so the client is only
+# created when first needed.
+@cache
+def get_client() -> "AsyncOpenAI":
+  from openai import AsyncOpenAI
+
+  return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+
 async def validate_environment() -> None:
   api_key = os.getenv("OPENAI_API_KEY")
   if not api_key:
@@ -23,7 +35,7 @@ async def validate_environment() -> None:
     logger.info("Using test API key; skipping OpenAI connectivity check")
     return
   try:
-    await client.models.list()
+    await get_client().models.list()
   except Exception as exc:
     logger.error("OpenAI connectivity check failed", error=str(exc))
     raise RuntimeError(f"OpenAI connectivity check failed: {exc}") from exc
@@ -0,0 +1,194 @@
+import io
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+_XREF_STREAM = re.compile(rb"\s*\d+\s+\d+\s+obj")
+
+
+@dataclass(frozen=True)
+class _PdfObject:
+  idnum: int
+  generation: int
+  value: Any
+
+
+@dataclass(frozen=True)
+class IncrementalTemplate:
+  data: bytes
+  trailer: dict[str, Any]
+  size: int
+  # Offset of the template's xref table, or None when the table is damaged
+  # and every update has to carry a complete, corrected one instead.
+  prev: int | None
+  offsets: dict[int, tuple[int, int]]
+  fields: dict[str, tuple[_PdfObject, ...]]
+  form_holder: _PdfObject
+
+  def update(self, values: dict[str, str]) -> bytes:
+    """Return the update section that sets ``values`` when appended."""
+    from PyPDF2.generic import (
+      ArrayObject,
+      BooleanObject,
+      DictionaryObject,
+      NameObject,
+      NumberObject,
+      TextStringObject,
+    )
+
+    changed: dict[int, tuple[int, Any]] = {}
+    for name, value in values.items():
+      for field in self.fields.get(name, ()):
+        obj = DictionaryObject(field.value)
+        obj[NameObject("/V")] = TextStringObject(value)
+        changed[field.idnum] = (field.generation, obj)
+
+    # Without appearance streams, viewers only show the new values when asked
+    # to regenerate them. Fields stored directly in /AcroForm are updated in
+    # the copy as well.
+    holder = DictionaryObject(self.form_holder.value)
+    form = holder
+    if self.form_holder.idnum == self.trailer["/Root"].idnum:
+      form = DictionaryObject(holder.raw_get("/AcroForm"))
+      holder[NameObject("/AcroForm")] = form
+    form[NameObject("/NeedAppearances")] = BooleanObject(True)
+    if isinstance(form.raw_get("/Fields"), list):
+      fields = ArrayObject()
+      for entry in form.raw_get("/Fields"):
+        if isinstance(entry, dict) and entry.get("/T") in values:
+          entry = DictionaryObject(entry)
+          entry[NameObject("/V")] = TextStringObject(values[entry["/T"]])
+        fields.append(entry)
+      form[NameObject("/Fields")] = fields
+    changed[self.form_holder.idnum] = (self.form_holder.generation, holder)
+
+    out = io.BytesIO()
+    if not self.data.endswith((b"\n", b"\r")):
+      out.write(b"\n")
+    base = len(self.data)
+    entries = dict(self.offsets)
+    for idnum, (generation, obj) in sorted(changed.items()):
+      entries[idnum] = (base + out.tell(), generation)
+      out.write(f"{idnum} {generation} obj\n".encode())
+      obj.write_to_stream(out, None)
+      out.write(b"\nendobj\n")
+
+    xref = base + out.tell()
+    out.write(b"xref\n")
+    lines = {
+      idnum: f"{offset:010d} {generation:05d} n \n"
+      for idnum, (offset, generation) in entries.items()
+    }
+    if self.prev is None:
+      lines[0] = "0000000000 65535 f \n"
+    for start, run in _runs(sorted(lines)):
+      out.write(f"{start} {len(run)}\n".encode())
+      out.write("".join(lines[idnum] for idnum in run).encode())
+
+    trailer = DictionaryObject(
+      {NameObject(key): value for key, value in self.trailer.items()}
+    )
+    trailer[NameObject("/Size")] = NumberObject(max(self.size, max(entries) + 1))
+    if self.prev is not None:
+      trailer[NameObject("/Prev")] = NumberObject(self.prev)
+    out.write(b"trailer\n")
+    trailer.write_to_stream(out, None)
+    out.write(f"\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def _runs(numbers: list[int]) -> list[tuple[int, list[int]]]:
+  runs: list[tuple[int, list[int]]] = []
+  for number in numbers:
+    if runs and runs[-1][1][-1] == number - 1:
+      runs[-1][1].append(number)
+    else:
+      runs.append((number, [number]))
+  return runs
+
+
+def _startxref(data: bytes) -> int:
+  marker = data.rindex(b"startxref")
+  return int(data[marker + len(b"startxref"):].split()[0])
+
+
+def _index_field(ref, fields: dict[str, list[_PdfObject]], seen: set[int]) -> None:
+  from PyPDF2.generic import IndirectObject
+
+  if not isinstance(ref, IndirectObject) or ref.idnum in seen:
+    return
+  seen.add(ref.idnum)
+  obj = ref.get_object()
+  if "/T" in obj:
+    fields.setdefault(obj["/T"], []).append(_PdfObject(ref.idnum, ref.generation, obj))
+  for kid in obj.raw_get("/Kids") if "/Kids" in obj else ():
+    _index_field(kid, fields, seen)
+
+
+def load_template(path: Path) -> IncrementalTemplate | None:
+  """Parse ``path`` once for incremental fills; None if it cannot be updated."""
+  from PyPDF2 import PdfReader
+  from PyPDF2.generic import IndirectObject
+
+  data = path.read_bytes()
+  reader = PdfReader(io.BytesIO(data))
+  root_ref = reader.trailer.raw_get("/Root")
+  startxref = _startxref(data)
+  unsupported = None
+  if reader.is_encrypted:
+    unsupported = "encrypted"
+  elif reader.xref_objStm or _XREF_STREAM.match(data, startxref):
+    unsupported = "cross-reference stream"
+  elif "/AcroForm" not in reader.trailer["/Root"]:
+    unsupported = "no AcroForm"
+  if unsupported:
+    logger.warning("incremental fill unsupported", template=path.name, reason=unsupported)
+    return None
+
+  root = root_ref.get_object()
+  form_ref = root.raw_get("/AcroForm")
+  if isinstance(form_ref, IndirectObject):
+    holder = _PdfObject(form_ref.idnum, form_ref.generation, form_ref.get_object())
+  else:
+    holder = _PdfObject(root_ref.idnum, root_ref.generation, root)
+
+  fields: dict[str, list[_PdfObject]] = {}
+  seen: set[int] = set()
+  for ref in root["/AcroForm"].get("/Fields", ()):
+    _index_field(ref, fields, seen)
+  for page in reader.pages:
+    for ref in page.get("/Annots", ()):
+      _index_field(ref, fields, seen)
+
+  offsets: dict[int, tuple[int, int]] = {}
+  prev: int | None = startxref
+  if not data.startswith(b"xref", startxref):
+    # The declared offsets are wrong; PyPDF2 has already located every
+    # object, so carry corrected offsets instead of pointing at the table.
+    logger.warning("template xref damaged", template=path.name)
+    prev = None
+    offsets = {
+      idnum: (offset, generation)
+      for generation, objects in reader.xref.items()
+      for idnum, offset in objects.items()
+    }
+
+  trailer = {
+    key: reader.trailer.raw_get(key)
+    for key in ("/Root", "/Info", "/ID")
+    if key in reader.trailer
+  }
+  return IncrementalTemplate(
+    data=data,
+    trailer=trailer,
+    size=reader.trailer["/Size"],
+    prev=prev,
+    offsets=offsets,
+    fields={name: tuple(objects) for name, objects in fields.items()},
+    form_holder=holder,
+  )
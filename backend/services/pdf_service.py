@@ -1,47 +1,252 @@
 import io
+import os
+import json
+import time
 import asyncio
+import hashlib
 import zipfile
+from functools import cache
 from fastapi import HTTPException
-from PyPDF2 import PdfReader, PdfWriter
+from pathlib import Path
+from typing import Any
 
+from prometheus_client import Counter, Histogram
+
+from ..utils.cancellation import check_cancelled
 from ..utils.sanitization import sanitize_string
-from .template_service import FIELD_MAP, get_template_file, verify_template_integrity
+from ..utils.timing import StageTimer
+from ..utils.ttl_cache import BoundedTTLCache
+from .admission import pdf_admission
+from .pdf_incremental import IncrementalTemplate, load_template
+from .template_service import (
+  FIELD_MAP,
+  FieldLocation,
+  field_index,
+  get_template_file,
+  template_checksum,
+  verify_template_integrity,
+)
 
+# Packets contain petitioner details, so they are only ever cached in process
+# memory and for a short time.
+PDF_CACHE_TTL = float(os.getenv("PDF_CACHE_TTL", "60"))
+PDF_CACHE_MAX_ENTRIES = int(os.getenv("PDF_CACHE_MAX_ENTRIES", "32"))
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+# "rewrite" copies every page into a new document; "incremental" appends the
+# changed fields to the original template bytes.
+PDF_RENDER_MODE = os.getenv("PDF_RENDER_MODE", "rewrite")
+if PDF_RENDER_MODE not in ("rewrite", "incremental"):
+  raise RuntimeError(f"Invalid PDF_RENDER_MODE: {PDF_RENDER_MODE}")
 
-def _generate_pdf_sync(data: dict) -> io.BytesIO:
-  county = data.get("county", "General")
-  template_file = get_template_file(county)
-  if not template_file.exists():
-    raise HTTPException(status_code=404, detail="Template not found")
-  verify_template_integrity(template_file)
+packet_cache: BoundedTTLCache[bytes] = BoundedTTLCache(
+  PDF_CACHE_TTL, PDF_CACHE_MAX_ENTRIES, PDF_CACHE_MAX_BYTES
+)
+
+
+PDF_STAGE_LATENCY = Histogram(
+  "pdf_stage_duration_seconds",
+  "Latency of individual PDF render stages",
+  ["stage", "county"],
+)
+PDF_QUEUE_WAIT = Histogram(
+  "pdf_queue_wait_seconds",
+  "Time PDF jobs spend queued before rendering starts",
+  ["county"],
+)
+PDF_PACKET_BYTES = Histogram(
+  "pdf_packet_bytes",
+  "Size of generated PDF packets in bytes",
+  ["county"],
+  buckets=(16_384, 65_536, 262_144, 1_048_576, 4_194_304, 16_777_216),
+)
+PDF_CACHE_LOOKUPS = Counter(
+  "pdf_cache_lookups_total",
+  "Lookups in the generated packet cache",
+  ["county", "result"],
+)
 
-  with open(template_file, "rb") as f:
-    reader = PdfReader(f)
-    writer = PdfWriter()
-    for page in reader.pages:
-      writer.add_page(page)
 
+def _form_values(data: dict) -> dict[str, str]:
   form_values: dict[str, str] = {}
   for key, field in FIELD_MAP.items():
     value = data.get(key)
     if value is not None:
       form_values[field] = sanitize_string(str(value))
+  return form_values
+
+
+def packet_key(data: dict) -> str:
+  template_file = get_template_file(data.get("county", "General"))
+  payload = {
+    "template": template_checksum(template_file),
+    "fields": _form_values(data),
+  }
+  encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+  return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def get_cached_packet(data: dict, key: str | None = None) -> bytes | None:
+  if PDF_CACHE_TTL <= 0:
+    return None
+  cached = packet_cache.get(key or packet_key(data))
+  result = "hit" if cached is not None else "miss"
+  PDF_CACHE_LOOKUPS.labels(county=data.get("county", "General"), result=result).inc()
+  return cached
+
+
+def cache_packet(key: str, packet: bytes) -> None:
+  if PDF_CACHE_TTL <= 0:
+    return
+  packet_cache.set(key, packet, len(packet))
+
+
+def _fill_fields(
+  writer: Any,
+  index: dict[str, tuple[FieldLocation, ...]],
+  values: dict[str, str],
+) -> None:
+  """Set field values through the template's precomputed widget index."""
+  from PyPDF2.generic import (
+    ArrayObject,
+    BooleanObject,
+    DictionaryObject,
+    NameObject,
+    TextStringObject,
+  )
+
+  for name, value in values.items():
+    for location in index.get(name, ()):
+      page = writer.pages[location.page]
+      annot = page["/Annots"][location.annotation].get_object()
+      annot[NameObject("/V")] = TextStringObject(value)
+  # add_page does not carry the template's /AcroForm over.
+  fields = ArrayObject(
+    ref
+    for page in writer.pages
+    for ref in page.get("/Annots", ())
+    if "/T" in ref.get_object()
+  )
+  writer._root_object[NameObject("/AcroForm")] = writer._add_object(
+    DictionaryObject({
+      NameObject("/Fields"): fields,
+      NameObject("/NeedAppearances"): BooleanObject(True),
+    })
+  )
+
+
+@cache
+def incremental_template(template_file: Path) -> IncrementalTemplate | None:
+  """Load and index a template once; its bytes are verified on first load."""
+  verify_template_integrity(template_file)
+  return load_template(template_file)
+
 
+def _render_incremental(
+  template: IncrementalTemplate, data: dict, timer: StageTimer
+) -> bytes:
   try:
-    for page in writer.pages:
-      writer.update_page_form_field_values(page, form_values)
-    pdf_bytes = io.BytesIO()
-    writer.write(pdf_bytes)
+    with timer.stage("fill"):
+      update = template.update(_form_values(data))
+  except Exception as exc:
+    raise HTTPException(status_code=500, detail="Failed to generate PDF") from exc
+  check_cancelled()
+
+  with timer.stage("zip"):
+    zip_bytes = io.BytesIO()
+    with zipfile.ZipFile(zip_bytes, "w") as zf, zf.open("petition.pdf", "w") as pdf:
+      pdf.write(template.data)
+      pdf.write(update)
+  return zip_bytes.getvalue()
+
+
+def _render_packet(data: dict, timer: StageTimer) -> bytes:
+  county = data.get("county", "General")
+  template: IncrementalTemplate | None = None
+  with timer.stage("integrity"):
+    template_file = get_template_file(county)
+    if not template_file.exists():
+      raise HTTPException(status_code=404, detail="Template not found")
+    if PDF_RENDER_MODE == "incremental":
+      template = incremental_template(template_file)
+    if template is None:
+      verify_template_integrity(template_file)
+      index = field_index(template_file)
+  check_cancelled()
+  if template is not None:
+    return _render_incremental(template, data, timer)
+
+  # PyPDF2 is imported here rather than with the app, which keeps it off
+  # the cold-start path.
+  from PyPDF2 import PdfReader, PdfWriter
+
+  with timer.stage("template_load"):
+    with open(template_file, "rb") as f:
+      reader = PdfReader(f)
+      writer = PdfWriter()
+      for page in reader.pages:
+        writer.add_page(page)
+  check_cancelled()
+
+  try:
+    with timer.stage("fill"):
+      _fill_fields(writer, index, _form_values(data))
+    with timer.stage("write"):
+      pdf_bytes = io.BytesIO()
+      writer.write(pdf_bytes)
   except Exception as exc:
     raise HTTPException(status_code=500, detail="Failed to generate PDF") from exc
   pdf_bytes.seek(0)
+  check_cancelled()
+
+  with timer.stage("zip"):
+    zip_bytes = io.BytesIO()
+    with zipfile.ZipFile(zip_bytes, "w") as zf:
+      zf.writestr("petition.pdf", pdf_bytes.getvalue())
+  # Packets leave the render as immutable bytes, so the cache, coalesced
+  # callers, jobs and responses all share one object. Nothing else refers to
+  # the buffer yet, so getvalue() hands it over rather than copying it.
+  return zip_bytes.getvalue()
+
+
+WARMUP_PETITION = {
+  "petitioner_full_name": "Warmup Petitioner",
+  "respondent_full_name": "Warmup Respondent",
+}
+
 
-  zip_bytes = io.BytesIO()
-  with zipfile.ZipFile(zip_bytes, "w") as zf:
-    zf.writestr("petition.pdf", pdf_bytes.getvalue())
-  zip_bytes.seek(0)
-  return zip_bytes
+def prerender(county: str) -> None:
+  """Render and discard a dummy packet so the template is parsed and cached."""
+  _render_packet({"county": county, **WARMUP_PETITION}, StageTimer())
+
+
+def _generate_pdf_sync(data: dict) -> bytes:
+  county = data.get("county", "General")
+  timer = StageTimer()
+  try:
+    packet = _render_packet(data, timer)
+  finally:
+    timer.observe(PDF_STAGE_LATENCY, county=county)
+  PDF_PACKET_BYTES.labels(county=county).observe(len(packet))
+  return packet
 
 
-async def generate_pdf(data: dict) -> io.BytesIO:
-  return await asyncio.to_thread(_generate_pdf_sync, data)
+async def generate_pdf(
+  data: dict, key: str | None = None, enqueued_at: float | None = None
+) -> bytes:
+  if enqueued_at is not None:
+    county = data.get("county", "General")
+    PDF_QUEUE_WAIT.labels(county=county).observe(time.perf_counter() - enqueued_at)
+  # Callers that already checked the cache pass their key, so sanitizing and
+  # hashing the petition happens once per request.
+  key = key or packet_key(data)
+  # An identical request may have filled the cache while this one was queued.
+  cached = packet_cache.get(key) if PDF_CACHE_TTL > 0 else None
+  if cached is not None:
+    return cached
+  started = time.monotonic()
+  packet = await asyncio.to_thread(_generate_pdf_sync, data)
+  # Only real renders feed admission control; counting the cache hit above
+  # would pull the average service time down and admit too much work.
+  pdf_admission.record_service(time.monotonic() - started)
+  cache_packet(key, packet)
+  return packet
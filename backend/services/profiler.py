@@ -0,0 +1,56 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in {"1", "true", "yes"}
+MAX_PROFILE_SECONDS = 60.0
+SAMPLE_INTERVAL = 0.005
+
+
+class ProfilerBusyError(RuntimeError):
+  pass
+
+
+def _collapse(thread_name: str, frame: FrameType | None) -> str:
+  frames: list[str] = []
+  while frame is not None:
+    code = frame.f_code
+    frames.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+    frame = frame.f_back
+  frames.append(thread_name)
+  return ";".join(reversed(frames))
+
+
+# Stacks are only sampled while a capture is in progress; when idle the
+# profiler holds no threads or hooks.
+class SamplingProfiler:
+  def __init__(self, interval: float = SAMPLE_INTERVAL) -> None:
+    self.interval = interval
+    self._lock = threading.Lock()
+
+  def capture(self, seconds: float) -> str:
+    if not self._lock.acquire(blocking=False):
+      raise ProfilerBusyError("A profile is already being captured")
+    try:
+      return self._sample(seconds)
+    finally:
+      self._lock.release()
+
+  def _sample(self, seconds: float) -> str:
+    own_id = threading.get_ident()
+    stacks: Counter[str] = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+      names = {t.ident: t.name for t in threading.enumerate()}
+      for thread_id, frame in sys._current_frames().items():
+        if thread_id == own_id:
+          continue
+        stacks[_collapse(names.get(thread_id, str(thread_id)), frame)] += 1
+      time.sleep(self.interval)
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+
+
+profiler = SamplingProfiler()
@@ -1,6 +1,10 @@
 import hashlib
+import io
 import os
+from dataclasses import dataclass
+from functools import cache
 from pathlib import Path
+from typing import Any
 
 import structlog
 from fastapi import HTTPException
@@ -20,6 +24,13 @@ FIELD_MAP = {
   "respondent_full_name": "RespondentName",
 }
 
+COUNTY_TEMPLATES = {
+  "Harris": "harris.pdf",
+  "Dallas": "dallas.pdf",
+  "Travis": "travis.pdf",
+  "General": "tx_general.pdf",
+}
+
 # Pre-computed SHA-256 checksums for the standard PDF templates.
 # These values are used to verify the integrity of form templates at runtime.
 TEMPLATE_CHECKSUMS: dict[str, str] = {
@@ -39,6 +50,15 @@ def _resolve_template(path: Path) -> Path:
   return resolved
 
 
+def template_checksum(path: Path) -> str:
+  resolved = _resolve_template(path)
+  expected = TEMPLATE_CHECKSUMS.get(resolved.name)
+  if expected:
+    return expected
+  with open(resolved, "rb") as f:
+    return hashlib.sha256(f.read()).hexdigest()
+
+
 def verify_template_integrity(path: Path) -> None:
   resolved = _resolve_template(path)
   expected = TEMPLATE_CHECKSUMS.get(resolved.name)
@@ -52,11 +72,52 @@ def verify_template_integrity(path: Path) -> None:
 
 
 def get_template_file(county: str) -> Path:
-  template_map = {
-    "Harris": "harris.pdf",
-    "Dallas": "dallas.pdf",
-    "Travis": "travis.pdf",
-    "General": "tx_general.pdf",
-  }
-  candidate = FORMS_DIR / template_map.get(county, "tx_general.pdf")
+  candidate = FORMS_DIR / COUNTY_TEMPLATES.get(county, "tx_general.pdf")
   return _resolve_template(candidate)
+
+
+@dataclass(frozen=True)
+class FieldLocation:
+  """Widget annotation that displays a mapped field."""
+
+  page: int
+  # Position in the page's /Annots array.
+  annotation: int
+
+
+def index_fields(reader: Any, name: str) -> dict[str, tuple[FieldLocation, ...]]:
+  """Locate every ``FIELD_MAP`` widget in a parsed template, or raise RuntimeError."""
+  wanted = set(FIELD_MAP.values())
+  index: dict[str, list[FieldLocation]] = {}
+  for page_no, page in enumerate(reader.pages):
+    for position, ref in enumerate(page.get("/Annots", ())):
+      # PdfWriter drops /Parent when copying pages, so only an own /T counts.
+      field = ref.get_object().get("/T")
+      if field in wanted:
+        index.setdefault(field, []).append(FieldLocation(page_no, position))
+
+  missing = sorted(wanted - index.keys())
+  if missing:
+    raise RuntimeError(f"Template {name} is missing form fields: {', '.join(missing)}")
+  return {field: tuple(locations) for field, locations in index.items()}
+
+
+@cache
+def field_index(path: Path) -> dict[str, tuple[FieldLocation, ...]]:
+  """Verify and index a template once per process."""
+  from PyPDF2 import PdfReader
+
+  resolved = _resolve_template(path)
+  verify_template_integrity(resolved)
+  reader = PdfReader(io.BytesIO(resolved.read_bytes()))
+  return index_fields(reader, resolved.name)
+
+
+def validate_templates() -> None:
+  """Build the field index of every county template so gaps fail at startup."""
+  for name in sorted(set(COUNTY_TEMPLATES.values())):
+    path = _resolve_template(FORMS_DIR / name)
+    if not path.exists():
+      logger.warning("Template not found", file=name)
+      continue
+    field_index(path)
@@ -0,0 +1,45 @@
+import asyncio
+import time
+
+import structlog
+
+from ..utils.sanitization import sanitize_string
+from ..utils.validation import petition_validator
+from .openai_client import get_client
+from .pdf_service import prerender
+from .template_service import COUNTY_TEMPLATES
+
+logger = structlog.get_logger(__name__)
+
+_ready = False
+
+
+def is_ready() -> bool:
+  return _ready
+
+
+def _warm_up_sync() -> None:
+  petition_validator()
+  sanitize_string("")
+  # validate_environment() already made a request through this client when a
+  # real key is configured, so its connection pool is warm as well.
+  get_client()
+  for county in COUNTY_TEMPLATES:
+    prerender(county)
+
+
+async def warm_up() -> None:
+  """Pay first-request costs off the event loop, then report ready."""
+  global _ready
+  started = time.perf_counter()
+  try:
+    await asyncio.to_thread(_warm_up_sync)
+  except Exception as exc:
+    logger.error("warmup failed", error=str(exc))
+  else:
+    logger.info(
+      "warmup complete",
+      duration_ms=round((time.perf_counter() - started) * 1000, 2),
+    )
+  # A broken template must not keep the machine out of rotation for good.
+  _ready = True
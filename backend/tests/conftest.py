@@ -1,6 +1,8 @@
 import types
 import sys
 
+import pytest
+
 redis_stub = types.ModuleType("redis")
 redis_asyncio_stub = types.ModuleType("redis.asyncio")
 
@@ -13,3 +15,11 @@ redis_asyncio_stub.from_url = from_url
 redis_stub.asyncio = redis_asyncio_stub
 sys.modules["redis"] = redis_stub
 sys.modules["redis.asyncio"] = redis_asyncio_stub
+
+
+@pytest.fixture(autouse=True)
+def _clear_packet_cache():
+  yield
+  pdf_service = sys.modules.get("backend.services.pdf_service")
+  if pdf_service is not None:
+    pdf_service.packet_cache.clear()
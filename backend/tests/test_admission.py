@@ -0,0 +1,161 @@
+import os
+import asyncio
+
+import httpx
+import pytest
+
+os.environ["OPENAI_API_KEY"] = "test"
+os.environ["CHAT_API_KEY"] = "test-key"
+
+from backend.main import app
+from backend.services.admission import AdaptiveConcurrencyLimit, QueueAdmission
+from backend.worker import PRIORITY_LOW, WorkerQueue
+
+
+def test_predicted_wait_sheds_with_retry_after():
+  admission = QueueAdmission(target=1.0, interval=2.0)
+  assert admission.check(ahead=50, workers=1) is None
+  admission.record_service(0.5)
+  assert admission.check(ahead=0, workers=1) is None
+  assert admission.check(ahead=4, workers=2) is None
+  shed = admission.check(ahead=6, workers=2)
+  assert shed.status_code == 503
+  assert shed.headers["Retry-After"] == "1"
+  assert admission.check(ahead=10, workers=1).headers["Retry-After"] == "4"
+
+
+def test_slow_renders_never_shed_an_empty_queue():
+  admission = QueueAdmission(target=5.0, interval=2.0)
+  admission.record_service(6.0)
+  assert admission.check(ahead=0, workers=2) is None
+  assert admission.check(ahead=2, workers=2).status_code == 503
+
+
+def test_sojourn_above_target_for_an_interval_starts_shedding():
+  admission = QueueAdmission(target=1.0, interval=2.0)
+  admission.record_wait(1.5, now=10.0)
+  admission.record_wait(1.5, now=11.0)
+  assert admission.check(ahead=1, workers=1) is None
+  admission.record_wait(1.5, now=12.0)
+  assert admission.check(ahead=1, workers=1).status_code == 503
+  assert admission.check(ahead=0, workers=1) is None
+  admission.record_wait(0.1, now=12.5)
+  assert admission.check(ahead=1, workers=1) is None
+
+
+def test_concurrency_limit_grows_and_backs_off():
+  limit = AdaptiveConcurrencyLimit(
+    initial=2, min_limit=1, max_limit=3, target_latency=1.0, backoff=0.5
+  )
+  limit.acquire()
+  limit.acquire()
+  with pytest.raises(Exception) as exc:
+    limit.acquire()
+  assert exc.value.status_code == 503
+  assert exc.value.headers["Retry-After"] == "1"
+
+  limit.release(0.1)
+  assert limit.limit == 3
+  limit.release(0.1)
+  limit.acquire()
+  limit.release(5.0)
+  assert limit.limit == 1.5
+  limit.acquire()
+  limit.release(0.1, failed=True)
+  assert limit.limit == 1
+  assert limit.in_flight == 0
+
+
+def test_queue_sheds_interactive_jobs_but_not_background_submits():
+  async def _run():
+    admission = QueueAdmission(target=1.0, interval=2.0)
+    admission.record_service(2.0)
+    q = WorkerQueue(workers=1, admission=admission)
+    release = asyncio.Event()
+
+    async def slow():
+      await release.wait()
+
+    running = await q.enqueue(slow)
+    await asyncio.sleep(0)
+    queued = await q.enqueue(slow)
+    with pytest.raises(Exception) as exc:
+      await q.enqueue(slow)
+    assert exc.value.status_code == 503
+    background = await q.submit(slow, priority=PRIORITY_LOW)
+    release.set()
+    await asyncio.gather(running, queued, background)
+
+  asyncio.run(_run())
+
+
+def test_chat_returns_503_when_concurrency_limit_reached(monkeypatch):
+  full = AdaptiveConcurrencyLimit(
+    initial=1, min_limit=1, max_limit=1, target_latency=1.0
+  )
+  full.acquire()
+  monkeypatch.setattr("backend.api.chat.chat_limit", full)
+
+  async def _run():
+    async with httpx.AsyncClient(
+      transport=httpx.ASGITransport(app=app, client=("10.0.37.1", 0)),
+      base_url="http://testserver",
+    ) as client:
+      return await client.post(
+        "/api/chat",
+        json={"messages": [{"role": "user", "content": "hello"}]},
+        headers={"X-API-Key": "test-key"},
+      )
+
+  resp = asyncio.run(_run())
+  assert resp.status_code == 503
+  assert resp.headers["Retry-After"] == "1"
+
+
+def _queue_rejections(reason):
+  from prometheus_client import REGISTRY
+
+  return REGISTRY.get_sample_value(
+    "pdf_queue_rejections_total", {"county": "Travis", "reason": reason}
+  ) or 0
+
+
+def test_pdf_rejections_are_labelled_by_reason(monkeypatch):
+  from fastapi import HTTPException
+  from backend.api.pdf import _render
+
+  admission = QueueAdmission(target=1.0, interval=2.0)
+  admission.record_service(2.0)
+  data = {"county": "Travis", "petitioner_full_name": "A", "respondent_full_name": "B"}
+  before = {reason: _queue_rejections(reason) for reason in ("shed", "queue_full")}
+
+  async def _run():
+    busy = WorkerQueue(workers=1, admission=admission)
+    busy._worker_started = True
+    await busy.enqueue(asyncio.sleep, 0, client="10.0.37.1")
+    monkeypatch.setattr("backend.api.pdf.queue", busy)
+    with pytest.raises(HTTPException):
+      await _render(data, "10.0.37.2")
+    full = WorkerQueue(maxsize=0)
+    full._worker_started = True
+    monkeypatch.setattr("backend.api.pdf.queue", full)
+    with pytest.raises(HTTPException):
+      await _render(data, "10.0.37.2")
+
+  asyncio.run(_run())
+  assert _queue_rejections("shed") == before["shed"] + 1
+  assert _queue_rejections("queue_full") == before["queue_full"] + 1
+
+
+def test_only_real_renders_feed_service_time(monkeypatch):
+  from backend.services import pdf_service
+
+  admission = QueueAdmission(target=1.0, interval=2.0)
+  monkeypatch.setattr(pdf_service, "pdf_admission", admission)
+  data = {"county": "Travis", "petitioner_full_name": "A", "respondent_full_name": "B"}
+
+  asyncio.run(pdf_service.generate_pdf(data))
+  rendered = admission.service_time
+  assert rendered is not None
+  asyncio.run(pdf_service.generate_pdf(data))
+  assert admission.service_time == rendered
@@ -0,0 +1,82 @@
+import os
+import asyncio
+import httpx
+from openai.resources.chat.completions import AsyncCompletions
+from prometheus_client import REGISTRY
+
+os.environ["OPENAI_API_KEY"] = "test"
+os.environ["CHAT_API_KEY"] = "test-key"
+
+from backend.main import app
+from backend.api.chat import CHAT_MODEL
+
+
+def _sample(name, labels):
+  return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_chat_records_stage_timings_and_tokens(monkeypatch):
+  async def fake_create(self, *args, **kwargs):
+    class FakeMessage:
+      role = "assistant"
+      content = "hi"
+
+    class FakeUsage:
+      prompt_tokens = 12
+      completion_tokens = 3
+
+    class FakeResponse:
+      choices = [type("Choice", (), {"message": FakeMessage()})()]
+      usage = FakeUsage()
+
+    return FakeResponse()
+
+  stages = ["validation", "sanitization", "openai", "tool_parsing", "response"]
+  labels = {"model": CHAT_MODEL, "outcome": "success"}
+  before = {
+    stage: _sample("chat_stage_duration_seconds_count", {"stage": stage, **labels})
+    for stage in stages
+  }
+  prompt_before = _sample(
+    "chat_openai_tokens_total", {"model": CHAT_MODEL, "kind": "prompt"}
+  )
+
+  async def _run():
+    monkeypatch.setattr(AsyncCompletions, "create", fake_create)
+    async with httpx.AsyncClient(
+      transport=httpx.ASGITransport(app=app), base_url="http://testserver"
+    ) as client:
+      return await client.post(
+        "/api/chat",
+        json={"messages": [{"role": "user", "content": "hello"}]},
+        headers={"X-API-Key": "test-key"},
+      )
+
+  resp = asyncio.run(_run())
+  assert resp.status_code == 200
+  for stage in stages:
+    after = _sample("chat_stage_duration_seconds_count", {"stage": stage, **labels})
+    assert after == before[stage] + 1
+  prompt_after = _sample(
+    "chat_openai_tokens_total", {"model": CHAT_MODEL, "kind": "prompt"}
+  )
+  assert prompt_after == prompt_before + 12
+
+
+def test_rejected_chat_labels_outcome():
+  labels = {"stage": "validation", "model": CHAT_MODEL, "outcome": "rejected"}
+  before = _sample("chat_stage_duration_seconds_count", labels)
+
+  async def _run():
+    async with httpx.AsyncClient(
+      transport=httpx.ASGITransport(app=app), base_url="http://testserver"
+    ) as client:
+      return await client.post(
+        "/api/chat",
+        json={"messages": [{"role": "user", "content": "<script>x</script>"}]},
+        headers={"X-API-Key": "test-key"},
+      )
+
+  resp = asyncio.run(_run())
+  assert resp.status_code == 400
+  assert _sample("chat_stage_duration_seconds_count", labels) == before + 1
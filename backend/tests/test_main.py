@@ -62,7 +62,7 @@ def _fake_redis(monkeypatch):
     asyncio.run(_run())
 
 
-def test_pdf_generation(monkeypatch):
+def test_pdf_generation():
   async def _run():
     data = {
         "county": "General",
@@ -75,68 +75,6 @@ def test_pdf_generation(monkeypatch):
         "respondent_full_name": "John Doe",
     }
 
-    class DummyPage:
-        pass
-
-    class DummyReader:
-        def __init__(self, *args, **kwargs):
-            self.pages = [DummyPage()]
-
-    class DummyWriter:
-        def __init__(self, *args, **kwargs):
-            self.pages = []
-            self.values = {}
-
-        def add_page(self, page):
-            self.pages.append(page)
-
-        def update_page_form_field_values(self, page, data):
-            self.values.update(data)
-
-        def write(self, stream):
-            from PyPDF2 import PdfWriter
-            from PyPDF2.generic import (
-                ArrayObject,
-                DictionaryObject,
-                NameObject,
-                NumberObject,
-                TextStringObject,
-            )
-
-            writer = PdfWriter()
-            writer.add_blank_page(width=300, height=400)
-            fields_arr = ArrayObject()
-            for idx, (name, value) in enumerate(self.values.items()):
-                annot = DictionaryObject({
-                    NameObject("/T"): TextStringObject(name),
-                    NameObject("/FT"): NameObject("/Tx"),
-                    NameObject("/Rect"): ArrayObject([
-                        NumberObject(0),
-                        NumberObject(idx * 20),
-                        NumberObject(100),
-                        NumberObject(idx * 20 + 20),
-                    ]),
-                    NameObject("/V"): TextStringObject(value),
-                    NameObject("/Ff"): NumberObject(0),
-                    NameObject("/Type"): NameObject("/Annot"),
-                    NameObject("/Subtype"): NameObject("/Widget"),
-                })
-                writer.add_annotation(0, annot)
-                fields_arr.append(annot)
-            writer._root_object.update(
-                {
-                    NameObject("/AcroForm"): DictionaryObject(
-                        {NameObject("/Fields"): fields_arr}
-                    )
-                }
-            )
-            writer.write(stream)
-
-    monkeypatch.setattr(
-        "backend.services.pdf_service.PdfReader", lambda *args, **kwargs: DummyReader()
-    )
-    monkeypatch.setattr("backend.services.pdf_service.PdfWriter", DummyWriter)
-
     async with httpx.AsyncClient(
         transport=httpx.ASGITransport(app=app), base_url="http://testserver"
     ) as client:
@@ -433,3 +371,33 @@ def test_pdf_invalid_schema():
 
   asyncio.run(_run())
 
+
+
+def test_shutdown_signal_schedules_callback_and_chains_server_handler():
+  import signal
+
+  from backend.main import on_shutdown_signal
+
+  seen = []
+
+  def server_handler(signum, frame):
+    seen.append("server")
+
+  previous = signal.signal(signal.SIGTERM, server_handler)
+  try:
+    async def _run():
+      stopped = asyncio.Event()
+
+      async def stop():
+        seen.append("pdf")
+        stopped.set()
+
+      with on_shutdown_signal(stop):
+        signal.raise_signal(signal.SIGTERM)
+        await asyncio.wait_for(stopped.wait(), 1)
+      assert signal.getsignal(signal.SIGTERM) is server_handler
+
+    asyncio.run(_run())
+  finally:
+    signal.signal(signal.SIGTERM, previous)
+  assert seen == ["server", "pdf"]
@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+
+INCREMENT = """
+from backend.api.chat import CHAT_REQUESTS
+from backend.worker import PDF_QUEUE_DEPTH
+CHAT_REQUESTS.inc()
+PDF_QUEUE_DEPTH.inc()
+"""
+
+SCRAPE = """
+import os
+from backend.api.chat import CHAT_REQUESTS
+from backend.utils.metrics import mark_worker_exit, render_metrics
+CHAT_REQUESTS.inc()
+print(render_metrics().decode())
+mark_worker_exit()
+"""
+
+
+def _run(code: str, env: dict) -> str:
+  result = subprocess.run(
+    [sys.executable, "-c", code],
+    cwd=ROOT,
+    env=env,
+    capture_output=True,
+    text=True,
+    check=True,
+  )
+  return result.stdout
+
+
+def test_metrics_aggregate_across_processes(tmp_path):
+  env = {
+    **os.environ,
+    "PROMETHEUS_MULTIPROC_DIR": str(tmp_path),
+    "OPENAI_API_KEY": "test",
+  }
+  _run(INCREMENT, env)
+  output = _run(SCRAPE, env)
+  assert "chat_requests_total 2.0" in output
+  assert list(tmp_path.glob("gauge_livesum_*.db"))
+
+
+def test_worker_exit_removes_live_gauges(tmp_path):
+  env = {
+    **os.environ,
+    "PROMETHEUS_MULTIPROC_DIR": str(tmp_path),
+    "OPENAI_API_KEY": "test",
+  }
+  _run(INCREMENT + "\nfrom backend.utils.metrics import mark_worker_exit\nmark_worker_exit()\n", env)
+  assert not list(tmp_path.glob("gauge_livesum_*.db"))
+  assert list(tmp_path.glob("counter_*.db"))
@@ -0,0 +1,115 @@
+import os
+import asyncio
+import io
+import json
+import zipfile
+
+import httpx
+import pytest
+
+os.environ["OPENAI_API_KEY"] = "test"
+os.environ["CHAT_API_KEY"] = "test-key"
+
+from backend.main import app
+from backend.worker import WorkerQueue
+
+HEADERS = {"X-API-Key": "test-key"}
+
+
+@pytest.fixture(autouse=True)
+def _fresh_queue(monkeypatch):
+  monkeypatch.setattr("backend.api.pdf.queue", WorkerQueue(workers=2))
+
+
+def _post(body, ip):
+  async def _run():
+    async with httpx.AsyncClient(
+      transport=httpx.ASGITransport(app=app, client=(ip, 0)),
+      base_url="http://testserver",
+    ) as client:
+      return await client.post("/api/pdf/batch", json=body, headers=HEADERS)
+
+  return asyncio.run(_run())
+
+
+def test_batch_returns_combined_zip_with_manifest():
+  petitions = [
+    {"county": "Harris", "petitioner_full_name": "Jane Doe", "respondent_full_name": "John Doe"},
+    {"county": "Harris"},
+    {"county": "Dallas", "petitioner_full_name": "Ann Roe", "respondent_full_name": "Rick Roe"},
+  ]
+  resp = _post({"petitions": petitions}, "10.0.34.1")
+  assert resp.status_code == 200
+  with zipfile.ZipFile(io.BytesIO(resp.content)) as zf:
+    names = set(zf.namelist())
+    manifest = json.loads(zf.read("manifest.json"))
+  assert names == {"petition_01.pdf", "petition_03.pdf", "manifest.json"}
+  assert [item["status"] for item in manifest] == ["ok", "error", "ok"]
+  assert manifest[1]["status_code"] == 400
+
+
+def test_batch_rejects_oversized_and_empty_batches():
+  petition = {"county": "General", "petitioner_full_name": "A", "respondent_full_name": "B"}
+  too_many = _post({"petitions": [petition] * 11}, "10.0.34.2")
+  empty = _post({"petitions": []}, "10.0.34.2")
+  assert too_many.status_code == 413
+  assert empty.status_code == 400
+
+
+def test_batch_with_no_valid_petitions_reports_items():
+  resp = _post({"petitions": [{"county": "Harris"}]}, "10.0.34.3")
+  assert resp.status_code == 422
+  assert resp.json()["items"][0]["detail"] == "Invalid petition data"
+
+
+def test_batch_stops_rendering_once_output_cap_is_exceeded(monkeypatch):
+  cancelled = []
+
+  async def fake_render(data, client, priority, wait_for_slot):
+    index = int(data["petitioner_full_name"])
+    try:
+      if index >= 2:
+        await asyncio.Event().wait()
+      await asyncio.sleep(0.01 * index)
+    except asyncio.CancelledError:
+      cancelled.append(index)
+      raise
+    packet = io.BytesIO()
+    with zipfile.ZipFile(packet, "w") as zf:
+      zf.writestr("petition.pdf", b"%" * 100)
+    return packet.getvalue()
+
+  monkeypatch.setattr("backend.api.pdf._render", fake_render)
+  monkeypatch.setattr("backend.api.pdf.MAX_BATCH_OUTPUT_BYTES", 150)
+  petitions = [
+    {"county": "General", "petitioner_full_name": str(i), "respondent_full_name": "B"}
+    for i in range(4)
+  ]
+  resp = _post({"petitions": petitions}, "10.0.34.4")
+  assert resp.status_code == 200
+  with zipfile.ZipFile(io.BytesIO(resp.content)) as zf:
+    names = set(zf.namelist())
+    manifest = json.loads(zf.read("manifest.json"))
+  assert names == {"petition_01.pdf", "manifest.json"}
+  assert [item["status"] for item in manifest] == ["ok", "error", "error", "error"]
+  assert [item.get("status_code") for item in manifest[1:]] == [413, 413, 413]
+  assert sorted(cancelled) == [2, 3]
+
+
+def test_batch_accepts_full_size_petitions_up_to_its_own_body_limit():
+  petition = {
+    "county": "General",
+    "petitioner_full_name": "Jane Doe",
+    "petitioner_address": "1 Main St, Apt 2 " * 50,
+    "respondent_full_name": "John Doe " * 100,
+    "case_no": "2024-PO-" + "0" * 890,
+  }
+  assert 2_500 < len(json.dumps(petition)) < 10_000
+  resp = _post({"petitions": [petition] * 10}, "10.0.34.5")
+  assert resp.status_code == 200
+  with zipfile.ZipFile(io.BytesIO(resp.content)) as zf:
+    manifest = json.loads(zf.read("manifest.json"))
+  assert [item["status"] for item in manifest] == ["ok"] * 10
+
+  too_large = _post({"petitions": [{"padding": "x" * 100_000}]}, "10.0.34.5")
+  assert (too_large.status_code, too_large.json()["detail"]) == (413, "Request too large")
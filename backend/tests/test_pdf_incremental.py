@@ -0,0 +1,98 @@
+import io
+import os
+import zipfile
+
+import pytest
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import (
+  ArrayObject,
+  DictionaryObject,
+  NameObject,
+  NumberObject,
+  TextStringObject,
+)
+
+os.environ["OPENAI_API_KEY"] = "test"
+
+from backend.services import pdf_service
+from backend.services.pdf_incremental import _startxref, load_template
+from backend.services.template_service import get_template_file
+
+DATA = {
+  "county": "General",
+  "case_no": "123",
+  "petitioner_full_name": "Jane Doe",
+  "respondent_full_name": "John Doe",
+}
+
+
+@pytest.fixture(autouse=True)
+def _incremental_mode(monkeypatch):
+  monkeypatch.setattr(pdf_service, "PDF_RENDER_MODE", "incremental")
+  pdf_service.incremental_template.cache_clear()
+  yield
+  pdf_service.incremental_template.cache_clear()
+
+
+def _petition_pdf(packet: bytes) -> bytes:
+  with zipfile.ZipFile(io.BytesIO(packet)) as zf:
+    return zf.read("petition.pdf")
+
+
+def _form_pdf(tmp_path, with_form=True):
+  writer = PdfWriter()
+  writer.add_blank_page(width=612, height=792)
+  if with_form:
+    field = writer._add_object(
+      DictionaryObject({
+        NameObject("/T"): TextStringObject("CaseNumber"),
+        NameObject("/FT"): NameObject("/Tx"),
+        NameObject("/Type"): NameObject("/Annot"),
+        NameObject("/Subtype"): NameObject("/Widget"),
+        NameObject("/Rect"): ArrayObject([NumberObject(n) for n in (0, 0, 100, 20)]),
+      })
+    )
+    writer.pages[0][NameObject("/Annots")] = ArrayObject([field])
+    writer._root_object[NameObject("/AcroForm")] = writer._add_object(
+      DictionaryObject({NameObject("/Fields"): ArrayObject([field])})
+    )
+  path = tmp_path / "form.pdf"
+  with open(path, "wb") as f:
+    writer.write(f)
+  return path
+
+
+def test_incremental_fill_appends_to_the_template():
+  template = get_template_file("General").read_bytes()
+  pdf = _petition_pdf(pdf_service._generate_pdf_sync(DATA))
+  assert pdf.startswith(template)
+
+  reader = PdfReader(io.BytesIO(pdf), strict=True)
+  fields = {name: field.get("/V") for name, field in reader.get_fields().items()}
+  assert fields["CaseNumber"] == "123"
+  assert fields["PetitionerName"] == "Jane Doe"
+  assert fields["HearingDate"] is None
+  widgets = {
+    annot.get_object()["/T"]: annot.get_object().get("/V")
+    for annot in reader.pages[0]["/Annots"]
+  }
+  assert widgets["RespondentName"] == "John Doe"
+  assert reader.trailer["/Root"]["/AcroForm"]["/NeedAppearances"].value is True
+
+
+def test_update_section_points_at_the_original_xref(tmp_path):
+  path = _form_pdf(tmp_path)
+  original = path.read_bytes()
+  template = load_template(path)
+  assert template.prev == _startxref(original)
+
+  update = template.update({"CaseNumber": "2024-CV-1"})
+  reader = PdfReader(io.BytesIO(original + update), strict=True)
+  assert reader.trailer["/Prev"] == template.prev
+  assert reader.get_fields()["CaseNumber"]["/V"] == "2024-CV-1"
+  # Only the field and the AcroForm dictionary are rewritten.
+  assert update.count(b" obj\n") == 2
+
+
+def test_templates_without_a_form_fall_back_to_rewrite(tmp_path):
+  assert load_template(_form_pdf(tmp_path, with_form=False)) is None
@@ -0,0 +1,216 @@
+import os
+import asyncio
+import io
+import zipfile
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+os.environ["OPENAI_API_KEY"] = "test"
+os.environ["CHAT_API_KEY"] = "test-key"
+
+from backend.main import app
+from backend.api.pdf import PacketResponse
+from backend.services.job_store import JobStore, jobs
+
+DATA = {
+  "county": "General",
+  "petitioner_full_name": "Jane Doe",
+  "respondent_full_name": "John Doe",
+}
+HEADERS = {"X-API-Key": "test-key"}
+
+
+@pytest.fixture(autouse=True)
+def _clear_jobs():
+  jobs.clear()
+  yield
+  jobs.clear()
+
+
+def _client():
+  return httpx.AsyncClient(
+    transport=httpx.ASGITransport(app=app, client=("10.0.31.1", 0)),
+    base_url="http://testserver",
+  )
+
+
+def test_job_is_accepted_and_result_retrieved(monkeypatch):
+  async def _run():
+    ready = asyncio.Event()
+
+    async def fake_submit(func, *args, **kwargs):
+      future = asyncio.get_running_loop().create_future()
+
+      async def finish():
+        await ready.wait()
+        zip_bytes = io.BytesIO()
+        with zipfile.ZipFile(zip_bytes, "w") as zf:
+          zf.writestr("petition.pdf", b"dummy")
+        future.set_result(zip_bytes.getvalue())
+
+      asyncio.create_task(finish())
+      return future
+
+    monkeypatch.setattr("backend.api.pdf.queue.submit", fake_submit)
+    async with _client() as client:
+      resp = await client.post("/api/pdf/jobs", json=DATA, headers=HEADERS)
+      assert resp.status_code == 202
+      body = resp.json()
+      assert body["status"] == "pending"
+      assert resp.headers["Location"] == body["status_url"]
+
+      pending = await client.get(body["status_url"], headers=HEADERS)
+      assert pending.status_code == 202
+      assert pending.json()["status"] == "pending"
+
+      ready.set()
+      for _ in range(10):
+        await asyncio.sleep(0)
+      done = await client.get(body["status_url"], headers=HEADERS)
+    assert done.status_code == 200
+    assert done.headers["content-type"] == "application/zip"
+    assert done.headers["content-length"] == str(len(done.content))
+    with zipfile.ZipFile(io.BytesIO(done.content)) as zf:
+      assert zf.read("petition.pdf") == b"dummy"
+
+  asyncio.run(_run())
+
+
+def test_failed_job_reports_error(monkeypatch):
+  async def fake_submit(func, *args, **kwargs):
+    raise HTTPException(status_code=500, detail="Failed to generate PDF")
+
+  async def _run():
+    monkeypatch.setattr("backend.api.pdf.queue.submit", fake_submit)
+    async with _client() as client:
+      resp = await client.post("/api/pdf/jobs", json=DATA, headers=HEADERS)
+      await asyncio.sleep(0)
+      status = await client.get(resp.json()["status_url"], headers=HEADERS)
+    assert status.status_code == 200
+    assert status.json()["status"] == "failed"
+    assert status.json()["detail"] == "Failed to generate PDF"
+
+  asyncio.run(_run())
+
+
+def test_shutdown_fails_unfinished_jobs_and_refuses_new_ones(monkeypatch):
+  from backend import main
+  from backend.worker import WorkerQueue
+
+  fresh = WorkerQueue()
+  monkeypatch.setattr("backend.api.pdf.queue", fresh)
+  monkeypatch.setattr(main, "queue", fresh)
+  cancelled = asyncio.Event()
+
+  async def endless(*args, **kwargs):
+    try:
+      await asyncio.Event().wait()
+    except asyncio.CancelledError:
+      cancelled.set()
+      raise
+
+  monkeypatch.setattr("backend.api.pdf._render", endless)
+
+  async def _run():
+    async with _client() as client:
+      resp = await client.post("/api/pdf/jobs", json=DATA, headers=HEADERS)
+      status_url = resp.json()["status_url"]
+      await main.stop_pdf_intake()
+      await asyncio.wait_for(cancelled.wait(), 1)
+      status = await client.get(status_url, headers=HEADERS)
+      refused = await client.post("/api/pdf/jobs", json=DATA, headers=HEADERS)
+    return status, refused
+
+  status, refused = asyncio.run(_run())
+  assert status.json()["status"] == "failed"
+  assert status.json()["error_status"] == 503
+  assert refused.status_code == 503
+  assert refused.headers["Retry-After"] == "1"
+
+
+def test_unknown_job_and_missing_key():
+  async def _run():
+    async with _client() as client:
+      missing = await client.get("/api/pdf/jobs/nope", headers=HEADERS)
+      unauthorized = await client.get("/api/pdf/jobs/nope")
+    assert missing.status_code == 404
+    assert unauthorized.status_code == 401
+
+  asyncio.run(_run())
+
+
+def test_job_store_bounds():
+  store = JobStore(ttl=10, max_pending=1, max_bytes=10)
+  job = store.create()
+  with pytest.raises(HTTPException) as exc:
+    store.create()
+  assert exc.value.status_code == 503
+
+  store.complete(job.job_id, b"x" * 11)
+  assert store.get(job.job_id).status == "failed"
+
+  job = store.create()
+  store.complete(job.job_id, b"zip")
+  assert store.get(job.job_id).result == b"zip"
+
+  expiring = JobStore(ttl=0, max_pending=1, max_bytes=10)
+  job = expiring.create()
+  expiring.complete(job.job_id, b"zip")
+  assert expiring.get(job.job_id) is None
+
+
+def test_jobs_are_refused_with_multiple_processes(monkeypatch):
+  monkeypatch.setattr(jobs, "processes", 2)
+
+  async def _run():
+    async with _client() as client:
+      created = await client.post("/api/pdf/jobs", json=DATA, headers=HEADERS)
+      polled = await client.get("/api/pdf/jobs/anything", headers=HEADERS)
+      return created, polled
+
+  created, polled = asyncio.run(_run())
+  assert created.status_code == polled.status_code == 501
+  assert "multiple server processes" in created.json()["detail"]
+  assert not jobs._pending
+
+
+def test_packet_response_sends_fixed_size_slices():
+  messages = []
+  packet = b"0123"
+
+  async def send(message):
+    messages.append(message)
+
+  async def _run():
+    await PacketResponse(b"0123456789", "po_packet.zip", chunk_size=4)(
+      {"type": "http"}, None, send
+    )
+    await PacketResponse(packet, "po_packet.zip", chunk_size=4)(
+      {"type": "http"}, None, send
+    )
+
+  asyncio.run(_run())
+  assert (b"content-length", b"10") in messages[0]["headers"]
+  assert [(m["body"], m["more_body"]) for m in messages[1:4]] == [
+    (b"0123", True), (b"4567", True), (b"89", False)
+  ]
+  assert messages[5] == {"type": "http.response.body", "body": b"0123"}
+  assert messages[5]["body"] is packet
+
+
+def test_large_job_result_is_sliced_through_the_middleware(monkeypatch):
+  monkeypatch.setattr("backend.api.pdf.PDF_SEND_CHUNK_BYTES", 1000)
+  job = jobs.create()
+  payload = os.urandom(4500)
+  jobs.complete(job.job_id, payload)
+
+  async def _run():
+    async with _client() as client:
+      return await client.get(f"/api/pdf/jobs/{job.job_id}", headers=HEADERS)
+
+  resp = asyncio.run(_run())
+  assert resp.status_code == 200
+  assert resp.content == payload
+  assert resp.headers["content-length"] == "4500"
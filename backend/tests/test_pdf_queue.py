@@ -41,8 +41,7 @@ def test_route_enqueues_and_returns_zip(monkeypatch):
     zip_bytes = io.BytesIO()
     with zipfile.ZipFile(zip_bytes, "w") as zf:
       zf.writestr("petition.pdf", b"dummy")
-    zip_bytes.seek(0)
-    future.set_result(zip_bytes)
+    future.set_result(zip_bytes.getvalue())
     return future
 
   monkeypatch.setattr("backend.api.pdf.queue.enqueue", fake_enqueue)
@@ -69,3 +68,173 @@ def test_route_enqueues_and_returns_zip(monkeypatch):
   assert called["func"] is generate_pdf
   with zipfile.ZipFile(io.BytesIO(resp.content)) as zf:
     assert zf.read("petition.pdf") == b"dummy"
+
+
+def test_generate_pdf_records_stage_metrics():
+  from prometheus_client import REGISTRY
+
+  def count(name, labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+  stages = ["integrity", "template_load", "fill", "write", "zip"]
+  before = {
+    stage: count("pdf_stage_duration_seconds_count", {"stage": stage, "county": "Travis"})
+    for stage in stages
+  }
+  wait_before = count("pdf_queue_wait_seconds_count", {"county": "Travis"})
+  data = {
+    "county": "Travis",
+    "petitioner_full_name": "Jane Doe",
+    "respondent_full_name": "John Doe",
+  }
+
+  packet = asyncio.run(generate_pdf(data, enqueued_at=0.0))
+  with zipfile.ZipFile(io.BytesIO(packet)) as zf:
+    assert "petition.pdf" in zf.namelist()
+  for stage in stages:
+    after = count("pdf_stage_duration_seconds_count", {"stage": stage, "county": "Travis"})
+    assert after == before[stage] + 1
+  assert count("pdf_queue_wait_seconds_count", {"county": "Travis"}) == wait_before + 1
+  assert count("pdf_packet_bytes_count", {"county": "Travis"}) >= 1
+  # The cached packet is handed out as the same bytes object, not a copy.
+  assert asyncio.run(generate_pdf(data)) is packet
+
+
+def test_identical_request_served_from_cache(monkeypatch):
+  calls = []
+
+  async def counting_enqueue(
+    func, *args, client=None, priority=None, deadline=None, **kwargs
+  ):
+    calls.append(args)
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    future.set_result(await func(*args, **kwargs))
+    return future
+
+  monkeypatch.setattr("backend.api.pdf.queue.enqueue", counting_enqueue)
+  from backend.services import pdf_service
+
+  keys = []
+
+  def counting_key(data):
+    keys.append(data)
+    return packet_key(data)
+
+  packet_key = pdf_service.packet_key
+  monkeypatch.setattr("backend.api.pdf.packet_key", counting_key)
+  monkeypatch.setattr(pdf_service, "packet_key", counting_key)
+  data = {
+    "county": "Harris",
+    "petitioner_full_name": "Jane Doe",
+    "respondent_full_name": "John Doe",
+  }
+
+  async def _run():
+    async with httpx.AsyncClient(
+      transport=httpx.ASGITransport(app=app, client=("10.0.32.1", 0)),
+      base_url="http://testserver",
+    ) as client:
+      first = await client.post("/api/pdf", json=data, headers={"X-API-Key": "test-key"})
+      second = await client.post("/api/pdf", json=data, headers={"X-API-Key": "test-key"})
+      changed = await client.post(
+        "/api/pdf",
+        json={**data, "respondent_full_name": "Someone Else"},
+        headers={"X-API-Key": "test-key"},
+      )
+    return first, second, changed
+
+  first, second, changed = asyncio.run(_run())
+  assert first.status_code == second.status_code == changed.status_code == 200
+  assert first.content == second.content
+  assert len(calls) == 2
+  # Each request sanitizes and hashes its petition once, misses included.
+  assert len(keys) == 3
+
+
+def test_closed_connection_cancels_render(monkeypatch):
+  import json
+  import uvicorn
+
+  started = asyncio.Event()
+  cancelled = asyncio.Event()
+
+  async def slow_render(*args, **kwargs):
+    started.set()
+    try:
+      await asyncio.Event().wait()
+    except asyncio.CancelledError:
+      cancelled.set()
+      raise
+
+  monkeypatch.setattr("backend.api.pdf._render", slow_render)
+  body = json.dumps({
+    "county": "General",
+    "petitioner_full_name": "Jane Doe",
+    "respondent_full_name": "John Doe",
+  }).encode()
+  head = (
+    "POST /api/pdf HTTP/1.1\r\nHost: testserver\r\nX-API-Key: test-key\r\n"
+    "X-Forwarded-For: 10.0.36.1\r\nContent-Type: application/json\r\n"
+    f"Content-Length: {len(body)}\r\n\r\n"
+  )
+
+  async def _run():
+    server = uvicorn.Server(
+      uvicorn.Config(app, host="127.0.0.1", port=0, lifespan="off", log_level="warning")
+    )
+    serving = asyncio.create_task(server.serve())
+    try:
+      while not server.started:
+        await asyncio.sleep(0.01)
+      port = server.servers[0].sockets[0].getsockname()[1]
+      _, writer = await asyncio.open_connection("127.0.0.1", port)
+      writer.write(head.encode() + body)
+      await writer.drain()
+      await asyncio.wait_for(started.wait(), 5)
+      writer.close()
+      await asyncio.wait_for(cancelled.wait(), 5)
+    finally:
+      server.should_exit = True
+      await serving
+
+  asyncio.run(_run())
+
+
+def test_background_render_does_not_inherit_interactive_queue_full(monkeypatch):
+  from fastapi import HTTPException
+  from backend.api.pdf import _render
+  from backend.worker import PRIORITY_LOW
+
+  data = {
+    "county": "Dallas",
+    "petitioner_full_name": "Jane Doe",
+    "respondent_full_name": "John Doe",
+  }
+
+  async def run():
+    full = asyncio.Event()
+
+    async def full_enqueue(*args, **kwargs):
+      await full.wait()
+      raise HTTPException(status_code=503, detail="Queue full")
+
+    async def waiting_submit(func, *args, client=None, priority=None, deadline=None, **kwargs):
+      future = asyncio.get_running_loop().create_future()
+      future.set_result(await func(*args, **kwargs))
+      return future
+
+    monkeypatch.setattr("backend.api.pdf.queue.enqueue", full_enqueue)
+    monkeypatch.setattr("backend.api.pdf.queue.submit", waiting_submit)
+    interactive = asyncio.create_task(_render(data, "10.0.33.1"))
+    await asyncio.sleep(0)
+    job = asyncio.create_task(_render(data, "10.0.33.1", PRIORITY_LOW, wait_for_slot=True))
+    await asyncio.sleep(0)
+    full.set()
+    with pytest.raises(HTTPException) as exc:
+      await interactive
+    assert exc.value.status_code == 503
+    with zipfile.ZipFile(io.BytesIO(await job)) as zf:
+      assert "petition.pdf" in zf.namelist()
+
+  asyncio.run(run())
@@ -0,0 +1,40 @@
+import os
+import asyncio
+import httpx
+
+os.environ["OPENAI_API_KEY"] = "test"
+os.environ["CHAT_API_KEY"] = "test-key"
+
+from backend.main import app
+
+
+def _post(path, headers=None):
+  async def _run():
+    async with httpx.AsyncClient(
+      transport=httpx.ASGITransport(app=app), base_url="http://testserver"
+    ) as client:
+      return await client.post(path, headers=headers or {})
+
+  return asyncio.run(_run())
+
+
+def test_profile_endpoint_disabled_by_default():
+  resp = _post("/admin/profile?seconds=0.1", {"X-API-Key": "test-key"})
+  assert resp.status_code == 404
+
+
+def test_profile_endpoint_requires_api_key(monkeypatch):
+  monkeypatch.setattr("backend.services.profiler.PROFILING_ENABLED", True)
+  resp = _post("/admin/profile?seconds=0.1")
+  assert resp.status_code == 401
+
+
+def test_profile_endpoint_returns_collapsed_stacks(monkeypatch):
+  monkeypatch.setattr("backend.services.profiler.PROFILING_ENABLED", True)
+  resp = _post("/admin/profile?seconds=0.1", {"X-API-Key": "test-key"})
+  assert resp.status_code == 200
+  lines = resp.text.splitlines()
+  assert lines
+  stack, count = lines[0].rsplit(" ", 1)
+  assert ";" in stack
+  assert int(count) > 0
@@ -1,13 +1,23 @@
 import os
 import asyncio
+import time
 import httpx
 import pytest
 import redis.asyncio as redis_asyncio
+from prometheus_client import REGISTRY
 from fastapi import Request
 from fastapi.responses import JSONResponse
 
 from backend.main import create_app
-from backend.middleware.rate_limit import InMemoryRateLimiter, RedisRateLimiter, rate_limit
+from backend.middleware.rate_limit import (
+  HybridRateLimiter,
+  InMemoryRateLimiter,
+  RateLimitRule,
+  RateLimitRules,
+  RedisRateLimiter,
+  load_rate_limit_rules,
+  rate_limit,
+)
 
 
 class DummyRedis:
@@ -36,6 +46,12 @@ redis_asyncio.from_url = from_url
 os.environ['OPENAI_API_KEY'] = 'test'
 
 
+@pytest.fixture(autouse=True)
+def no_exempt_paths(monkeypatch):
+  # Most tests here drive the limiter through /health.
+  monkeypatch.setattr('backend.main.RATE_LIMIT_EXEMPT_PATHS', frozenset())
+
+
 class TimeStub:
   def __init__(self):
     self.now = 0
@@ -220,10 +236,32 @@ def test_timestamp_cleanup(monkeypatch):
   asyncio.run(_run())
 
 
+class FakePipeline:
+  def __init__(self, redis):
+    self.redis = redis
+    self.calls = []
+
+  def __getattr__(self, name):
+    def queue(*args, **kwargs):
+      self.calls.append((name, args, kwargs))
+      return self
+
+    return queue
+
+  async def execute(self):
+    return [
+      await getattr(self.redis, name)(*args, **kwargs)
+      for name, args, kwargs in self.calls
+    ]
+
+
 class FlakyRedis:
   def __init__(self):
     self.fail = True
 
+  def pipeline(self, transaction=True):
+    return FakePipeline(self)
+
   async def zremrangebyscore(self, *args, **kwargs):
     if self.fail:
       raise RuntimeError('down')
@@ -332,7 +370,8 @@ def test_route_specific_rate_limit(monkeypatch):
       resp1 = await client.get('/limited')
       resp2 = await client.get('/limited')
     assert resp1.status_code == 200
-    assert resp1.headers['X-Route-RateLimit-Remaining'] == '0'
+    assert resp1.headers['X-RateLimit-Remaining'] == '0'
+    assert resp1.headers['X-RateLimit-Rule'] == 'limited'
     assert resp2.status_code == 429
 
   asyncio.run(_run())
@@ -372,8 +411,412 @@ def test_rate_limit_wraps_dict_response(monkeypatch):
     ) as client:
       resp = await client.get('/limited-dict')
     assert resp.status_code == 200
-    assert resp.headers['X-Route-RateLimit-Remaining'] == '0'
+    assert resp.headers['X-RateLimit-Remaining'] == '0'
     assert resp.json() == {'ok': True}
 
   asyncio.run(_run())
 
+
+
+def test_fallback_limit_is_split_across_server_processes(monkeypatch):
+  monkeypatch.setattr('backend.middleware.rate_limit.SERVER_PROCESSES', 4)
+  limiter = RedisRateLimiter(DummyRedis(), 100, 60, 300, 1000)
+  assert limiter.fallback_limiter.rate_limit == 25
+  assert RedisRateLimiter(DummyRedis(), 2, 60, 300, 1000).fallback_limiter.rate_limit == 1
+
+
+class SortedSetRedis(FlakyRedis):
+  def __init__(self):
+    self.fail = False
+    self.sets = {}
+    self.counters = {}
+    self.pings = 0
+
+  async def incrby(self, key, amount):
+    self.counters[key] = self.counters.get(key, 0) + amount
+    return self.counters[key]
+
+  async def incr(self, key):
+    return await self.incrby(key, 1)
+
+  async def decr(self, key):
+    return await self.incrby(key, -1)
+
+  async def get(self, key):
+    value = self.counters.get(key)
+    return None if value is None else str(value)
+
+  async def zremrangebyscore(self, key, low, high):
+    members = self.sets.setdefault(key, {})
+    for member, score in list(members.items()):
+      if low <= score <= high:
+        del members[member]
+
+  async def zadd(self, key, mapping):
+    self.sets.setdefault(key, {}).update(mapping)
+
+  async def zcard(self, key):
+    return len(self.sets.get(key, {}))
+
+  async def zrem(self, key, member):
+    self.sets.get(key, {}).pop(member, None)
+
+  async def ping(self):
+    self.pings += 1
+    if self.fail:
+      raise RuntimeError('down')
+    return True
+
+
+def test_redis_limiter_pipelines_and_removes_rejected_entries():
+  async def _run():
+    redis = SortedSetRedis()
+    limiter = RedisRateLimiter(redis, 2, 60, 300, 100)
+    results = [await limiter.record_request('1.1.1.1', float(t)) for t in range(3)]
+    assert results == [(True, 'redis', 1), (True, 'redis', 0), (False, 'redis', 0)]
+    assert sorted(redis.sets['ratelimit:1.1.1.1'].values()) == [0.0, 1.0]
+    assert await limiter.record_request('1.1.1.1', 60.5) == (True, 'redis', 0)
+
+  asyncio.run(_run())
+
+
+def test_recovery_probes_are_throttled_while_redis_is_down():
+  async def _run():
+    redis = SortedSetRedis()
+    redis.fail = True
+    redis.pipeline = lambda transaction=True: (_ for _ in ()).throw(RuntimeError('down'))
+    limiter = RedisRateLimiter(redis, 100, 60, 300, 100)
+    limiter.probe_interval = 1.0
+    for now in (0.0, 0.0, 0.5, 0.9):
+      assert (await limiter.record_request('1.1.1.1', now))[1] == 'memory'
+    assert redis.pings == 1
+    await limiter.record_request('1.1.1.1', 1.0)
+    assert redis.pings == 2
+
+  asyncio.run(_run())
+
+
+def test_rate_limit_rules_parse_from_json():
+  rules = load_rate_limit_rules(
+    '[{"name": "health", "limit": 3, "window": 10, "paths": ["/health"], "methods": ["get"]},'
+    ' {"name": "pdf", "limit": 20, "window": 60}]'
+  )
+  assert rules['health'] == RateLimitRule('health', 3, 10, ('/health',), ('GET',))
+  assert rules['pdf'].paths == ()
+  assert load_rate_limit_rules('') == {}
+  with pytest.raises(RuntimeError):
+    load_rate_limit_rules('[{"name": "broken"}]')
+
+
+def _limited_app(rules):
+  app = create_app(InMemoryRateLimiter(100, 60, 300, 100))
+  app.state.rate_limit_rules = RateLimitRules(rules)
+
+  @app.get('/limited')
+  @rate_limit(limit=1, window=60, key='limited')
+  async def limited_endpoint(request: Request):
+    return {'ok': True}
+
+  return app
+
+
+async def _statuses(app, path, count):
+  async with httpx.AsyncClient(
+    transport=httpx.ASGITransport(app=app, client=('1.1.1.1', 0)),
+    base_url='http://testserver'
+  ) as client:
+    return [await client.get(path) for _ in range(count)]
+
+
+def test_configured_path_rule_and_override_apply_in_one_pass():
+  app = _limited_app({
+    'health': RateLimitRule('health', 1, 60, paths=('/health',)),
+    'limited': RateLimitRule('limited', 2, 60),
+  })
+  health = asyncio.run(_statuses(app, '/health', 2))
+  assert [r.status_code for r in health] == [200, 429]
+  assert health[1].headers['X-RateLimit-Rule'] == 'health'
+
+  limited = asyncio.run(_statuses(app, '/limited', 3))
+  assert [r.status_code for r in limited] == [200, 200, 429]
+  assert limited[0].headers['X-RateLimit-Limit'] == '2'
+
+
+def test_redis_checks_all_rules_in_one_round_trip():
+  class CountingRedis(SortedSetRedis):
+    executions = 0
+
+    def pipeline(self, transaction=True):
+      CountingRedis.executions += 1
+      return FakePipeline(self)
+
+  async def _run():
+    redis = CountingRedis()
+    limiter = RedisRateLimiter(redis, 100, 60, 300, 100)
+    rules = [RateLimitRule('pdf', 1, 60), RateLimitRule('batch', 5, 30)]
+    first = await limiter.check('1.1.1.1', 0.0, rules)
+    assert CountingRedis.executions == 1
+    assert (first.allowed, first.rule, first.remaining) == (True, 'pdf', 0)
+    second = await limiter.check('1.1.1.1', 1.0, rules)
+    assert (second.allowed, second.rule) == (False, 'pdf')
+    assert list(redis.sets['ratelimit:1.1.1.1'].values()) == [0.0]
+    assert list(redis.sets['ratelimit:batch:1.1.1.1'].values()) == [0.0]
+
+  asyncio.run(_run())
+
+
+def test_exempt_paths_skip_the_limiter():
+  limiter = InMemoryRateLimiter(1, 60, 300, 100)
+  app = create_app(limiter, exempt_paths=frozenset({'/health'}))
+  responses = asyncio.run(_statuses(app, '/health', 3))
+  assert [r.status_code for r in responses] == [200, 200, 200]
+  assert 'X-RateLimit-Limit' not in responses[0].headers
+  assert limiter._store == {}
+
+
+def test_hybrid_limiter_decides_locally_and_shares_counts_on_sync():
+  class CountingRedis(SortedSetRedis):
+    executions = 0
+
+    def pipeline(self, transaction=True):
+      CountingRedis.executions += 1
+      return FakePipeline(self)
+
+  async def _run():
+    redis = CountingRedis()
+    first = HybridRateLimiter(redis, 3, 60, 300, 100, sync_interval=3600)
+    second = HybridRateLimiter(redis, 3, 60, 300, 100, sync_interval=3600)
+    assert (await first.check('1.1.1.1', 0.0)).remaining == 2
+    assert (await first.check('1.1.1.1', 0.1)).remaining == 1
+    assert CountingRedis.executions == 0
+
+    await first.sync(0.5)
+    assert CountingRedis.executions == 1
+    assert len(redis.sets['ratelimit:1.1.1.1']) == 2
+    # The second process has not synced yet, so it overshoots by one.
+    assert (await second.check('1.1.1.1', 1.0)).allowed is True
+    await second.sync(1.0)
+    assert len(redis.sets['ratelimit:1.1.1.1']) == 3
+    denied = await second.check('1.1.1.1', 1.5)
+    assert (denied.allowed, denied.store) == (False, 'hybrid')
+    # Denied keys are refreshed without new entries, so the client is let
+    # back in once its entries leave the window.
+    executions = CountingRedis.executions
+    await second.sync(2.0)
+    assert CountingRedis.executions == executions + 1
+    assert (await second.check('1.1.1.1', 2.0)).allowed is False
+    await second.sync(61.0)
+    assert (await second.check('1.1.1.1', 61.0)).allowed is True
+
+  asyncio.run(_run())
+
+
+def test_hybrid_limiter_keeps_local_entries_while_redis_is_down(monkeypatch):
+  monkeypatch.setattr('backend.middleware.rate_limit.SERVER_PROCESSES', 2)
+
+  async def _run():
+    redis = SortedSetRedis()
+    redis.fail = True
+    limiter = HybridRateLimiter(redis, 4, 60, 300, 100, sync_interval=3600)
+    assert (await limiter.check('1.1.1.1', 0.0)).store == 'hybrid'
+    await limiter.sync(0.1)
+    assert limiter.fallback_active is True
+    fallback = await limiter.check('1.1.1.1', 0.2)
+    assert (fallback.store, fallback.limit, fallback.remaining) == ('memory', 2, 0)
+    assert (await limiter.check('1.1.1.1', 0.3)).allowed is False
+
+    redis.fail = False
+    await limiter.sync(1.5)
+    assert limiter.fallback_active is False
+    assert len(redis.sets['ratelimit:1.1.1.1']) == 2
+
+  asyncio.run(_run())
+
+
+def test_hybrid_limiter_syncs_in_the_background_and_flushes_on_close():
+  async def _run():
+    redis = SortedSetRedis()
+    limiter = HybridRateLimiter(redis, 100, 60, 300, 100, sync_interval=0.001)
+    await limiter.check('1.1.1.1', time.time())
+    await asyncio.sleep(0.05)
+    assert len(redis.sets['ratelimit:1.1.1.1']) == 1
+
+    await limiter.check('1.1.1.1', time.time())
+    await limiter.close()
+    assert len(redis.sets['ratelimit:1.1.1.1']) == 2
+    assert limiter._sync_task is None
+
+  asyncio.run(_run())
+
+
+def test_hybrid_limiter_counts_entries_while_their_sync_is_in_flight():
+  class SlowPipeline(FakePipeline):
+    async def execute(self):
+      await asyncio.sleep(0.05)
+      return await super().execute()
+
+  class SlowRedis(SortedSetRedis):
+    def pipeline(self, transaction=True):
+      return SlowPipeline(self)
+
+  async def _run():
+    limiter = HybridRateLimiter(SlowRedis(), 5, 60, 300, 100, sync_interval=3600)
+    for _ in range(5):
+      assert (await limiter.check('1.1.1.1', 0.0)).allowed is True
+    sync = asyncio.create_task(limiter.sync(0.0))
+    await asyncio.sleep(0.01)
+    assert (await limiter.check('1.1.1.1', 0.01)).allowed is False
+    await sync
+    assert (await limiter.check('1.1.1.1', 0.1)).allowed is False
+
+  asyncio.run(_run())
+
+
+def test_hybrid_limiter_sync_loop_sleeps_while_idle():
+  syncs = []
+
+  async def _run():
+    limiter = HybridRateLimiter(SortedSetRedis(), 100, 60, 300, 100, sync_interval=0.001)
+    sync = limiter.sync
+    limiter.sync = lambda now: syncs.append(now) or sync(now)
+    await limiter.check('1.1.1.1', time.time())
+    await asyncio.sleep(0.05)
+    assert len(syncs) == 1
+    await limiter.check('1.1.1.1', time.time())
+    await asyncio.sleep(0.05)
+    assert len(syncs) == 2
+    limiter._sync_task.cancel()
+
+  asyncio.run(_run())
+
+
+def _sample(name, labels):
+  return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_middleware_records_decisions_and_check_latency():
+  allowed = {'outcome': 'allowed', 'store': 'memory', 'rule': 'global'}
+  denied = {**allowed, 'outcome': 'denied'}
+  checks = {'store': 'memory'}
+  before = (
+    _sample('rate_limit_decisions_total', allowed),
+    _sample('rate_limit_decisions_total', denied),
+    _sample('rate_limit_check_duration_seconds_count', checks),
+  )
+  app = create_app(InMemoryRateLimiter(1, 60, 300, 100))
+  asyncio.run(_statuses(app, '/health', 2))
+  assert _sample('rate_limit_decisions_total', allowed) == before[0] + 1
+  assert _sample('rate_limit_decisions_total', denied) == before[1] + 1
+  assert _sample('rate_limit_check_duration_seconds_count', checks) == before[2] + 2
+  assert _sample('rate_limit_tracked_keys', {'limiter': 'memory'}) == 1
+
+
+def test_fallback_transitions_are_counted_once_per_switch():
+  to_memory = {'to': 'memory'}
+  to_redis = {'to': 'redis'}
+  failed_syncs = {'outcome': 'error'}
+  before = (
+    _sample('rate_limit_fallback_transitions_total', to_memory),
+    _sample('rate_limit_fallback_transitions_total', to_redis),
+    _sample('rate_limit_sync_duration_seconds_count', failed_syncs),
+  )
+
+  async def _run():
+    redis = SortedSetRedis()
+    redis.pipeline = lambda transaction=True: (_ for _ in ()).throw(RuntimeError('down'))
+    limiter = HybridRateLimiter(redis, 100, 60, 300, 100, sync_interval=3600)
+    for now in (0.0, 1.0):
+      await limiter.check('1.1.1.1', now)
+      await limiter.sync(now)
+    del redis.pipeline
+    await limiter.sync(2.0)
+    assert _sample('rate_limit_tracked_keys', {'limiter': 'hybrid'}) == 1
+
+  asyncio.run(_run())
+  assert _sample('rate_limit_fallback_transitions_total', to_memory) == before[0] + 1
+  assert _sample('rate_limit_fallback_transitions_total', to_redis) == before[1] + 1
+  assert _sample('rate_limit_sync_duration_seconds_count', failed_syncs) == before[2] + 2
+
+
+def test_log_members_are_unique_within_one_timestamp():
+  async def _run():
+    redis = SortedSetRedis()
+    limiter = RedisRateLimiter(redis, 100, 60, 300, 100, algorithm='log')
+    for _ in range(3):
+      await limiter.check('1.1.1.1', 5.0)
+    assert len(redis.sets['ratelimit:1.1.1.1']) == 3
+
+  asyncio.run(_run())
+
+
+def test_counter_limiter_uses_two_buckets_and_undoes_rejections():
+  async def _run():
+    redis = SortedSetRedis()
+    limiter = RedisRateLimiter(redis, 3, 60, 300, 100, algorithm='counter')
+    results = [(await limiter.check('1.1.1.1', 10.0)).allowed for _ in range(4)]
+    assert results == [True, True, True, False]
+    assert redis.counters == {'ratelimit:1.1.1.1:0': 3}
+    assert redis.sets == {}
+    # A quarter into the next window, three quarters of the old count remain.
+    decision = await limiter.check('1.1.1.1', 75.0)
+    assert (decision.allowed, decision.remaining) == (True, 0)
+    assert (await limiter.check('1.1.1.1', 75.0)).allowed is False
+    assert (await limiter.check('1.1.1.1', 105.0)).allowed is True
+
+  asyncio.run(_run())
+
+
+def _counter_error(timestamps, window=60):
+  """Largest gap between the counter estimate and the exact log count."""
+  async def _run():
+    redis = SortedSetRedis()
+    exact = RedisRateLimiter(redis, 10**6, window, 300, 100, algorithm='log')
+    approx = RedisRateLimiter(redis, 10**6, window, 300, 100, algorithm='counter')
+    worst = 0
+    for now in timestamps:
+      logged = await exact.check('1.1.1.1', now)
+      estimated = await approx.check('1.1.1.1', now)
+      worst = max(worst, abs(logged.remaining - estimated.remaining))
+    return worst
+
+  return asyncio.run(_run())
+
+
+def test_counter_estimate_tracks_the_exact_log_for_steady_traffic():
+  assert _counter_error([t * 0.5 for t in range(1200)]) <= 1
+
+
+def test_counter_estimate_error_is_bounded_for_bursty_traffic():
+  import random
+
+  rng = random.Random(7)
+  now, timestamps = 0.0, []
+  while now < 600:
+    # Bursts of 5-30 requests separated by pauses of up to 20 seconds.
+    timestamps += [now + i * 0.01 for i in range(rng.randint(5, 30))]
+    now += rng.uniform(1, 20)
+  peak = max(
+    sum(1 for t in timestamps if end - 60 < t <= end) for end in timestamps
+  )
+  assert _counter_error(timestamps) <= 0.25 * peak
+
+
+def test_hybrid_limiter_syncs_counters():
+  async def _run():
+    redis = SortedSetRedis()
+    first = HybridRateLimiter(
+      redis, 2, 60, 300, 100, sync_interval=3600, algorithm='counter'
+    )
+    second = HybridRateLimiter(
+      redis, 2, 60, 300, 100, sync_interval=3600, algorithm='counter'
+    )
+    await first.check('1.1.1.1', 59.0)
+    await first.check('1.1.1.1', 61.0)
+    await first.sync(61.0)
+    assert redis.counters == {'ratelimit:1.1.1.1:0': 1, 'ratelimit:1.1.1.1:1': 1}
+    await second.check('1.1.1.1', 61.5)
+    await second.sync(62.0)
+    assert (await second.check('1.1.1.1', 62.0)).allowed is False
+    assert redis.sets == {}
+
+  asyncio.run(_run())
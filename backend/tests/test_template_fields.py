@@ -0,0 +1,99 @@
+import os
+
+import pytest
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import (
+  ArrayObject,
+  DictionaryObject,
+  NameObject,
+  TextStringObject,
+)
+
+os.environ["OPENAI_API_KEY"] = "test"
+
+from backend.services import template_service
+from backend.services.pdf_service import _fill_fields
+from backend.services.template_service import (
+  FIELD_MAP,
+  FieldLocation,
+  field_index,
+  get_template_file,
+  validate_templates,
+)
+
+
+def _template(path, names, parent=None):
+  """Write a one-page form with a text widget per name."""
+  writer = PdfWriter()
+  writer.add_blank_page(width=612, height=792)
+  annots = ArrayObject()
+  for name in names:
+    annots.append(writer._add_object(DictionaryObject({
+      NameObject("/T"): TextStringObject(name),
+      NameObject("/FT"): NameObject("/Tx"),
+      NameObject("/Subtype"): NameObject("/Widget"),
+    })))
+  if parent:
+    field = writer._add_object(DictionaryObject({
+      NameObject("/T"): TextStringObject(parent),
+      NameObject("/FT"): NameObject("/Tx"),
+    }))
+    annots.append(writer._add_object(DictionaryObject({
+      NameObject("/Parent"): field,
+      NameObject("/Subtype"): NameObject("/Widget"),
+    })))
+  writer.pages[0][NameObject("/Annots")] = annots
+  with open(path, "wb") as f:
+    writer.write(f)
+  return path
+
+
+def test_bundled_templates_index_every_mapped_field():
+  validate_templates()
+  index = field_index(get_template_file("General"))
+  assert set(index) == set(FIELD_MAP.values())
+  assert index["CaseNumber"] == (FieldLocation(page=0, annotation=0),)
+  assert index["RespondentName"] == (FieldLocation(page=0, annotation=6),)
+
+
+def test_template_missing_a_field_fails_validation(monkeypatch, tmp_path):
+  names = [n for n in FIELD_MAP.values() if n not in ("HearingDate", "PetitionerEmail")]
+  _template(tmp_path / "tx_general.pdf", names)
+  monkeypatch.setattr(template_service, "FORMS_DIR", tmp_path)
+  monkeypatch.setattr(template_service, "TEMPLATE_CHECKSUMS", {})
+  monkeypatch.setattr(template_service, "COUNTY_TEMPLATES", {"General": "tx_general.pdf"})
+  with pytest.raises(RuntimeError, match="HearingDate, PetitionerEmail"):
+    validate_templates()
+
+
+def test_field_only_on_a_parent_counts_as_missing(monkeypatch, tmp_path):
+  # PdfWriter drops /Parent when copying pages, so such a field never fills.
+  names = [n for n in FIELD_MAP.values() if n != "RespondentName"]
+  path = _template(tmp_path / "kids.pdf", names, parent="RespondentName")
+  monkeypatch.setattr(template_service, "FORMS_DIR", tmp_path)
+  with pytest.raises(RuntimeError, match="kids.pdf is missing form fields: RespondentName"):
+    field_index(path)
+
+
+def test_fill_sets_values_on_indexed_widgets(monkeypatch, tmp_path):
+  names = list(FIELD_MAP.values()) + ["CaseNumber"]
+  path = _template(tmp_path / "repeated.pdf", names)
+  monkeypatch.setattr(template_service, "FORMS_DIR", tmp_path)
+  index = field_index(path)
+  assert index["CaseNumber"] == (FieldLocation(0, 0), FieldLocation(0, len(names) - 1))
+
+  writer = PdfWriter()
+  for page in PdfReader(path).pages:
+    writer.add_page(page)
+  _fill_fields(writer, index, {"CaseNumber": "123", "RespondentName": "John Doe"})
+  values = {
+    position: ref.get_object().get("/V")
+    for position, ref in enumerate(writer.pages[0]["/Annots"])
+  }
+  assert values[0] == values[len(names) - 1] == "123"
+  assert values[6] == "John Doe"
+  assert values[1] is None
+  form = writer._root_object["/AcroForm"]
+  assert form["/NeedAppearances"]
+  assert [ref.get_object()["/T"] for ref in form["/Fields"]] == names
+
@@ -0,0 +1,55 @@
+import os
+import asyncio
+
+import httpx
+
+os.environ["OPENAI_API_KEY"] = "test"
+os.environ["CHAT_API_KEY"] = "test-key"
+
+from backend.main import app
+from backend.services import warmup
+from backend.services.pdf_service import packet_cache
+
+
+def _get(path):
+  async def _run():
+    async with httpx.AsyncClient(
+      transport=httpx.ASGITransport(app=app, client=("10.0.40.1", 0)),
+      base_url="http://testserver",
+    ) as client:
+      return await client.get(path)
+
+  return asyncio.run(_run())
+
+
+def test_ready_is_gated_on_warmup(monkeypatch):
+  monkeypatch.setattr(warmup, "_ready", False)
+  rendered = []
+  monkeypatch.setattr(warmup, "prerender", rendered.append)
+
+  assert _get("/ready").status_code == 503
+  assert _get("/health").status_code == 200
+
+  asyncio.run(warmup.warm_up())
+  resp = _get("/ready")
+  assert resp.status_code == 200
+  assert resp.json() == {"status": "ready"}
+  assert rendered == ["Harris", "Dallas", "Travis", "General"]
+
+
+def test_failed_warmup_still_reports_ready(monkeypatch):
+  monkeypatch.setattr(warmup, "_ready", False)
+
+  def broken(county):
+    raise RuntimeError("bad template")
+
+  monkeypatch.setattr(warmup, "prerender", broken)
+  asyncio.run(warmup.warm_up())
+  assert warmup.is_ready()
+
+
+def test_prerender_renders_real_packets_without_caching():
+  from backend.services.pdf_service import prerender
+
+  prerender("Harris")
+  assert len(packet_cache) == 0
@@ -1,13 +1,20 @@
 import asyncio
+import threading
+import time
 import pytest
 from fastapi import HTTPException
 
-from backend.worker import WorkerQueue
+from backend.worker import (
+  PRIORITY_HIGH,
+  PRIORITY_LOW,
+  SingleFlight,
+  WorkerQueue,
+)
+from backend.utils.cancellation import check_cancelled, current_token
 
 
 def test_excessive_enqueues_rejected():
-  queue = WorkerQueue()
-  queue._queue = asyncio.Queue(maxsize=1)
+  queue = WorkerQueue(maxsize=1)
   queue._worker_started = True
 
   async def dummy():
@@ -20,3 +27,340 @@ def test_excessive_enqueues_rejected():
     assert exc.value.status_code == 503
 
   asyncio.run(run())
+
+
+def test_worker_skips_cancelled_jobs():
+  queue = WorkerQueue()
+  calls = []
+
+  async def job(name):
+    calls.append(name)
+    return name
+
+  async def run():
+    cancelled = await queue.enqueue(job, "cancelled")
+    kept = await queue.enqueue(job, "kept")
+    cancelled.cancel()
+    assert await kept == "kept"
+
+  asyncio.run(run())
+  assert calls == ["kept"]
+
+
+def test_single_flight_shares_one_render():
+  flights = SingleFlight()
+  starts = []
+
+  async def run():
+    gate = asyncio.get_running_loop().create_future()
+
+    async def start():
+      starts.append(1)
+      return gate
+
+    waiters = [asyncio.create_task(flights.run("key", start)) for _ in range(3)]
+    await asyncio.sleep(0)
+    assert flights.in_flight("key")
+    gate.set_result("packet")
+    assert await asyncio.gather(*waiters) == ["packet"] * 3
+    assert not flights.in_flight("key")
+
+  asyncio.run(run())
+  assert len(starts) == 1
+
+
+def test_single_flight_does_not_cache_errors():
+  flights = SingleFlight()
+  attempts = []
+
+  async def run():
+    async def start():
+      attempts.append(1)
+      future = asyncio.get_running_loop().create_future()
+      if len(attempts) == 1:
+        future.set_exception(RuntimeError("boom"))
+      else:
+        future.set_result("packet")
+      return future
+
+    with pytest.raises(RuntimeError):
+      await flights.run("key", start)
+    assert await flights.run("key", start) == "packet"
+
+  asyncio.run(run())
+  assert len(attempts) == 2
+
+
+def test_single_flight_cancels_render_only_when_all_waiters_leave():
+  flights = SingleFlight()
+
+  async def run():
+    gate = asyncio.get_running_loop().create_future()
+
+    async def start():
+      return gate
+
+    first = asyncio.create_task(flights.run("key", start))
+    second = asyncio.create_task(flights.run("key", start))
+    await asyncio.sleep(0)
+
+    first.cancel()
+    await asyncio.sleep(0)
+    assert not gate.cancelled()
+
+    second.cancel()
+    await asyncio.gather(first, second, return_exceptions=True)
+    await asyncio.sleep(0)
+    assert gate.cancelled()
+    assert not flights.in_flight("key")
+
+  asyncio.run(run())
+
+
+def test_single_flight_restarts_when_starter_is_cancelled():
+  flights = SingleFlight()
+  starts = []
+
+  async def run():
+    loop = asyncio.get_running_loop()
+    slot = asyncio.Event()
+
+    async def start():
+      starts.append(1)
+      if len(starts) == 1:
+        # The first caller is still waiting for a queue slot.
+        await slot.wait()
+      future = loop.create_future()
+      future.set_result("packet")
+      return future
+
+    first = asyncio.create_task(flights.run("key", start))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(flights.run("key", start))
+    await asyncio.sleep(0)
+    first.cancel()
+    with pytest.raises(asyncio.CancelledError):
+      await first
+    assert await second == "packet"
+
+  asyncio.run(run())
+  assert len(starts) == 2
+
+
+def test_single_flight_does_not_share_start_errors():
+  flights = SingleFlight()
+  starts = []
+
+  async def run():
+    loop = asyncio.get_running_loop()
+    capped = asyncio.Event()
+
+    async def start():
+      starts.append(1)
+      if len(starts) == 1:
+        await capped.wait()
+        raise HTTPException(status_code=429, detail="Too many pending PDF jobs")
+      future = loop.create_future()
+      future.set_result("packet")
+      return future
+
+    first = asyncio.create_task(flights.run("key", start))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(flights.run("key", start))
+    await asyncio.sleep(0)
+    capped.set()
+    with pytest.raises(HTTPException):
+      await first
+    assert await second == "packet"
+
+  asyncio.run(run())
+  assert len(starts) == 2
+
+
+def test_single_flight_joiner_leaving_during_start_keeps_render():
+  flights = SingleFlight()
+
+  async def run():
+    loop = asyncio.get_running_loop()
+    slot = asyncio.Event()
+    render = loop.create_future()
+
+    async def start():
+      await slot.wait()
+      return render
+
+    first = asyncio.create_task(flights.run("key", start))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(flights.run("key", start))
+    await asyncio.sleep(0)
+    second.cancel()
+    await asyncio.gather(second, return_exceptions=True)
+    slot.set()
+    await asyncio.sleep(0)
+    render.set_result("packet")
+    assert await first == "packet"
+
+  asyncio.run(run())
+
+
+def test_round_robin_across_clients_and_priorities():
+  queue = WorkerQueue(maxsize=10)
+  queue._worker_started = True
+  order = []
+
+  async def job(name):
+    order.append(name)
+
+  async def run():
+    for i in range(3):
+      await queue.enqueue(job, f"heavy-{i}", client="heavy")
+    await queue.enqueue(job, "light-0", client="light")
+    await queue.enqueue(job, "batch-0", client="light", priority=PRIORITY_LOW)
+    await queue.enqueue(job, "urgent-0", client="other", priority=PRIORITY_HIGH)
+    queue._worker_started = False
+    await queue._start_worker()
+    while queue.qsize():
+      await asyncio.sleep(0)
+    await asyncio.sleep(0)
+
+  asyncio.run(run())
+  assert order == ["urgent-0", "heavy-0", "light-0", "heavy-1", "heavy-2", "batch-0"]
+
+
+def test_per_client_cap_rejects_with_429():
+  queue = WorkerQueue(maxsize=10, max_per_client=2)
+  queue._worker_started = True
+
+  async def dummy():
+    return None
+
+  async def run():
+    await queue.enqueue(dummy, client="a")
+    await queue.enqueue(dummy, client="a")
+    with pytest.raises(HTTPException) as exc:
+      await queue.enqueue(dummy, client="a")
+    assert exc.value.status_code == 429
+    await queue.enqueue(dummy, client="b")
+
+  asyncio.run(run())
+
+
+def _abandoned(reason, stage):
+  from prometheus_client import REGISTRY
+
+  return REGISTRY.get_sample_value(
+    "pdf_jobs_abandoned_total", {"reason": reason, "stage": stage}
+  ) or 0
+
+
+def test_expired_job_is_not_run():
+  queue = WorkerQueue()
+  calls = []
+  before = _abandoned("deadline", "queued")
+
+  async def job():
+    calls.append(1)
+
+  async def run():
+    future = await queue.enqueue(job, deadline=time.monotonic() - 1)
+    with pytest.raises(HTTPException) as exc:
+      await future
+    assert exc.value.status_code == 504
+
+  asyncio.run(run())
+  assert calls == []
+  assert _abandoned("deadline", "queued") == before + 1
+
+
+def test_cancelled_render_stops_between_stages():
+  queue = WorkerQueue()
+  stages = []
+  before = _abandoned("cancelled", "render")
+
+  def render(started):
+    stages.append("first")
+    started.set()
+    while current_token.get().reason is None:
+      time.sleep(0.001)
+    check_cancelled()
+    stages.append("second")
+
+  async def job(started):
+    await asyncio.to_thread(render, started)
+
+  async def run():
+    started = threading.Event()
+    future = await queue.enqueue(job, started)
+    await asyncio.to_thread(started.wait)
+    future.cancel()
+    while _abandoned("cancelled", "render") == before:
+      await asyncio.sleep(0.001)
+
+  asyncio.run(run())
+  assert stages == ["first"]
+
+
+def test_drain_finishes_queued_work_and_refuses_new_jobs():
+  queue = WorkerQueue()
+
+  async def job(value):
+    await asyncio.sleep(0.01)
+    return value
+
+  async def run():
+    futures = [await queue.enqueue(job, i) for i in range(3)]
+    failed = await queue.drain(timeout=5)
+    assert failed == 0
+    assert [f.result() for f in futures] == [0, 1, 2]
+    with pytest.raises(HTTPException) as exc:
+      await queue.enqueue(job, 4)
+    assert exc.value.status_code == 503
+    with pytest.raises(HTTPException):
+      await queue.submit(job, 5)
+
+  asyncio.run(run())
+
+
+def test_drain_timeout_fails_remaining_jobs_with_503():
+  queue = WorkerQueue()
+  before = _abandoned("shutdown", "queued")
+
+  async def stuck():
+    await asyncio.Event().wait()
+
+  async def run():
+    running = await queue.enqueue(stuck)
+    queued = await queue.enqueue(stuck)
+    await asyncio.sleep(0)
+    failed = await queue.drain(timeout=0.01)
+    assert failed == 2
+    for future in (running, queued):
+      with pytest.raises(HTTPException) as exc:
+        await future
+      assert exc.value.status_code == 503
+      assert exc.value.headers["Retry-After"] == "1"
+
+  asyncio.run(run())
+  assert _abandoned("shutdown", "queued") == before + 1
+
+
+def test_close_refuses_new_work_but_keeps_queued_jobs():
+  queue = WorkerQueue(maxsize=1)
+
+  async def job(value):
+    await asyncio.sleep(0.01)
+    return value
+
+  async def run():
+    queued = await queue.enqueue(job, "queued")
+    waiting = asyncio.create_task(queue.submit(job, "waiting"))
+    await asyncio.sleep(0)
+    await queue.close()
+    with pytest.raises(HTTPException) as exc:
+      await waiting
+    assert exc.value.status_code == 503
+    with pytest.raises(HTTPException):
+      await queue.enqueue(job, "late")
+    assert await queued == "queued"
+
+  asyncio.run(run())
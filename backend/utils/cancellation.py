@@ -0,0 +1,42 @@
+import threading
+import time
+from contextvars import ContextVar
+
+
+class JobCancelled(Exception):
+  def __init__(self, reason: str) -> None:
+    super().__init__(reason)
+    self.reason = reason
+
+
+class CancelToken:
+  def __init__(self, deadline: float | None = None) -> None:
+    self.deadline = deadline
+    self._cancelled = threading.Event()
+
+  def cancel(self) -> None:
+    self._cancelled.set()
+
+  @property
+  def reason(self) -> str | None:
+    if self._cancelled.is_set():
+      return "cancelled"
+    if self.deadline is not None and time.monotonic() >= self.deadline:
+      return "deadline"
+    return None
+
+  def raise_if_cancelled(self) -> None:
+    reason = self.reason
+    if reason is not None:
+      raise JobCancelled(reason)
+
+
+# Set by the worker for the job it is running. asyncio.to_thread copies the
+# context, so render code running in a thread can poll it between stages.
+current_token: ContextVar[CancelToken | None] = ContextVar("current_token", default=None)
+
+
+def check_cancelled() -> None:
+  token = current_token.get()
+  if token is not None:
+    token.raise_if_cancelled()
@@ -0,0 +1,37 @@
+import os
+from pathlib import Path
+
+from prometheus_client import CollectorRegistry, generate_latest, multiprocess
+
+# prometheus_client picks its value storage when the first metric is created,
+# so PROMETHEUS_MULTIPROC_DIR must be set in the environment before the
+# server (and every worker process) starts.
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+
+def multiprocess_dir() -> Path | None:
+  raw = os.getenv(MULTIPROC_DIR_ENV)
+  return Path(raw) if raw else None
+
+
+def clear_multiprocess_dir() -> None:
+  path = multiprocess_dir()
+  if path is None:
+    return
+  path.mkdir(parents=True, exist_ok=True)
+  for db_file in path.glob("*.db"):
+    db_file.unlink()
+
+
+def render_metrics() -> bytes:
+  if multiprocess_dir() is None:
+    return generate_latest()
+  registry = CollectorRegistry()
+  multiprocess.MultiProcessCollector(registry)
+  return generate_latest(registry)
+
+
+def mark_worker_exit(pid: int | None = None) -> None:
+  if multiprocess_dir() is None:
+    return
+  multiprocess.mark_process_dead(pid or os.getpid())
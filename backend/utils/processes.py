@@ -0,0 +1,6 @@
+import os
+
+# Number of server processes sharing this machine, set by
+# backend/gunicorn_conf.py. State held in process memory (the PDF queue,
+# caches, job store and rate-limiter fallback) is not shared between them.
+SERVER_PROCESSES = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
@@ -1,7 +1,8 @@
 import re
+from functools import cache
+from types import ModuleType
 from urllib.parse import urlparse
 
-import bleach
 from pydantic import BaseModel, field_validator
 
 from .validation import MAX_FIELD_LENGTH
@@ -12,8 +13,16 @@ DISALLOWED_PATTERNS = [
 ]
 
 
+@cache
+def _bleach() -> ModuleType:
+  # bleach pulls in html5lib, which is slow to import; defer it to first use.
+  import bleach
+
+  return bleach
+
+
 def sanitize_string(value: str) -> str:
-  cleaned = bleach.clean(value, tags=[], attributes={}, strip=True)
+  cleaned = _bleach().clean(value, tags=[], attributes={}, strip=True)
   cleaned = re.sub(r"[\x00-\x1f\x7f-\x9f]", "", cleaned)
   cleaned = re.sub(r"(javascript:|data:)", "", cleaned, flags=re.IGNORECASE)
   return cleaned.strip()[:MAX_FIELD_LENGTH]
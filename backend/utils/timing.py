@@ -0,0 +1,26 @@
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from prometheus_client import Histogram
+
+
+class StageTimer:
+  def __init__(self) -> None:
+    self.timings: dict[str, float] = {}
+
+  @contextmanager
+  def stage(self, name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      elapsed = time.perf_counter() - start
+      self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+  def observe(self, histogram: Histogram, **labels: str) -> None:
+    for name, duration in self.timings.items():
+      histogram.labels(stage=name, **labels).observe(duration)
+
+  def as_ms(self) -> dict[str, float]:
+    return {name: round(duration * 1000, 3) for name, duration in self.timings.items()}
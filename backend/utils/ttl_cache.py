@@ -0,0 +1,68 @@
+import time
+from collections import OrderedDict
+from typing import Generic, TypeVar
+
+V = TypeVar("V")
+
+
+class BoundedTTLCache(Generic[V]):
+  def __init__(self, ttl: float, max_entries: int, max_bytes: int) -> None:
+    self.ttl = ttl
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self._store: OrderedDict[str, tuple[float, int, V]] = OrderedDict()
+    self._bytes = 0
+
+  def __len__(self) -> int:
+    return len(self._store)
+
+  @property
+  def total_bytes(self) -> int:
+    return self._bytes
+
+  def get(self, key: str, now: float | None = None) -> V | None:
+    now = time.monotonic() if now is None else now
+    entry = self._store.get(key)
+    if entry is None:
+      return None
+    expires_at, _, value = entry
+    if expires_at <= now:
+      self._remove(key)
+      return None
+    self._store.move_to_end(key)
+    return value
+
+  def set(self, key: str, value: V, size: int, now: float | None = None) -> bool:
+    now = time.monotonic() if now is None else now
+    if size > self.max_bytes:
+      return False
+    self._remove(key)
+    self.expire(now)
+    self._store[key] = (now + self.ttl, size, value)
+    self._bytes += size
+    while len(self._store) > self.max_entries or self._bytes > self.max_bytes:
+      oldest = next(iter(self._store))
+      self._remove(oldest)
+    return True
+
+  def pop(self, key: str) -> V | None:
+    entry = self._store.get(key)
+    if entry is None:
+      return None
+    self._remove(key)
+    return entry[2]
+
+  def expire(self, now: float | None = None) -> None:
+    now = time.monotonic() if now is None else now
+    for key, (expires_at, _, _) in list(self._store.items()):
+      if expires_at <= now:
+        self._remove(key)
+
+  def clear(self) -> None:
+    self._store.clear()
+    self._bytes = 0
+
+  def _remove(self, key: str) -> None:
+    entry = self._store.pop(key, None)
+    if entry is not None:
+      self._bytes -= entry[1]
@@ -1,14 +1,22 @@
 import json
 import os
 from pathlib import Path
+from typing import TYPE_CHECKING
 from urllib.parse import urlparse
 
+if TYPE_CHECKING:
+  from jsonschema.protocols import Validator
+
 
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 SCHEMA_PATH = Path(os.getenv("SCHEMA_PATH", BASE_DIR / "schema" / "petition.schema.json"))
 MAX_REQUEST_SIZE = 10_000
 MAX_FIELD_LENGTH = 1_000
 MAX_HISTORY_MESSAGES = 20
+MAX_BATCH_PETITIONS = 10
+# Each batch item may be as large as a single /api/pdf request.
+MAX_BATCH_REQUEST_SIZE = MAX_BATCH_PETITIONS * MAX_REQUEST_SIZE
+MAX_BATCH_OUTPUT_BYTES = 20 * 1024 * 1024
 DEFAULT_ALLOWED_ORIGINS = ["http://localhost:5173"]
 
 
@@ -18,11 +26,25 @@ def load_schema() -> dict:
 
 
 PETITION_SCHEMA: dict = load_schema()
+_petition_validator: "Validator | None" = None
 
 
 def reload_schema() -> None:
-  global PETITION_SCHEMA
+  global PETITION_SCHEMA, _petition_validator
   PETITION_SCHEMA = load_schema()
+  _petition_validator = None
+
+
+def petition_validator() -> "Validator":
+  """Return a validator for ``PETITION_SCHEMA``, compiled on first use."""
+  global _petition_validator
+  if _petition_validator is None:
+    from jsonschema import FormatChecker
+    from jsonschema.validators import validator_for
+
+    cls = validator_for(PETITION_SCHEMA)
+    _petition_validator = cls(PETITION_SCHEMA, format_checker=FormatChecker())
+  return _petition_validator
 
 
 def get_allowed_origins() -> list[str]:
@@ -1,36 +1,389 @@
 import asyncio
-from typing import Any, Awaitable, Callable
+import os
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Hashable
 
+import structlog
 from fastapi import HTTPException
+from prometheus_client import Counter, Gauge, Histogram
 
+from .services.admission import QueueAdmission, pdf_admission
+from .utils.cancellation import CancelToken, JobCancelled, current_token
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+PDF_MAX_PER_CLIENT = int(os.getenv("PDF_MAX_PER_CLIENT", "10"))
+PDF_DRAIN_TIMEOUT = float(os.getenv("PDF_DRAIN_TIMEOUT", "10"))
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+PRIORITIES = (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)
+
+PDF_QUEUE_DEPTH = Gauge(
+  "pdf_queue_depth",
+  "Jobs waiting in the PDF worker queue",
+  multiprocess_mode="livesum",
+)
+PDF_CLIENT_CAP_REJECTIONS = Counter(
+  "pdf_queue_client_cap_rejections_total",
+  "PDF jobs rejected because the client already had too many in flight",
+)
+PDF_JOBS_ABANDONED = Counter(
+  "pdf_jobs_abandoned_total",
+  "PDF jobs dropped because they were cancelled or missed their deadline",
+  ["reason", "stage"],
+)
+PDF_DRAIN_SECONDS = Histogram(
+  "pdf_queue_drain_seconds",
+  "Time spent draining the PDF worker queue on shutdown",
+)
+
+logger = structlog.get_logger(__name__)
+
+
+def _abandoned_error(reason: str) -> HTTPException:
+  if reason == "deadline":
+    return HTTPException(status_code=504, detail="PDF generation timed out")
+  return HTTPException(status_code=499, detail="PDF generation cancelled")
+
+
+def shutdown_error() -> HTTPException:
+  return HTTPException(
+    status_code=503,
+    detail="Server shutting down",
+    headers={"Retry-After": "1"},
+  )
+
+
+@dataclass
+class _Job:
+  func: Callable[..., Awaitable[Any]]
+  args: tuple
+  kwargs: dict
+  future: asyncio.Future
+  client: str
+  priority: int
+  token: CancelToken
+  enqueued_at: float = field(default_factory=time.monotonic)
+
+
+# Jobs are served by strict priority class and, within a class, round-robin
+# across clients, so one client's backlog cannot delay everyone else.
 class WorkerQueue:
-  def __init__(self, maxsize: int = 100) -> None:
-    self._queue: asyncio.Queue[tuple[Callable[..., Awaitable[Any]], tuple, dict, asyncio.Future]] = asyncio.Queue(maxsize=maxsize)
+  def __init__(
+    self,
+    maxsize: int = 100,
+    workers: int = 1,
+    max_per_client: int | None = None,
+    admission: QueueAdmission | None = None,
+  ) -> None:
+    self.maxsize = maxsize
+    self.workers = workers
+    self.max_per_client = max_per_client or maxsize
+    self.admission = admission
+    self._classes: dict[int, OrderedDict[str, deque[_Job]]] = {
+      priority: OrderedDict() for priority in PRIORITIES
+    }
+    self._size = 0
+    self._in_flight: dict[str, int] = {}
+    self._changed = asyncio.Condition()
     self._worker_started = False
+    self._tasks: list[asyncio.Task] = []
+    self._running: list[_Job] = []
+    self._closing = False
+
+  def qsize(self) -> int:
+    return self._size
+
+  @property
+  def closing(self) -> bool:
+    return self._closing
 
   async def _start_worker(self) -> None:
     if not self._worker_started:
-      asyncio.create_task(self._worker())
+      self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
       self._worker_started = True
 
+  def _pop(self) -> _Job:
+    for priority in PRIORITIES:
+      clients = self._classes[priority]
+      if not clients:
+        continue
+      client, jobs = next(iter(clients.items()))
+      job = jobs.popleft()
+      if jobs:
+        clients.move_to_end(client)
+      else:
+        del clients[client]
+      self._size -= 1
+      PDF_QUEUE_DEPTH.dec()
+      return job
+    raise RuntimeError("pop from an empty WorkerQueue")
+
+  def _push(self, job: _Job) -> None:
+    self._classes[job.priority].setdefault(job.client, deque()).append(job)
+    self._size += 1
+    self._in_flight[job.client] = self._in_flight.get(job.client, 0) + 1
+    PDF_QUEUE_DEPTH.inc()
+
+  def _release(self, client: str) -> None:
+    remaining = self._in_flight.get(client, 0) - 1
+    if remaining > 0:
+      self._in_flight[client] = remaining
+    else:
+      self._in_flight.pop(client, None)
+
+  def _ahead_of(self, priority: int) -> int:
+    return sum(
+      len(jobs)
+      for level in PRIORITIES
+      if level <= priority
+      for jobs in self._classes[level].values()
+    )
+
+  def _has_room(self, client: str) -> bool:
+    return (
+      self._size < self.maxsize
+      and self._in_flight.get(client, 0) < self.max_per_client
+    )
+
   async def _worker(self) -> None:
     while True:
-      func, args, kwargs, future = await self._queue.get()
+      async with self._changed:
+        await self._changed.wait_for(lambda: self._size > 0)
+        job = self._pop()
+        self._running.append(job)
       try:
-        result = await func(*args, **kwargs)
-        future.set_result(result)
-      except Exception as exc:
-        future.set_exception(exc)
-      self._queue.task_done()
+        await self._run(job)
+      finally:
+        async with self._changed:
+          self._running.remove(job)
+          self._release(job.client)
+          self._changed.notify_all()
+
+  async def _run(self, job: _Job) -> None:
+    # Background jobs are expected to wait, so only interactive waits count
+    # towards the sojourn signal used for shedding.
+    if self.admission is not None and job.priority < PRIORITY_LOW:
+      self.admission.record_wait(time.monotonic() - job.enqueued_at)
+    reason = "cancelled" if job.future.cancelled() else job.token.reason
+    if reason is not None:
+      PDF_JOBS_ABANDONED.labels(reason=reason, stage="queued").inc()
+      if not job.future.done():
+        job.future.set_exception(_abandoned_error(reason))
+      return
+    reset = current_token.set(job.token)
+    try:
+      result = await job.func(*job.args, **job.kwargs)
+      if not job.future.done():
+        job.future.set_result(result)
+    except JobCancelled as exc:
+      PDF_JOBS_ABANDONED.labels(reason=exc.reason, stage="render").inc()
+      if not job.future.done():
+        job.future.set_exception(_abandoned_error(exc.reason))
+    except Exception as exc:
+      if not job.future.done():
+        job.future.set_exception(exc)
+    finally:
+      current_token.reset(reset)
+
+  def _new_job(
+    self, func, args, kwargs, client: str, priority: int, deadline: float | None
+  ) -> _Job:
+    if priority not in PRIORITIES:
+      raise ValueError(f"Unknown priority: {priority}")
+    future: asyncio.Future = asyncio.get_running_loop().create_future()
+    token = CancelToken(deadline)
+    future.add_done_callback(lambda f: token.cancel() if f.cancelled() else None)
+    return _Job(func, args, kwargs, future, client, priority, token)
 
-  async def enqueue(self, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> asyncio.Future:
+  async def enqueue(
+    self,
+    func: Callable[..., Awaitable[Any]],
+    *args,
+    client: str = "anon",
+    priority: int = PRIORITY_NORMAL,
+    deadline: float | None = None,
+    **kwargs,
+  ) -> asyncio.Future:
     await self._start_worker()
-    loop = asyncio.get_running_loop()
-    future: asyncio.Future = loop.create_future()
+    job = self._new_job(func, args, kwargs, client, priority, deadline)
+    async with self._changed:
+      if self._closing:
+        raise shutdown_error()
+      if self._size >= self.maxsize:
+        raise HTTPException(status_code=503, detail="Queue full")
+      if self._in_flight.get(client, 0) >= self.max_per_client:
+        PDF_CLIENT_CAP_REJECTIONS.inc()
+        raise HTTPException(status_code=429, detail="Too many pending PDF jobs")
+      if self.admission is not None:
+        shed = self.admission.check(self._ahead_of(priority), self.workers)
+        if shed is not None:
+          raise shed
+      self._push(job)
+      self._changed.notify_all()
+    return job.future
+
+  async def submit(
+    self,
+    func: Callable[..., Awaitable[Any]],
+    *args,
+    client: str = "anon",
+    priority: int = PRIORITY_NORMAL,
+    deadline: float | None = None,
+    **kwargs,
+  ) -> asyncio.Future:
+    await self._start_worker()
+    job = self._new_job(func, args, kwargs, client, priority, deadline)
+    async with self._changed:
+      await self._changed.wait_for(lambda: self._closing or self._has_room(client))
+      if self._closing:
+        raise shutdown_error()
+      self._push(job)
+      self._changed.notify_all()
+    return job.future
+
+  async def close(self) -> None:
+    """Refuse new jobs. Queued and running jobs carry on until ``drain``."""
+    async with self._changed:
+      if self._closing:
+        return
+      self._closing = True
+      self._changed.notify_all()
+      logger.info("pdf queue closed", queued=self._size, running=len(self._running))
+
+  async def drain(self, timeout: float) -> int:
+    """Give queued work ``timeout`` seconds, then fail the rest; returns that count."""
+    started = time.monotonic()
+    async with self._changed:
+      self._closing = True
+      self._changed.notify_all()
+      try:
+        await asyncio.wait_for(
+          self._changed.wait_for(lambda: self._size == 0 and not self._running),
+          timeout,
+        )
+      except asyncio.TimeoutError:
+        pass
+      failed = self._fail_remaining()
+    for task in self._tasks:
+      task.cancel()
+    await asyncio.gather(*self._tasks, return_exceptions=True)
+    elapsed = time.monotonic() - started
+    PDF_DRAIN_SECONDS.observe(elapsed)
+    logger.info(
+      "pdf queue drained",
+      duration_ms=round(elapsed * 1000, 2),
+      failed_jobs=failed,
+    )
+    return failed
+
+  def _fail_remaining(self) -> int:
+    failed = 0
+    while self._size:
+      job = self._pop()
+      self._release(job.client)
+      failed += self._fail_for_shutdown(job, "queued")
+    for job in self._running:
+      job.token.cancel()
+      failed += self._fail_for_shutdown(job, "render")
+    return failed
+
+  def _fail_for_shutdown(self, job: _Job, stage: str) -> int:
+    if job.future.done():
+      return 0
+    PDF_JOBS_ABANDONED.labels(reason="shutdown", stage=stage).inc()
+    job.future.set_exception(shutdown_error())
+    return 1
+
+
+def _chain(source: asyncio.Future, target: asyncio.Future) -> None:
+  if target.done():
+    return
+  if source.cancelled():
+    target.cancel()
+  elif source.exception() is not None:
+    target.set_exception(source.exception())
+  else:
+    target.set_result(source.result())
+
+
+class _Flight:
+  def __init__(self, future: asyncio.Future) -> None:
+    self.future = future
+    self.waiters = 0
+
+
+# Resolves a flight whose starter failed before any render existed. Callers
+# that joined it start over rather than inherit that caller's error.
+_RESTART = object()
+
+
+class SingleFlight:
+  def __init__(self) -> None:
+    self._flights: dict[Hashable, _Flight] = {}
+
+  def in_flight(self, key: Hashable) -> bool:
+    return key in self._flights
+
+  async def run(
+    self, key: Hashable, start: Callable[[], Awaitable[asyncio.Future]]
+  ) -> Any:
+    while True:
+      flight = self._flights.get(key)
+      if flight is None:
+        flight = self._register(key)
+        # The starter counts as a waiter while it queues the render, so a
+        # caller that joins and leaves meanwhile cannot abandon the flight.
+        flight.waiters += 1
+        try:
+          source = await start()
+        except BaseException:
+          # Cancellation, a full queue or the client cap belong to this
+          # caller alone; anyone who joined meanwhile starts a fresh render.
+          self._forget(key, flight)
+          flight.future.set_result(_RESTART)
+          raise
+        finally:
+          flight.waiters -= 1
+        source.add_done_callback(lambda f, flight=flight: _chain(f, flight.future))
+        flight.future.add_done_callback(
+          lambda f, source=source: source.cancel() if f.cancelled() else None
+        )
+      result = await self._wait(key, flight)
+      if result is not _RESTART:
+        return result
+
+  async def _wait(self, key: Hashable, flight: _Flight) -> Any:
+    flight.waiters += 1
     try:
-      self._queue.put_nowait((func, args, kwargs, future))
-    except asyncio.QueueFull as exc:
-      raise HTTPException(status_code=503, detail="Queue full") from exc
-    return future
+      return await asyncio.shield(flight.future)
+    except asyncio.CancelledError:
+      # Only abandon the shared render once every waiter has gone away.
+      if flight.waiters == 1 and not flight.future.done():
+        self._forget(key, flight)
+        flight.future.cancel()
+      raise
+    finally:
+      flight.waiters -= 1
+
+  def _register(self, key: Hashable) -> _Flight:
+    flight = _Flight(asyncio.get_running_loop().create_future())
+    self._flights[key] = flight
+    # Results and errors are only shared with callers already waiting; the
+    # next identical request after completion starts a fresh render.
+    flight.future.add_done_callback(lambda _: self._forget(key, flight))
+    return flight
+
+  def _forget(self, key: Hashable, flight: _Flight) -> None:
+    if self._flights.get(key) is flight:
+      del self._flights[key]
+
 
-queue = WorkerQueue()
+queue = WorkerQueue(
+  workers=PDF_WORKERS,
+  max_per_client=PDF_MAX_PER_CLIENT,
+  admission=pdf_admission,
+)